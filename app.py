@@ -1,13 +1,33 @@
 import streamlit as st
 import pandas as pd
-import openpyxl
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
 from datetime import datetime
-import re
 from io import BytesIO
+import os
+import re
 import warnings
+
+from conciliacion import (
+    AGGREGATE_MAX_CANDIDATES,
+    IncrementalReconciliation,
+    NormalizationCache,
+    RECONCILE_ENGINES,
+    ReconciliationStore,
+    WorkbookCache,
+    process_excel_file,
+    process_excel_file_streaming,
+    read_excel_preview,
+    reconcile,
+    reconcile_multi,
+    match_summary,
+)
+from exportacion import (
+    account_name,
+    add_original_sheets,
+    create_excel_with_format,
+    describe_match,
+    mark_original_workbooks,
+    match_difference,
+)
 warnings.filterwarnings('ignore')
 
 st.set_page_config(
@@ -23,6 +43,8 @@ if 'sheet_names' not in st.session_state:
     st.session_state['sheet_names'] = None
 if 'original_files_data' not in st.session_state:
     st.session_state['original_files_data'] = {}
+if 'accounts' not in st.session_state:
+    st.session_state['accounts'] = False
 
 # Estilos CSS personalizados - Diseño elegante y moderno
 st.markdown("""
@@ -395,604 +417,132 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def normalize_date(date_value):
-    """Normaliza fechas a formato YYYY-MM-DD - Versión mejorada para coincidencias exactas"""
-    if pd.isna(date_value) or date_value == '':
-        return ''
-    
-    # Si es datetime o Timestamp, convertir directamente
-    if isinstance(date_value, (pd.Timestamp, datetime)):
-        try:
-            return date_value.strftime('%Y-%m-%d')
-        except:
-            return ''
-    
-    # Si es string, intentar parsear
-    if isinstance(date_value, str):
-        date_str = str(date_value).strip()
-        
-        # Si ya está en formato YYYY-MM-DD, retornar directamente
-        if re.match(r'^\d{4}-\d{2}-\d{2}$', date_str):
-            return date_str
-        
-        # Formatos comunes con regex más estricto
-        patterns = [
-            # DD/MM/YYYY o D/M/YYYY
-            (r'^(\d{1,2})[/\-](\d{1,2})[/\-](\d{4})$', lambda m: f"{m.group(3)}-{m.group(2).zfill(2)}-{m.group(1).zfill(2)}"),
-            # YYYY-MM-DD o YYYY/MM/DD
-            (r'^(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})$', lambda m: f"{m.group(1)}-{m.group(2).zfill(2)}-{m.group(3).zfill(2)}"),
-            # DD.MM.YYYY
-            (r'^(\d{1,2})\.(\d{1,2})\.(\d{4})$', lambda m: f"{m.group(3)}-{m.group(2).zfill(2)}-{m.group(1).zfill(2)}"),
-            # YYYY.MM.DD
-            (r'^(\d{4})\.(\d{1,2})\.(\d{1,2})$', lambda m: f"{m.group(1)}-{m.group(2).zfill(2)}-{m.group(3).zfill(2)}"),
-        ]
-        
-        for pattern, formatter in patterns:
-            match = re.match(pattern, date_str)
-            if match:
-                try:
-                    formatted = formatter(match)
-                    # Validar que la fecha sea válida
-                    year, month, day = map(int, formatted.split('-'))
-                    if 1900 <= year <= 2100 and 1 <= month <= 12 and 1 <= day <= 31:
-                        return formatted
-                except:
-                    continue
-        
-        # Intentar parsear con pandas (más flexible)
-        try:
-            parsed = pd.to_datetime(date_str, dayfirst=True, errors='coerce')
-            if pd.notna(parsed):
-                return parsed.strftime('%Y-%m-%d')
-        except:
-            pass
-        
-        # Si no se pudo parsear, retornar string vacío para evitar falsos positivos
-        return ''
-    
-    # Si es número (fecha serial de Excel), convertir
-    if isinstance(date_value, (int, float)):
-        try:
-            # Intentar convertir desde fecha serial de Excel
-            if date_value > 1 and date_value < 1000000:  # Rango razonable para fechas Excel
-                excel_date = pd.Timestamp('1900-01-01') + pd.Timedelta(days=int(date_value) - 2)
-                return excel_date.strftime('%Y-%m-%d')
-        except:
-            pass
-    
-    return ''
+# Los archivos de la barra lateral (caché de normalización, estado incremental y base de
+# conciliación) se indican por nombre y siempre se resuelven dentro de este directorio
+STATE_DIR = os.environ.get('CONCILIACION_DIR_ESTADO',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'estado'))
+STATE_NAME = re.compile(r'[\w-]{1,64}')
 
-def extract_pv(text):
-    """Extrae código PV de un texto - Versión mejorada para coincidencias exactas, incluyendo LOG"""
-    if pd.isna(text) or text == '':
+def state_file_input(label, extension, help, value=''):
+    """Campo de la barra lateral con el nombre de un archivo de STATE_DIR
+    
+    Devuelve la ruta del archivo (nombre + extension), o '' si el campo está vacío
+    o el nombre no es válido (solo letras, números, '-' y '_': nada de rutas).
+    """
+    name = st.sidebar.text_input(label, value=value, help=help).strip()
+    if not name:
         return ''
-    
-    text_str = str(text).upper().strip()
-    
-    # Si está vacío después de limpiar, retornar vacío
-    if not text_str:
+    if not STATE_NAME.fullmatch(name):
+        st.sidebar.error(f"❌ Nombre no válido para {label.lower()}: usa solo letras, números, '-' y '_'")
         return ''
-    
-    # Caso 1: LOG seguido de números (LOG81, LOG081, LOG 81, etc.)
-    log_match = re.search(r'LOG\s*0*(\d+)', text_str)
-    if log_match:
-        num = log_match.group(1)
-        # Normalizar LOG a PV (LOG81 -> PV081)
-        return f"PV{num.zfill(3)}"
-    
-    # Caso 2: Ya está en formato PV### (con o sin ceros a la izquierda)
-    pv_match = re.search(r'PV\s*0*(\d+)', text_str)
-    if pv_match:
-        num = pv_match.group(1)
-        # Normalizar a 3 dígitos (rellenar con ceros a la izquierda)
-        return f"PV{num.zfill(3)}"
-    
-    # Caso 3: Es solo un número (sin PV ni LOG) - como "81"
-    num_match = re.match(r'^0*(\d+)$', text_str)
-    if num_match:
-        num = num_match.group(1)
-        return f"PV{num.zfill(3)}"
-    
-    # Caso 4: Buscar número significativo (2 o más dígitos) en el texto
-    # Priorizar números más largos al final
-    numbers = re.findall(r'(\d{2,})', text_str)
-    if numbers:
-        # Tomar el último número encontrado (más probable que sea el PV)
-        num = numbers[-1]
-        return f"PV{num.zfill(3)}"
-    
-    # Caso 5: Buscar cualquier número (1 o más dígitos)
-    any_num = re.search(r'(\d+)', text_str)
-    if any_num:
-        num = any_num.group(1)
-        return f"PV{num.zfill(3)}"
-    
-    # Caso 6: Limpiar y buscar cualquier alfanumérico que pueda ser PV
-    cleaned = re.sub(r'[^A-Z0-9]', '', text_str)
-    if cleaned and len(cleaned) >= 2:
-        # Si tiene al menos 2 caracteres, intentar extraer número
-        num_in_cleaned = re.search(r'(\d+)', cleaned)
-        if num_in_cleaned:
-            num = num_in_cleaned.group(1)
-            return f"PV{num.zfill(3)}"
-    
-    return ''
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, name + extension)
 
-def normalize_amount(value):
-    """Normaliza montos a número"""
-    if pd.isna(value):
-        return 0.0
-    
-    if isinstance(value, (int, float)):
-        return abs(float(value))
-    
-    if isinstance(value, str):
-        # Limpiar string
-        cleaned = re.sub(r'[$€£¥₱₹¢\s]', '', value)
-        
-        # Detectar formato
-        if ',' in cleaned and '.' in cleaned:
-            # Determinar cuál es decimal
-            last_comma = cleaned.rfind(',')
-            last_dot = cleaned.rfind('.')
-            if last_comma > last_dot:
-                # Formato europeo: 1.234,56
-                cleaned = cleaned.replace('.', '').replace(',', '.')
-            else:
-                # Formato americano: 1,234.56
-                cleaned = cleaned.replace(',', '')
-        elif ',' in cleaned:
-            # Solo coma, puede ser decimal
-            if re.search(r',\d{1,2}$', cleaned):
-                cleaned = cleaned.replace(',', '.')
-            else:
-                cleaned = cleaned.replace(',', '')
-        else:
-            # Solo punto o sin separadores
-            pass
-        
-        try:
-            return abs(float(re.sub(r'[^0-9.-]', '', cleaned)))
-        except:
-            return 0.0
-    
-    return 0.0
+@st.cache_resource
+def get_workbook_cache():
+    """Caché de libros compartida entre ejecuciones del script y sesiones"""
+    return WorkbookCache()
 
-def detect_columns(df):
-    """Detecta automáticamente las columnas de fecha, monto y referencia - Versión mejorada"""
-    if df.empty or len(df.columns) == 0:
-        return None, None, None, None
-    
-    # Crear diccionario más flexible de búsqueda
-    columns_lower = {}
-    for col in df.columns:
-        # Normalizar nombre de columna
-        normalized = str(col).lower().strip()
-        # Remover espacios, guiones, puntos, etc.
-        normalized_clean = re.sub(r'[_\s\-\.]', '', normalized)
-        columns_lower[normalized_clean] = col
-        # También guardar versión con espacios
-        columns_lower[normalized] = col
-    
-    fecha_col = None
-    monto_col = None
-    referencia_col = None
-    descripcion_col = None
-    
-    # Buscar fecha - MÁS VARIACIONES
-    fecha_patterns = [
-        'fecha', 'date', 'fec', 'dia', 'day', 'fechapago', 'fechaoperacion',
-        'fechacontabilizacion', 'fechavencimiento', 'foperacion', 'fpago',
-        'fechadecontabilizacion', 'fechadevencimiento'
-    ]
-    for pattern in fecha_patterns:
-        if pattern in columns_lower:
-            fecha_col = columns_lower[pattern]
-            break
-    
-    # Si no se encontró, buscar por contenido (columnas que parecen fechas)
-    if not fecha_col:
-        for col in df.columns:
-            # Verificar si la columna contiene fechas
-            sample_values = df[col].dropna().head(10)
-            date_count = 0
-            for val in sample_values:
-                try:
-                    pd.to_datetime(val)
-                    date_count += 1
-                except:
-                    pass
-            if date_count >= 3:  # Si al menos 3 valores son fechas
-                fecha_col = col
-                break
-    
-    # Buscar monto - MÁS VARIACIONES
-    monto_patterns = [
-        'monto', 'amount', 'importe', 'valor', 'total', 'cantidad', 'pago', 
-        'abono', 'cargo', 'credito', 'debito', 'value', 'cargoabono',
-        'cargoabonoml', 'saldo', 'suma'
-    ]
-    for pattern in monto_patterns:
-        if pattern in columns_lower:
-            monto_col = columns_lower[pattern]
-            break
-    
-    # Si no se encontró, buscar columnas numéricas
-    if not monto_col:
-        for col in df.columns:
-            # Verificar si la columna es numérica
-            if df[col].dtype in ['int64', 'float64']:
-                # Verificar que tenga valores significativos
-                if df[col].abs().sum() > 0:
-                    monto_col = col
-                    break
-            else:
-                # Intentar convertir a numérico
-                try:
-                    numeric_vals = pd.to_numeric(df[col].astype(str).str.replace(r'[^\d.-]', '', regex=True), errors='coerce')
-                    if numeric_vals.notna().sum() > len(df) * 0.5:  # Si más del 50% son numéricos
-                        monto_col = col
-                        break
-                except:
-                    pass
-    
-    # Buscar referencia/PV - MÁS VARIACIONES
-    referencia_patterns = [
-        'referencia', 'ref', 'reference', 'pv', 'puntoventa', 'puntoventa',
-        'numero', 'num', 'codigopv', 'codpv', 'nro', 'no', 'voucher',
-        'comprobante', 'ticket', 'folio', 'numerooperacion', 'nrooperacion',
-        'comentarios', 'codpv', 'codigopuntoventa'
-    ]
-    for pattern in referencia_patterns:
-        if pattern in columns_lower:
-            referencia_col = columns_lower[pattern]
-            break
-    
-    # Buscar descripción
-    descripcion_patterns = [
-        'descripcion', 'description', 'desc', 'concepto', 'detalle', 
-        'observacion', 'nota', 'comentario', 'memo', 'nombredelacuentadecontrapartida',
-        'nombrepv', 'glosa'
-    ]
-    for pattern in descripcion_patterns:
-        if pattern in columns_lower:
-            descripcion_col = columns_lower[pattern]
-            break
+@st.cache_resource
+def get_normalization_cache(path):
+    """Caché de normalización en disco, una conexión por ruta compartida entre sesiones"""
+    return NormalizationCache(path)
+
+def run_reconcile(data1, data2, name1, name2, engine, engine_options, match_options, persistence):
+    """Conciliación normal, en la base SQLite por período o incremental, según lo configurado
     
-    return fecha_col, monto_col, referencia_col, descripcion_col
+    Devuelve None (con el error ya mostrado) si la base rechaza el período.
+    """
+    if persistence['store_path']:
+        with ReconciliationStore(persistence['store_path']) as store:
+            try:
+                results = store.reconcile_period(persistence['periodo'], data1, data2, name1, name2, **match_options)
+            except ValueError as e:
+                st.error(f"❌ {e}")
+                return None
+        stats = store.stats
+        st.caption(f"🗄️ Período {persistence['periodo']}: {stats['arrastradas1']} / {stats['arrastradas2']} "
+                   f"partidas abiertas arrastradas, {stats['cerradas']} cerradas · "
+                   f"quedan abiertas {stats['abiertas1']} / {stats['abiertas2']}")
+        return results
+    state_path = persistence['state_path']
+    if not state_path:
+        return reconcile(data1, data2, name1, name2, engine=engine, **engine_options)
+    state = IncrementalReconciliation.open(state_path, **match_options)
+    results = state.update(data1, data2, name1, name2)
+    state.save(state_path)
+    stats = state.stats
+    st.caption(f"🔁 Incremental: {stats['conservados']} cruces conservados, {stats['reabiertos']} reabiertos · "
+               f"filas nuevas {stats['nuevas1']} / {stats['nuevas2']} · "
+               f"cruzadas {stats['cruzadas1']} / {stats['cruzadas2']} · {stats['nuevos']} cruces nuevos")
+    return results
 
-def process_excel_file(file, sheet_name=None, fecha_col=None, monto_col=None, referencia_col=None, descripcion_col=None):
-    """Procesa un archivo Excel y retorna datos normalizados"""
-    try:
-        if sheet_name:
-            df = pd.read_excel(file, sheet_name=sheet_name, engine='openpyxl')
-        else:
-            df = pd.read_excel(file, engine='openpyxl')
-        
-        # Si no se proporcionaron columnas, detectarlas automáticamente
-        if not fecha_col or not monto_col:
-            detected_fecha, detected_monto, detected_ref, detected_desc = detect_columns(df)
-            
-            if not fecha_col:
-                fecha_col = detected_fecha
-            if not monto_col:
-                monto_col = detected_monto
-            if not referencia_col:
-                referencia_col = detected_ref
-            if not descripcion_col:
-                descripcion_col = detected_desc
-        
-        if not fecha_col or not monto_col:
-            # Preparar información de columnas disponibles para el error
-            available_cols = ", ".join(df.columns.astype(str).tolist())
-            return None, f"No se pudieron detectar las columnas de fecha y monto. Columnas disponibles: {available_cols}"
-        
-        # Normalizar datos - Guardar índice real del DataFrame
-        processed_data = []
-        for idx, row in df.iterrows():
-            fecha = normalize_date(row.get(fecha_col, ''))
-            monto = normalize_amount(row.get(monto_col, 0))
-            referencia = extract_pv(row.get(referencia_col, '')) if referencia_col else ''
-            descripcion = str(row.get(descripcion_col, '')) if descripcion_col else ''
-            
-            if fecha and monto > 0:
-                # Guardar el índice real del DataFrame (idx puede ser cualquier número)
-                # El número de fila en Excel será idx + 2 (1 para encabezado + 1 porque Excel empieza en 1)
-                processed_data.append({
-                    'fecha': fecha,
-                    'monto': round(monto, 2),
-                    'referencia': referencia,
-                    'descripcion': descripcion,
-                    '_original': row.to_dict(),
-                    '_excel_row': int(idx) + 2  # +2 porque Excel: fila 1 = encabezado, fila 2+ = datos
-                })
-        
-        return processed_data, None
-    except Exception as e:
-        return None, f"Error al procesar archivo: {str(e)}"
 
-def reconcile_data(data1, data2, name1="Hoja 1", name2="Hoja 2"):
-    """Reconcilia dos conjuntos de datos - Busca automáticamente valores iguales por Fecha y PV"""
-    results = []
-    matched1 = set()
-    matched2 = set()
-    
-    # Normalizar y validar datos antes de cruzar - NORMALIZACIÓN MEJORADA
-    normalized_data1 = []
-    normalized_data2 = []
-    
-    def normalize_for_matching(fecha, monto, referencia):
-        """Normaliza valores para comparación exacta"""
-        # Normalizar fecha: asegurar formato YYYY-MM-DD consistente
-        fecha_norm = ''
-        if fecha:
-            fecha_str = str(fecha).strip()
-            # Si ya está en formato YYYY-MM-DD, usar directamente
-            if re.match(r'^\d{4}-\d{2}-\d{2}$', fecha_str):
-                fecha_norm = fecha_str
-            else:
-                # Normalizar usando la función normalize_date
-                fecha_norm = normalize_date(fecha)
-        
-        # Normalizar monto: redondear a 2 decimales y usar tolerancia
-        monto_norm = 0.0
-        if monto:
-            try:
-                monto_float = float(monto)
-                monto_norm = round(abs(monto_float), 2)
-            except:
-                monto_norm = 0.0
-        
-        # Normalizar referencia/PV: extraer y normalizar PV
-        ref_norm = ''
-        if referencia:
-            ref_str = str(referencia).strip().upper()
-            # Si ya está en formato PV###, usar directamente
-            if re.match(r'^PV\d+$', ref_str):
-                # Extraer número y normalizar a PV### (3 dígitos)
-                num_match = re.search(r'(\d+)', ref_str)
-                if num_match:
-                    ref_norm = f"PV{num_match.group(1).zfill(3)}"
-            else:
-                # Extraer PV usando extract_pv
-                ref_norm = extract_pv(referencia)
-                # Asegurar formato PV### si se encontró algo
-                if ref_norm and not ref_norm.startswith('PV'):
-                    num_match = re.search(r'(\d+)', ref_norm)
-                    if num_match:
-                        ref_norm = f"PV{num_match.group(1).zfill(3)}"
-        
-        return fecha_norm, monto_norm, ref_norm
-    
-    for idx, row in enumerate(data1):
-        if row.get('fecha') and row.get('monto', 0) > 0:
-            fecha_norm, monto_norm, ref_norm = normalize_for_matching(
-                row.get('fecha', ''),
-                row.get('monto', 0),
-                row.get('referencia', '')
-            )
-            if fecha_norm:  # Solo agregar si tiene fecha válida
-                # Usar _excel_row si existe (número de fila real en Excel), sino calcular desde índice
-                excel_row = row.get('_excel_row')
-                if excel_row is None:
-                    # Si no tiene _excel_row, usar el índice + 2 (asumiendo que data1 viene de un DataFrame)
-                    excel_row = idx + 2
-                
-                normalized_data1.append({
-                    'fecha': fecha_norm,
-                    'monto': monto_norm,
-                    'referencia': ref_norm,
-                    'descripcion': str(row.get('descripcion', '')),
-                    '_original': row.get('_original', {}),
-                    '_index_original': idx,
-                    '_excel_row': excel_row  # Número de fila real en Excel
-                })
-    
-    for idx, row in enumerate(data2):
-        if row.get('fecha') and row.get('monto', 0) > 0:
-            fecha_norm, monto_norm, ref_norm = normalize_for_matching(
-                row.get('fecha', ''),
-                row.get('monto', 0),
-                row.get('referencia', '')
-            )
-            if fecha_norm:  # Solo agregar si tiene fecha válida
-                # Usar _excel_row si existe (número de fila real en Excel), sino calcular desde índice
-                excel_row = row.get('_excel_row')
-                if excel_row is None:
-                    # Si no tiene _excel_row, usar el índice + 2 (asumiendo que data2 viene de un DataFrame)
-                    excel_row = idx + 2
-                
-                normalized_data2.append({
-                    'fecha': fecha_norm,
-                    'monto': monto_norm,
-                    'referencia': ref_norm,
-                    'descripcion': str(row.get('descripcion', '')),
-                    '_original': row.get('_original', {}),
-                    '_index_original': idx,
-                    '_excel_row': excel_row  # Número de fila real en Excel
-                })
-    
-    # Crear índices para búsqueda rápida en data2
-    # PRIORIDAD 1: Fecha + PV + Monto (coincidencia EXACTA - máxima prioridad)
-    data2_by_exact = {}  # fecha|pv|monto -> [indices]
-    # PRIORIDAD 2: Fecha + PV (sin importar monto) - LO MÁS IMPORTANTE
-    data2_by_date_pv = {}  # fecha|pv -> [indices]
-    # PRIORIDAD 3: Fecha + Monto (sin PV)
-    data2_by_date_amount = {}  # fecha|monto -> [indices]
-    
-    for idx, row2 in enumerate(normalized_data2):
-        fecha = row2['fecha']
-        pv = row2['referencia']
-        monto = row2['monto']
-        # Usar formato consistente para monto (siempre 2 decimales, sin ceros innecesarios)
-        monto_str = f"{monto:.2f}".rstrip('0').rstrip('.')
-        if not monto_str or monto_str == '.':
-            monto_str = "0.00"
-        
-        # PRIORIDAD 1: Clave exacta: fecha + PV + monto (MÁXIMA PRIORIDAD)
-        if fecha and pv:
-            exact_key = f"{fecha}|{pv}|{monto_str}"
-            if exact_key not in data2_by_exact:
-                data2_by_exact[exact_key] = []
-            data2_by_exact[exact_key].append(idx)
-        
-        # PRIORIDAD 2: Clave fecha + PV (sin importar monto) - LO MÁS IMPORTANTE
-        if fecha and pv:
-            date_pv_key = f"{fecha}|{pv}"
-            if date_pv_key not in data2_by_date_pv:
-                data2_by_date_pv[date_pv_key] = []
-            data2_by_date_pv[date_pv_key].append(idx)
-        
-        # PRIORIDAD 3: Clave fecha + monto (sin importar PV)
-        if fecha:
-            date_amount_key = f"{fecha}|{monto_str}"
-            if date_amount_key not in data2_by_date_amount:
-                data2_by_date_amount[date_amount_key] = []
-            data2_by_date_amount[date_amount_key].append(idx)
-    
-    # PASO 1: PRIORIDAD MÁXIMA - Coincidencias EXACTAS por FECHA + PV + MONTO
-    # Primero buscar coincidencias exactas (todos los campos iguales)
-    for idx1, row1 in enumerate(normalized_data1):
-        if idx1 in matched1:
-            continue
-        
-        fecha = row1['fecha']
-        pv = row1['referencia']
-        monto = row1['monto']
-        monto_str = f"{monto:.2f}".rstrip('0').rstrip('.')
-        if not monto_str or monto_str == '.':
-            monto_str = "0.00"
-        
-        if not fecha:
-            continue
-        
-        # PRIORIDAD 1: Coincidencia EXACTA (fecha + PV + monto)
-        if fecha and pv:
-            exact_key = f"{fecha}|{pv}|{monto_str}"
-            candidates = data2_by_exact.get(exact_key, [])
-            
-            for idx2 in candidates:
-                if idx2 in matched2:
-                    continue
-                
-                row2 = normalized_data2[idx2]
-                # Verificación adicional: asegurar que todos los campos coincidan exactamente
-                if (row2['fecha'] == fecha and 
-                    row2['referencia'] == pv and 
-                    abs(row2['monto'] - monto) < 0.005):  # Tolerancia muy pequeña para montos
-                    # Usar _excel_row para obtener el número de fila real en Excel
-                    fila_banco = row1.get('_excel_row', idx1 + 2)
-                    fila_interno = row2.get('_excel_row', idx2 + 2)
-                    results.append({
-                        'banco': {**row1, 'origen': name1},
-                        'interno': {**row2, 'origen': name2},
-                        'estado': 'Conciliado',
-                        'origen': 'exacto_fecha_pv_monto',
-                        'fila_banco': fila_banco,
-                        'fila_interno': fila_interno
-                    })
-                    matched1.add(idx1)
-                    matched2.add(idx2)
-                    break
-            
-            if idx1 in matched1:
-                continue  # Ya se encontró coincidencia exacta, pasar a siguiente
-        
-        # PRIORIDAD 2: Coincidencia por FECHA + PV (sin importar monto)
-        if fecha and pv:
-            date_pv_key = f"{fecha}|{pv}"
-            candidates = data2_by_date_pv.get(date_pv_key, [])
-            
-            for idx2 in candidates:
-                if idx2 in matched2:
-                    continue
-                
-                row2 = normalized_data2[idx2]
-                # Verificar que fecha y PV coincidan exactamente
-                if row2['fecha'] == fecha and row2['referencia'] == pv:
-                    # Usar _excel_row para obtener el número de fila real en Excel
-                    fila_banco = row1.get('_excel_row', idx1 + 2)
-                    fila_interno = row2.get('_excel_row', idx2 + 2)
-                    results.append({
-                        'banco': {**row1, 'origen': name1},
-                        'interno': {**row2, 'origen': name2},
-                        'estado': 'Conciliado',
-                        'origen': 'fecha_pv',
-                        'fila_banco': fila_banco,
-                        'fila_interno': fila_interno
-                    })
-                    matched1.add(idx1)
-                    matched2.add(idx2)
-                    break
-    
-    # PASO 2: Coincidencias por fecha + monto (sin PV) - Solo si no se encontró por fecha+PV
-    for idx1, row1 in enumerate(normalized_data1):
-        if idx1 in matched1:
-            continue
-        
-        fecha = row1['fecha']
-        monto = row1['monto']
-        monto_str = f"{monto:.2f}".rstrip('0').rstrip('.')
-        if not monto_str or monto_str == '.':
-            monto_str = "0.00"
-        
-        if not fecha:
+def warn_ambiguous_amounts(data, label):
+    """Avisa de los montos en texto que no se pudieron leer sin adivinar el separador decimal"""
+    rows = data.attrs.get('montos_ambiguos', [])
+    if rows:
+        shown = ', '.join(str(row) for row in rows[:10]) + (' ...' if len(rows) > 10 else '')
+        st.warning(f"⚠️ {label}: {len(rows)} montos ambiguos (por ejemplo '1,234') en las filas {shown}. "
+                   "No se pudo deducir si la columna usa coma o punto decimal: revísalos antes de confiar en el cruce.")
+
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+XLSM_MIME = "application/vnd.ms-excel.sheet.macroEnabled.12"
+
+
+def original_workbooks(uploads):
+    """Libros subidos que se pueden marcar: [(nombre, bytes, [(hoja, lado)])] (solo .xlsx / .xlsm)"""
+    return [(upload.name, upload.getvalue(), sheets) for upload, sheets in uploads
+            if upload.name.lower().endswith(('.xlsx', '.xlsm'))]
+
+
+def run_multi_sheet(uploaded_file, ledger_sheet, account_sheets, workbook_cache, normalization_cache, streaming, match_options):
+    """Modo N hojas: procesa el libro y todas las cuentas y guarda los resultados en la sesión"""
+    def load(sheet):
+        if streaming:
+            return process_excel_file_streaming(uploaded_file, sheet, normalization_cache=normalization_cache)
+        return process_excel_file(uploaded_file, sheet, columnar=True, cache=workbook_cache, normalization_cache=normalization_cache)
+    
+    ledger, error = load(ledger_sheet)
+    if error or ledger is None or len(ledger) == 0:
+        st.error(f"Error en el libro mayor ({ledger_sheet}): {error or 'sin datos válidos'}")
+        return
+    warn_ambiguous_amounts(ledger, ledger_sheet)
+    accounts = {}
+    for sheet in account_sheets:
+        data, error = load(sheet)
+        if error or data is None or len(data) == 0:
+            st.warning(f"⚠️ Se omite la hoja '{sheet}': {error or 'sin datos válidos'}")
             continue
-        
-        date_amount_key = f"{fecha}|{monto_str}"
-        candidates = data2_by_date_amount.get(date_amount_key, [])
-        
-        for idx2 in candidates:
-            if idx2 in matched2:
-                continue
-            
-            row2 = normalized_data2[idx2]
-            # Verificar que fecha y monto coincidan exactamente (con tolerancia pequeña)
-            if row2['fecha'] == fecha and abs(row2['monto'] - monto) < 0.005:
-                # Usar _excel_row para obtener el número de fila real en Excel
-                fila_banco = row1.get('_excel_row', idx1 + 2)
-                fila_interno = row2.get('_excel_row', idx2 + 2)
-                results.append({
-                    'banco': {**row1, 'origen': name1},
-                    'interno': {**row2, 'origen': name2},
-                    'estado': 'Conciliado',
-                    'origen': 'fecha_monto',
-                    'fila_banco': fila_banco,
-                    'fila_interno': fila_interno
-                })
-                matched1.add(idx1)
-                matched2.add(idx2)
-                break
-    
-    # PASO 3: No conciliados de hoja 1
-    for idx1, row1 in enumerate(normalized_data1):
-        if idx1 not in matched1:
-            # Usar _excel_row para obtener el número de fila real en Excel
-            fila_banco = row1.get('_excel_row', idx1 + 2)
-            results.append({
-                'banco': {**row1, 'origen': name1},
-                'interno': None,
-                'estado': 'No conciliado',
-                'origen': name1,
-                'fila_banco': fila_banco,
-                'fila_interno': None
-            })
-    
-    # PASO 4: No conciliados de hoja 2
-    for idx2, row2 in enumerate(normalized_data2):
-        if idx2 not in matched2:
-            # Usar _excel_row para obtener el número de fila real en Excel
-            fila_interno = row2.get('_excel_row', idx2 + 2)
-            results.append({
-                'banco': {'fecha': '', 'monto': 0, 'referencia': '', 'descripcion': '', 'origen': ''},
-                'interno': {**row2, 'origen': name2},
-                'estado': 'No conciliado',
-                'origen': name2,
-                'fila_banco': None,
-                'fila_interno': fila_interno
-            })
+        warn_ambiguous_amounts(data, sheet)
+        accounts[sheet] = data
+    if not accounts:
+        st.error("Ninguna hoja de cuenta tiene datos válidos")
+        return
+    
+    results = reconcile_multi(accounts, ledger, ledger_sheet, **match_options)
+    st.session_state['results'] = results
+    st.session_state['sheet_names'] = ['Cuentas', ledger_sheet]
+    # Cada fila de cuenta se identifica por su hoja (columna Cuenta)
+    st.session_state['accounts'] = True
+    # Las descargas con hojas originales son de a dos hojas: aquí se omiten
+    st.session_state['original_files_data'] = {}
     
-    return results
+    resumen = []
+    for sheet in accounts:
+        rows = [r for r in results if r['banco'].get('origen') == sheet]
+        conciliados = {r['fila_banco'] for r in rows if r['estado'] == 'Conciliado'}
+        resumen.append({
+            'Cuenta': sheet,
+            'Filas': len({r['fila_banco'] for r in rows}),
+            'Conciliadas': len(conciliados),
+            'No conciliadas': sum(1 for r in rows if r['estado'] != 'Conciliado'),
+        })
+    libre = sum(1 for r in results if r['fila_banco'] is None)
+    st.success(f"✅ Conciliación completada! {len(accounts)} cuentas contra **{ledger_sheet}**")
+    st.dataframe(pd.DataFrame(resumen), use_container_width=True, hide_index=True)
+    st.info(f"📒 Filas de **{ledger_sheet}** sin cruce con ninguna cuenta: {libre}")
 
 def main():
     # Header con logo CALYPSO usando la imagen real
@@ -1039,20 +589,129 @@ def main():
         ["Un archivo (múltiples hojas)", "Dos archivos separados"]
     )
     
+    # Caché de libros parseados: cada hoja subida se lee con openpyxl una sola vez
+    workbook_cache = get_workbook_cache()
+    
+    streaming = st.sidebar.checkbox(
+        "Lectura en streaming (archivos muy grandes)",
+        value=False,
+        help="Lee las hojas por bloques sin cargarlas completas en memoria. "
+             "La descarga no incluirá las hojas originales."
+    )
+    
+    # Caché de normalización en disco: los textos de fecha ya vistos en otras cargas no se vuelven a parsear
+    normalization_cache_path = state_file_input(
+        "Caché de normalización",
+        ".normalizacion.sqlite",
+        value=os.environ.get('CONCILIACION_CACHE_NORMALIZACION', ''),
+        help="Si se indica un nombre, las fechas de texto ya normalizadas en cargas anteriores "
+             "se leen de ese archivo SQLite del directorio de estado. Se comparte entre sesiones "
+             "y con la CLI (--cache-normalizacion)."
+    )
+    normalization_cache = get_normalization_cache(normalization_cache_path) if normalization_cache_path else None
+    
+    engine = st.sidebar.selectbox(
+        "Motor de conciliación",
+        list(RECONCILE_ENGINES),
+        index=0,
+        help="'vectorizado' cruza por joins de pandas; produce el mismo resultado "
+             "y es mucho más rápido con cientos de miles de filas. 'jerarquico' compara "
+             "primero los totales por día y solo cruza en detalle los días que no cuadran (mismo resultado). "
+             "'paralelo' reparte el cruce vectorizado por rangos de fechas en varios procesos."
+    )
+    workers = st.sidebar.number_input(
+        "Procesos de trabajo",
+        min_value=1,
+        max_value=64,
+        value=os.cpu_count() or 1,
+        step=1,
+        disabled=engine != 'paralelo',
+        help="Cantidad de procesos del motor 'paralelo'. El resultado no depende de este valor."
+    )
+    
+    date_tolerance = st.sidebar.number_input(
+        "Tolerancia de fecha (días)",
+        min_value=0,
+        max_value=31,
+        value=0,
+        step=1,
+        help="Las filas que no cruzan en su misma fecha se buscan también hasta ±N días "
+             "(por Fecha+PV y por Fecha+Monto). 0 = solo fechas iguales."
+    )
+    
+    amount_tolerance = st.sidebar.number_input(
+        "Tolerancia de monto ($)",
+        min_value=0.0,
+        value=0.0,
+        step=1.0,
+        help="Diferencia absoluta admitida en el cruce Fecha+Monto (comisiones, redondeos)."
+    )
+    amount_tolerance_pct = st.sidebar.number_input(
+        "Tolerancia de monto (%)",
+        min_value=0.0,
+        max_value=100.0,
+        value=0.0,
+        step=0.1,
+        help="Diferencia relativa admitida sobre el monto del banco. Se usa la mayor de las dos tolerancias."
+    )
+    
+    aggregate = st.sidebar.checkbox(
+        "Cruce por agregados (un abono = suma de varias filas)",
+        value=False,
+        help="Busca, entre las filas libres de la misma fecha, combinaciones cuya suma "
+             f"coincide con un abono sin cruzar (hasta {AGGREGATE_MAX_CANDIDATES} filas por grupo)."
+    )
+    aggregate_by_pv = st.sidebar.checkbox(
+        "Agrupar agregados también por PV",
+        value=False,
+        disabled=not aggregate
+    )
+    match_options = {
+        'date_tolerance': date_tolerance,
+        'amount_tolerance': amount_tolerance,
+        'amount_tolerance_pct': amount_tolerance_pct,
+        'aggregate': aggregate,
+        'aggregate_by_pv': aggregate_by_pv,
+    }
+    state_path = state_file_input(
+        "Estado incremental",
+        ".estado.sqlite",
+        help="Si se indica un nombre, se guardan las filas, sus huellas y los cruces confirmados. "
+             "En la siguiente carga (p. ej. el extracto acumulado del mes) solo se cruzan las filas "
+             "nuevas o modificadas contra las abiertas; los cruces confirmados no se tocan. "
+             "No aplica al cruce contra todas las hojas de cuentas."
+    )
+    store_path = state_file_input(
+        "Base de conciliación",
+        ".conciliacion.sqlite",
+        help="Si se indica un nombre, los movimientos y resultados se guardan por período y las "
+             "partidas que quedan abiertas se arrastran al período siguiente. Tiene prioridad "
+             "sobre el estado incremental. No aplica al cruce contra todas las hojas de cuentas."
+    )
+    periodo = st.sidebar.text_input(
+        "Período",
+        value=datetime.now().strftime('%Y-%m'),
+        disabled=not store_path,
+        help="Período de la carga (por ejemplo 2025-01). Volver a conciliar el último período lo "
+             "reemplaza; uno anterior no se puede volver a conciliar."
+    ).strip()
+    persistence = {'state_path': state_path, 'store_path': store_path, 'periodo': periodo}
+    
+    # workers solo aplica al motor 'paralelo' (el cruce contra varias hojas no lo usa)
+    engine_options = dict(match_options, workers=workers) if engine == 'paralelo' else match_options
+    
     if mode == "Un archivo (múltiples hojas)":
         st.header("📁 Cargar archivo Excel con dos hojas")
         uploaded_file = st.file_uploader(
             "Selecciona un archivo Excel con al menos 2 hojas",
-            type=['xlsx', 'xls'],
+            type=['xlsx', 'xlsm', 'xls'],
             help="La primera hoja se cruzará contra la segunda"
         )
         
         if uploaded_file:
             try:
                 # Leer archivo Excel y obtener nombres de hojas
-                uploaded_file.seek(0)  # Asegurar que el archivo esté al inicio
-                excel_file = pd.ExcelFile(uploaded_file, engine='openpyxl')
-                sheet_names = excel_file.sheet_names
+                sheet_names = workbook_cache.get_sheet_names(uploaded_file)
                 
                 if len(sheet_names) < 2:
                     st.error(f"❌ El archivo solo tiene {len(sheet_names)} hoja(s). Se necesitan al menos 2 hojas para realizar la conciliación.")
@@ -1060,104 +719,140 @@ def main():
                 else:
                     st.success(f"✅ Archivo cargado: **{uploaded_file.name}**")
                     st.info(f"📑 **Hojas encontradas ({len(sheet_names)}):** {', '.join(sheet_names)}")
-                    st.info(f"🔄 Se conciliará: **{sheet_names[0]}** ↔ **{sheet_names[1]}**")
                     
-                    # Mostrar preview de columnas de cada hoja
-                    try:
-                        uploaded_file.seek(0)
-                        df_preview1 = pd.read_excel(uploaded_file, sheet_name=sheet_names[0], engine='openpyxl', nrows=3)
-                        if not df_preview1.empty:
-                            st.info(f"📋 **Columnas en '{sheet_names[0]}':** {', '.join(df_preview1.columns.astype(str).tolist()[:10])}" + 
-                                   (f" ... (+{len(df_preview1.columns) - 10} más)" if len(df_preview1.columns) > 10 else ""))
+                    multi_sheet = len(sheet_names) > 2 and st.checkbox(
+                        "🏦 Cruzar el libro mayor contra todas las hojas de cuentas",
+                        value=False,
+                        help="Cada hoja de cuenta se cruza contra el mismo libro mayor (índice compartido, en paralelo)."
+                    )
+                    if multi_sheet:
+                        ledger_default = next((i for i, name in enumerate(sheet_names)
+                                               if 'MAYOR' in name.upper() or 'LIBRO' in name.upper()), 0)
+                        ledger_sheet = st.selectbox("Hoja del libro mayor", sheet_names, index=ledger_default)
+                        account_sheets = [name for name in sheet_names if name != ledger_sheet]
+                        st.info(f"🔄 Se conciliará: **{', '.join(account_sheets)}** ↔ **{ledger_sheet}**")
+                        if persistence['store_path'] or persistence['state_path']:
+                            st.warning("⚠️ El cruce contra todas las hojas de cuentas no usa la base de conciliación "
+                                       "ni el estado incremental: los resultados no se guardan.")
+                        if st.button("🔄 Procesar y Conciliar todas las hojas", type="primary"):
+                            with st.spinner("Procesando hojas..."):
+                                run_multi_sheet(uploaded_file, ledger_sheet, account_sheets, workbook_cache, normalization_cache, streaming, match_options)
+                    else:
+                        st.info(f"🔄 Se conciliará: **{sheet_names[0]}** ↔ **{sheet_names[1]}**")
+                    
+                        # Mostrar preview de columnas de cada hoja (desde la caché: la hoja completa se reutiliza al procesar)
+                        try:
+                            if streaming:
+                                df_preview1 = read_excel_preview(uploaded_file, sheet_names[0])
+                            else:
+                                df_preview1 = workbook_cache.get_sheet(uploaded_file, sheet_names[0]).head(3)
+                            if not df_preview1.empty:
+                                st.info(f"📋 **Columnas en '{sheet_names[0]}':** {', '.join(df_preview1.columns.astype(str).tolist()[:10])}" + 
+                                       (f" ... (+{len(df_preview1.columns) - 10} más)" if len(df_preview1.columns) > 10 else ""))
                         
-                        uploaded_file.seek(0)
-                        df_preview2 = pd.read_excel(uploaded_file, sheet_name=sheet_names[1], engine='openpyxl', nrows=3)
-                        if not df_preview2.empty:
-                            st.info(f"📋 **Columnas en '{sheet_names[1]}':** {', '.join(df_preview2.columns.astype(str).tolist()[:10])}" + 
-                                   (f" ... (+{len(df_preview2.columns) - 10} más)" if len(df_preview2.columns) > 10 else ""))
-                        uploaded_file.seek(0)
-                    except Exception as preview_error:
-                        st.warning(f"⚠️ No se pudo mostrar el preview de columnas: {str(preview_error)}")
-                        uploaded_file.seek(0)
+                            if streaming:
+                                df_preview2 = read_excel_preview(uploaded_file, sheet_names[1])
+                            else:
+                                df_preview2 = workbook_cache.get_sheet(uploaded_file, sheet_names[1]).head(3)
+                            if not df_preview2.empty:
+                                st.info(f"📋 **Columnas en '{sheet_names[1]}':** {', '.join(df_preview2.columns.astype(str).tolist()[:10])}" + 
+                                       (f" ... (+{len(df_preview2.columns) - 10} más)" if len(df_preview2.columns) > 10 else ""))
+                        except Exception as preview_error:
+                            st.warning(f"⚠️ No se pudo mostrar el preview de columnas: {str(preview_error)}")
                     
-                    if st.button("🔄 Procesar y Conciliar", type="primary"):
-                        with st.spinner("Procesando archivo..."):
-                            try:
-                                # Procesar primera hoja
-                                uploaded_file.seek(0)  # Asegurar que el archivo esté al inicio
-                                data1, error1 = process_excel_file(uploaded_file, sheet_names[0])
-                                if error1:
-                                    st.error(f"Error en hoja 1 ({sheet_names[0]}): {error1}")
-                                    if "Columnas disponibles" in error1:
-                                        st.warning("💡 Asegúrate de que las columnas tengan nombres que contengan 'fecha' o 'date' para fechas, y 'monto', 'amount' o 'valor' para montos.")
-                                    return
+                        if st.button("🔄 Procesar y Conciliar", type="primary"):
+                            with st.spinner("Procesando archivo..."):
+                                try:
+                                    # Procesar primera hoja
+                                    if streaming:
+                                        data1, error1 = process_excel_file_streaming(uploaded_file, sheet_names[0], normalization_cache=normalization_cache)
+                                    else:
+                                        data1, error1 = process_excel_file(uploaded_file, sheet_names[0], columnar=True, cache=workbook_cache, normalization_cache=normalization_cache)
+                                    if error1:
+                                        st.error(f"Error en hoja 1 ({sheet_names[0]}): {error1}")
+                                        if "Columnas disponibles" in error1:
+                                            st.warning("💡 Asegúrate de que las columnas tengan nombres que contengan 'fecha' o 'date' para fechas, y 'monto', 'amount' o 'valor' para montos.")
+                                        return
                                 
-                                # Procesar segunda hoja
-                                uploaded_file.seek(0)  # Resetear archivo
-                                data2, error2 = process_excel_file(uploaded_file, sheet_names[1])
-                                if error2:
-                                    st.error(f"Error en hoja 2 ({sheet_names[1]}): {error2}")
-                                    if "Columnas disponibles" in error2:
-                                        st.warning("💡 Asegúrate de que las columnas tengan nombres que contengan 'fecha' o 'date' para fechas, y 'monto', 'amount' o 'valor' para montos.")
-                                    return
+                                    # Procesar segunda hoja
+                                    if streaming:
+                                        data2, error2 = process_excel_file_streaming(uploaded_file, sheet_names[1], normalization_cache=normalization_cache)
+                                    else:
+                                        data2, error2 = process_excel_file(uploaded_file, sheet_names[1], columnar=True, cache=workbook_cache, normalization_cache=normalization_cache)
+                                    if error2:
+                                        st.error(f"Error en hoja 2 ({sheet_names[1]}): {error2}")
+                                        if "Columnas disponibles" in error2:
+                                            st.warning("💡 Asegúrate de que las columnas tengan nombres que contengan 'fecha' o 'date' para fechas, y 'monto', 'amount' o 'valor' para montos.")
+                                        return
                                 
-                                if not data1 or len(data1) == 0:
-                                    st.error(f"La hoja '{sheet_names[0]}' está vacía o no contiene datos válidos")
-                                    return
+                                    if data1 is None or len(data1) == 0:
+                                        st.error(f"La hoja '{sheet_names[0]}' está vacía o no contiene datos válidos")
+                                        return
                                 
-                                if not data2 or len(data2) == 0:
-                                    st.error(f"La hoja '{sheet_names[1]}' está vacía o no contiene datos válidos")
-                                    return
+                                    if data2 is None or len(data2) == 0:
+                                        st.error(f"La hoja '{sheet_names[1]}' está vacía o no contiene datos válidos")
+                                        return
+                                    warn_ambiguous_amounts(data1, sheet_names[0])
+                                    warn_ambiguous_amounts(data2, sheet_names[1])
                                 
-                                # Guardar datos originales para preservar formato en descarga
-                                try:
-                                    uploaded_file.seek(0)
-                                    df1_original = pd.read_excel(uploaded_file, sheet_name=sheet_names[0], engine='openpyxl')
-                                    uploaded_file.seek(0)
-                                    df2_original = pd.read_excel(uploaded_file, sheet_name=sheet_names[1], engine='openpyxl')
-                                except Exception as e:
-                                    st.warning(f"Advertencia: No se pudieron cargar los datos originales para preservar formato: {str(e)}")
-                                    # Crear DataFrames vacíos como fallback
-                                    df1_original = pd.DataFrame()
-                                    df2_original = pd.DataFrame()
+                                    # Guardar datos originales para preservar formato en descarga (ya parseados en la caché)
+                                    try:
+                                        if streaming:
+                                            # En streaming no se cargan las hojas completas: se omiten en la descarga
+                                            df1_original = None
+                                            df2_original = None
+                                        else:
+                                            df1_original = workbook_cache.get_sheet(uploaded_file, sheet_names[0])
+                                            df2_original = workbook_cache.get_sheet(uploaded_file, sheet_names[1])
+                                    except Exception as e:
+                                        st.warning(f"Advertencia: No se pudieron cargar los datos originales para preservar formato: {str(e)}")
+                                        # Crear DataFrames vacíos como fallback
+                                        df1_original = pd.DataFrame()
+                                        df2_original = pd.DataFrame()
                                 
-                                # Reconciliar
-                                results = reconcile_data(data1, data2, sheet_names[0], sheet_names[1])
+                                    # Reconciliar
+                                    results = run_reconcile(data1, data2, sheet_names[0], sheet_names[1], engine, engine_options, match_options, persistence)
+                                    if results is None:
+                                        return
                                 
-                                if not results or len(results) == 0:
-                                    st.warning("⚠️ No se generaron resultados de conciliación. Verifica que los datos sean válidos.")
-                                    return
+                                    if not results or len(results) == 0:
+                                        st.warning("⚠️ No se generaron resultados de conciliación. Verifica que los datos sean válidos.")
+                                        return
                                 
-                                # Calcular estadísticas
-                                conciliados = [r for r in results if r['estado'] == 'Conciliado']
-                                exactos = [r for r in conciliados if r['origen'] == 'exacto_fecha_pv_monto']
-                                fecha_pv = [r for r in conciliados if r['origen'] == 'fecha_pv']
-                                fecha_monto = [r for r in conciliados if r['origen'] == 'fecha_monto']
+                                    # Calcular estadísticas
+                                    # Cada fila del banco una sola vez (un agregado repite la fila en cada parte)
+                                    resumen = match_summary(results)
+                                    por_origen = resumen['por_origen']
+                                    agregados = sum(n for origen, n in por_origen.items() if origen.startswith('agregado'))
                                 
-                                # Guardar resultados en session state
-                                st.session_state['results'] = results
-                                st.session_state['sheet_names'] = sheet_names
-                                st.session_state['original_files_data'] = {
-                                    'original_df1': df1_original,
-                                    'original_df2': df2_original
-                                }
+                                    # Guardar resultados en session state
+                                    st.session_state['results'] = results
+                                    st.session_state['sheet_names'] = sheet_names
+                                    st.session_state['accounts'] = False
+                                    st.session_state['original_files_data'] = {} if streaming else {
+                                        'original_df1': df1_original,
+                                        'original_df2': df2_original,
+                                        # Libro subido, para marcar una copia con la columna Cruce
+                                        'libros': original_workbooks([(uploaded_file, [(sheet_names[0], 0), (sheet_names[1], 1)])])
+                                    }
                                 
-                                st.success(f"✅ Conciliación completada!")
-                                st.info(f"""
-                                **Resultados del cruce:**
-                                - Total registros procesados: **{sheet_names[0]}**: {len(data1)}, **{sheet_names[1]}**: {len(data2)}
-                                - **Conciliados: {len(conciliados)}**
-                                  - ✅ Exactos (Fecha+PV+Monto): {len(exactos)}
-                                  - 🔄 Por Fecha+PV: {len(fecha_pv)}
-                                  - 📅 Por Fecha+Monto: {len(fecha_monto)}
-                                - ❌ No conciliados: {len(results) - len(conciliados)}
-                                """)
-                                # Evitar st.rerun() que puede causar errores de DOM
-                                # Los resultados se mostrarán automáticamente en la siguiente sección
-                            except Exception as e:
-                                st.error(f"❌ Error al procesar el archivo: {str(e)}")
-                                import traceback
-                                st.exception(e)
+                                    st.success(f"✅ Conciliación completada!")
+                                    st.info(f"""
+                                    **Resultados del cruce:**
+                                    - Total registros procesados: **{sheet_names[0]}**: {len(data1)}, **{sheet_names[1]}**: {len(data2)}
+                                    - **Conciliados: {resumen['conciliados1']}**
+                                      - ✅ Exactos (Fecha+PV+Monto): {por_origen.get('exacto_fecha_pv_monto', 0)}
+                                      - 🔄 Por Fecha+PV: {por_origen.get('fecha_pv', 0)}
+                                      - 📅 Por Fecha+Monto: {por_origen.get('fecha_monto', 0)}
+                                      - ➕ Por agregados: {agregados}
+                                    - ❌ No conciliados: {resumen['no_conciliados1'] + resumen['no_conciliados2']}
+                                    """)
+                                    # Evitar st.rerun() que puede causar errores de DOM
+                                    # Los resultados se mostrarán automáticamente en la siguiente sección
+                                except Exception as e:
+                                    st.error(f"❌ Error al procesar el archivo: {str(e)}")
+                                    import traceback
+                                    st.exception(e)
             except Exception as e:
                 st.error(f"Error al leer el archivo: {str(e)}")
     
@@ -1168,14 +863,14 @@ def main():
         with col1:
             banco_file = st.file_uploader(
                 "Archivo de Pagos Bancarios",
-                type=['xlsx', 'xls', 'csv'],
+                type=['xlsx', 'xlsm', 'xls', 'csv'],
                 key="banco"
             )
         
         with col2:
             interno_file = st.file_uploader(
                 "Archivo de Pagos Internos",
-                type=['xlsx', 'xls', 'csv'],
+                type=['xlsx', 'xlsm', 'xls', 'csv'],
                 key="interno"
             )
         
@@ -1183,72 +878,94 @@ def main():
             if st.button("🔄 Procesar y Conciliar", type="primary"):
                 with st.spinner("Procesando archivos..."):
                     # Procesar archivo banco
-                    data1, error1 = process_excel_file(banco_file)
+                    if streaming:
+                        data1, error1 = process_excel_file_streaming(banco_file, normalization_cache=normalization_cache)
+                    else:
+                        data1, error1 = process_excel_file(banco_file, columnar=True, cache=workbook_cache, normalization_cache=normalization_cache)
                     if error1:
                         st.error(f"Error en archivo bancario: {error1}")
                         return
                     
                     # Procesar archivo interno
-                    data2, error2 = process_excel_file(interno_file)
+                    if streaming:
+                        data2, error2 = process_excel_file_streaming(interno_file, normalization_cache=normalization_cache)
+                    else:
+                        data2, error2 = process_excel_file(interno_file, columnar=True, cache=workbook_cache, normalization_cache=normalization_cache)
                     if error2:
                         st.error(f"Error en archivo interno: {error2}")
                         return
                     
-                    if not data1 or not data2:
+                    if data1 is None or data2 is None or len(data1) == 0 or len(data2) == 0:
                         st.error("Uno o ambos archivos están vacíos")
                         return
+                    warn_ambiguous_amounts(data1, "Archivo bancario")
+                    warn_ambiguous_amounts(data2, "Archivo interno")
                     
-                    # Guardar datos originales para preservar formato
-                    banco_file.seek(0)
-                    df1_original = pd.read_excel(banco_file, engine='openpyxl')
-                    interno_file.seek(0)
-                    df2_original = pd.read_excel(interno_file, engine='openpyxl')
+                    # Guardar datos originales para preservar formato (ya parseados en la caché)
+                    if streaming:
+                        original_files_data = {}
+                    else:
+                        original_files_data = {
+                            'original_df1': workbook_cache.get_sheet(banco_file),
+                            'original_df2': workbook_cache.get_sheet(interno_file),
+                            'libros': original_workbooks([(banco_file, [(0, 0)]), (interno_file, [(0, 1)])])
+                        }
                     
                     # Reconciliar
-                    results = reconcile_data(data1, data2, "Banco", "Interno")
+                    results = run_reconcile(data1, data2, "Banco", "Interno", engine, engine_options, match_options, persistence)
+                    if results is None:
+                        return
                     
                     # Calcular estadísticas
-                    conciliados = [r for r in results if r['estado'] == 'Conciliado']
-                    exactos = [r for r in conciliados if r['origen'] == 'exacto_fecha_pv_monto']
-                    fecha_pv = [r for r in conciliados if r['origen'] == 'fecha_pv']
-                    fecha_monto = [r for r in conciliados if r['origen'] == 'fecha_monto']
+                    # Cada fila del banco una sola vez (un agregado repite la fila en cada parte)
+                    resumen = match_summary(results)
+                    por_origen = resumen['por_origen']
+                    agregados = sum(n for origen, n in por_origen.items() if origen.startswith('agregado'))
                     
                     # Guardar resultados
                     st.session_state['results'] = results
                     st.session_state['sheet_names'] = ["Banco", "Interno"]
-                    st.session_state['original_files_data'] = {
-                        'original_df1': df1_original,
-                        'original_df2': df2_original
-                    }
+                    st.session_state['accounts'] = False
+                    st.session_state['original_files_data'] = original_files_data
                     
                     st.success(f"✅ Conciliación completada!")
                     st.info(f"""
                     **Resultados del cruce:**
                     - Total registros procesados: Banco: {len(data1)}, Interno: {len(data2)}
-                    - **Conciliados: {len(conciliados)}**
-                      - Exactos (Fecha+PV+Monto): {len(exactos)}
-                      - Por Fecha+PV: {len(fecha_pv)}
-                      - Por Fecha+Monto: {len(fecha_monto)}
-                    - No conciliados: {len(results) - len(conciliados)}
+                    - **Conciliados: {resumen['conciliados1']}**
+                      - Exactos (Fecha+PV+Monto): {por_origen.get('exacto_fecha_pv_monto', 0)}
+                      - Por Fecha+PV: {por_origen.get('fecha_pv', 0)}
+                      - Por Fecha+Monto: {por_origen.get('fecha_monto', 0)}
+                      - Por agregados: {agregados}
+                    - No conciliados: {resumen['no_conciliados1'] + resumen['no_conciliados2']}
                     """)
                     # Evitar st.rerun() que puede causar errores de DOM
                     # Los resultados se mostrarán automáticamente en la siguiente sección
     
+    # Estado de la caché de libros
+    cache_stats = workbook_cache.stats()
+    st.sidebar.caption(
+        f"🗂️ Caché de libros: {cache_stats['hits']} aciertos / {cache_stats['misses']} fallos · "
+        f"{cache_stats['entries']} hojas · {cache_stats['bytes'] / (1024 * 1024):,.1f} MB"
+    )
+    if normalization_cache is not None:
+        normalization_stats = normalization_cache.stats()
+        st.sidebar.caption(
+            f"🧮 Caché de normalización: {normalization_stats['hits']} aciertos / "
+            f"{normalization_stats['misses']} fallos · {normalization_stats['entries']:,} textos"
+        )
+    
     # Mostrar resultados
     if 'results' in st.session_state and st.session_state['results']:
         results = st.session_state['results']
         sheet_names = st.session_state.get('sheet_names', ['Hoja 1', 'Hoja 2'])
+        accounts = st.session_state.get('accounts', False)
         
         # Estadísticas
-        conciliados = [r for r in results if r['estado'] == 'Conciliado']
-        no_conciliados = [r for r in results if r['estado'] == 'No conciliado']
-        
-        monto_conciliado = sum(r['banco'].get('monto', 0) or r['interno'].get('monto', 0) 
-                              if r['interno'] else r['banco'].get('monto', 0) 
-                              for r in conciliados)
-        monto_no_conciliado = sum(r['banco'].get('monto', 0) or r['interno'].get('monto', 0) 
-                                 if r['interno'] else r['banco'].get('monto', 0) 
-                                 for r in no_conciliados)
+        # Cada fila del banco conciliada cuenta (y suma su monto) una sola vez, aunque sea un agregado
+        resumen = match_summary(results)
+        monto_conciliado = resumen['monto_conciliado']
+        monto_no_conciliado = resumen['monto_no_conciliado']
         
         st.header("📊 Panel de Control")
         
@@ -1263,14 +980,14 @@ def main():
         with col2:
             st.markdown(f"""
             <div class="stat-card success">
-                <div class="stat-value">{len(conciliados)}</div>
+                <div class="stat-value">{resumen['conciliados1']}</div>
                 <div class="stat-label">Conciliados</div>
             </div>
             """, unsafe_allow_html=True)
         with col3:
             st.markdown(f"""
             <div class="stat-card warning">
-                <div class="stat-value">{len(no_conciliados)}</div>
+                <div class="stat-value">{resumen['no_conciliados1'] + resumen['no_conciliados2']}</div>
                 <div class="stat-label">No Conciliados</div>
             </div>
             """, unsafe_allow_html=True)
@@ -1292,29 +1009,9 @@ def main():
             interno = r.get('interno')
             
             # Determinar tipo de coincidencia y mensaje claro
-            tipo_coincidencia = ""
-            mensaje_cruce = ""
-            if r['estado'] == 'Conciliado':
-                fila_banco = r.get('fila_banco', '?')
-                fila_interno = r.get('fila_interno', '?')
-                
-                if r['origen'] == 'exacto_fecha_pv_monto':
-                    tipo_coincidencia = "✅ EXACTA"
-                    mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: Fecha+PV+Monto iguales"
-                elif r['origen'] == 'fecha_pv':
-                    tipo_coincidencia = "🔄 FECHA+PV"
-                    mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: Fecha y PV iguales"
-                elif r['origen'] == 'fecha_monto':
-                    tipo_coincidencia = "📅 FECHA+MONTO"
-                    mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: Fecha y Monto iguales"
-            else:
-                tipo_coincidencia = "❌ NO CRUZADO"
-                if interno:
-                    mensaje_cruce = f"Fila {r.get('fila_interno', '?')} de {sheet_names[1]}: No tiene coincidencia"
-                else:
-                    mensaje_cruce = f"Fila {r.get('fila_banco', '?')} de {sheet_names[0]}: No tiene coincidencia"
+            tipo_coincidencia, mensaje_cruce = describe_match(r, sheet_names, accounts)
             
-            table_data.append({
+            fila = {
                 'Estado': r['estado'],
                 'Tipo': tipo_coincidencia,
                 'Cruza': mensaje_cruce,
@@ -1326,8 +1023,12 @@ def main():
                 f'Fecha {sheet_names[1]}': interno.get('fecha', '-') if interno else '-',
                 f'PV {sheet_names[1]}': interno.get('referencia', '-') if interno else '-',
                 f'Monto {sheet_names[1]}': f"${interno.get('monto', 0):,.2f}" if interno and interno.get('monto') else '-',
-                'Diferencia Monto': f"${abs((banco.get('monto', 0) or 0) - (interno.get('monto', 0) or 0) if interno else 0):,.2f}"
-            })
+                'Diferencia Monto': f"${match_difference(r):,.2f}",
+                'Grupo Agregado': r.get('grupo_agregado')
+            }
+            if accounts:
+                fila['Cuenta'] = account_name(r, sheet_names)
+            table_data.append(fila)
         
         df_results = pd.DataFrame(table_data)
         
@@ -1344,7 +1045,8 @@ def main():
         conciliados_list = [r for r in results if r['estado'] == 'Conciliado']
         
         if conciliados_list:
-            st.success(f"✅ Se encontraron {len(conciliados_list)} valores que coinciden entre ambas hojas:")
+            st.success(f"✅ Se encontraron {resumen['conciliados1']} filas de {sheet_names[0]} que coinciden "
+                       f"con {resumen['conciliados2']} de {sheet_names[1]}:")
             
             # Mostrar ejemplos de cruces
             with st.expander("🔍 Ver detalles de los cruces", expanded=True):
@@ -1353,10 +1055,11 @@ def main():
                     interno = r['interno']
                     fila_b = r.get('fila_banco', '?')
                     fila_i = r.get('fila_interno', '?')
+                    hoja_b = account_name(r, sheet_names) if accounts else sheet_names[0]
                     
                     st.markdown(f"""
                     **Cruze #{i}:**
-                    - **{sheet_names[0]} (Fila {fila_b})**: Fecha={banco.get('fecha')}, PV={banco.get('referencia')}, Monto=${banco.get('monto', 0):,.2f}
+                    - **{hoja_b} (Fila {fila_b})**: Fecha={banco.get('fecha')}, PV={banco.get('referencia')}, Monto=${banco.get('monto', 0):,.2f}
                     - **{sheet_names[1]} (Fila {fila_i})**: Fecha={interno.get('fecha')}, PV={interno.get('referencia')}, Monto=${interno.get('monto', 0):,.2f}
                     - **Tipo**: {r['origen']}
                     ---
@@ -1388,302 +1091,15 @@ def main():
             - El tipo de coincidencia encontrada
             """)
         
-        # Botón de descarga con formato preservado
-        def create_excel_with_format(results, sheet_names):
-            """Crea Excel preservando formatos originales"""
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Conciliación"
-            
-            # Estilos
-            header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            header_font = Font(bold=True, color="FFFFFF", size=11)
-            border = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-            center_align = Alignment(horizontal='center', vertical='center')
-            
-            # Encabezados
-            headers = [
-                'Estado', 'Tipo', 'Cruza',
-                f'Fila {sheet_names[0]}', f'Fecha {sheet_names[0]}', f'PV {sheet_names[0]}', f'Monto {sheet_names[0]}',
-                f'Fila {sheet_names[1]}', f'Fecha {sheet_names[1]}', f'PV {sheet_names[1]}', f'Monto {sheet_names[1]}',
-                'Diferencia Monto'
-            ]
-            
-            # Escribir encabezados con formato
-            for col_idx, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col_idx, value=header)
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = center_align
-                cell.border = border
-            
-            # Escribir datos preservando formatos
-            for row_idx, r in enumerate(results, 2):
-                banco = r['banco']
-                interno = r.get('interno')
-                
-                # Determinar tipo de coincidencia
-                tipo_coincidencia = ""
-                mensaje_cruce = ""
-                if r['estado'] == 'Conciliado':
-                    fila_banco = r.get('fila_banco', '?')
-                    fila_interno = r.get('fila_interno', '?')
-                    
-                    if r['origen'] == 'exacto_fecha_pv_monto':
-                        tipo_coincidencia = "✅ EXACTA"
-                        mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: Fecha+PV+Monto iguales"
-                    elif r['origen'] == 'fecha_pv':
-                        tipo_coincidencia = "🔄 FECHA+PV"
-                        mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: Fecha y PV iguales"
-                    elif r['origen'] == 'fecha_monto':
-                        tipo_coincidencia = "📅 FECHA+MONTO"
-                        mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: Fecha y Monto iguales"
-                else:
-                    tipo_coincidencia = "❌ NO CRUZADO"
-                    if interno:
-                        mensaje_cruce = f"Fila {r.get('fila_interno', '?')} de {sheet_names[1]}: No tiene coincidencia"
-                    else:
-                        mensaje_cruce = f"Fila {r.get('fila_banco', '?')} de {sheet_names[0]}: No tiene coincidencia"
-                
-                # Preparar valores
-                row_data = [
-                    r['estado'],
-                    tipo_coincidencia,
-                    mensaje_cruce,
-                    r.get('fila_banco', '-'),
-                    banco.get('fecha', '-'),
-                    banco.get('referencia', '-'),
-                    banco.get('monto', 0) if banco.get('monto') else None,
-                    r.get('fila_interno', '-'),
-                    interno.get('fecha', '-') if interno else '-',
-                    interno.get('referencia', '-') if interno else '-',
-                    interno.get('monto', 0) if interno and interno.get('monto') else None,
-                    abs((banco.get('monto', 0) or 0) - (interno.get('monto', 0) or 0) if interno else 0)
-                ]
-                
-                # Escribir valores con formato apropiado
-                for col_idx, value in enumerate(row_data, 1):
-                    cell = ws.cell(row=row_idx, column=col_idx, value=value)
-                    cell.border = border
-                    
-                    # Formato para estado
-                    if col_idx == 1:  # Estado
-                        if value == 'Conciliado':
-                            cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                        else:
-                            cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-                    
-                    # Formato para montos (columnas 7, 11, 12)
-                    if col_idx in [7, 11, 12]:
-                        if value is not None and isinstance(value, (int, float)) and value != 0:
-                            cell.number_format = '#,##0.00'
-                            cell.alignment = Alignment(horizontal='right', vertical='center')
-                    
-                    # Formato para fechas (columnas 5, 9)
-                    if col_idx in [5, 9]:
-                        if value and value != '-':
-                            try:
-                                # Intentar convertir a fecha
-                                date_val = pd.to_datetime(value)
-                                cell.value = date_val
-                                cell.number_format = 'dd/mm/yyyy'
-                                cell.alignment = Alignment(horizontal='center', vertical='center')
-                            except:
-                                cell.alignment = Alignment(horizontal='center', vertical='center')
-                    
-                    # Formato para números de fila (columnas 4, 8)
-                    if col_idx in [4, 8]:
-                        if value != '-':
-                            cell.alignment = Alignment(horizontal='center', vertical='center')
-            
-            # Ajustar ancho de columnas
-            column_widths = {
-                'A': 12,  # Estado
-                'B': 15,  # Tipo
-                'C': 50,  # Cruza
-                'D': 12,  # Fila 1
-                'E': 12,  # Fecha 1
-                'F': 12,  # PV 1
-                'G': 15,  # Monto 1
-                'H': 12,  # Fila 2
-                'I': 12,  # Fecha 2
-                'J': 12,  # PV 2
-                'K': 15,  # Monto 2
-                'L': 15   # Diferencia
-            }
-            
-            for col_letter, width in column_widths.items():
-                ws.column_dimensions[col_letter].width = width
-            
-            # Congelar primera fila
-            ws.freeze_panes = 'A2'
-            
-            return wb
-        
         # Crear Excel con formato preservado
         try:
             output = BytesIO()
-            wb = create_excel_with_format(results, sheet_names)
+            wb = create_excel_with_format(results, sheet_names, write_only=True, accounts=accounts)
             
             # Agregar hojas originales preservando formato y valores originales
             if 'original_files_data' in st.session_state:
                 try:
-                    original_data = st.session_state['original_files_data']
-                    
-                    # Crear conjuntos de filas que cruzaron (fila_banco y fila_interno son base 1)
-                    filas_banco_cruzadas = set()
-                    filas_interno_cruzadas = set()
-                    for r in results:
-                        if r['estado'] == 'Conciliado':
-                            if r.get('fila_banco'):
-                                filas_banco_cruzadas.add(r['fila_banco'])
-                            if r.get('fila_interno'):
-                                filas_interno_cruzadas.add(r['fila_interno'])
-                    
-                    # Definir border para las hojas originales
-                    border_original = Border(
-                        left=Side(style='thin'),
-                        right=Side(style='thin'),
-                        top=Side(style='thin'),
-                        bottom=Side(style='thin')
-                    )
-                    
-                    # Agregar hoja con datos originales de la primera hoja
-                    if 'original_df1' in original_data:
-                        df1 = original_data['original_df1']
-                        # Limpiar nombre de hoja (máximo 31 caracteres, sin caracteres inválidos)
-                        sheet_name1 = f"Original_{sheet_names[0]}"[:31].replace('/', '_').replace('\\', '_').replace('?', '_').replace('*', '_').replace('[', '_').replace(']', '_')
-                        ws1 = wb.create_sheet(title=sheet_name1)
-                        
-                        # Escribir encabezados con formato (incluyendo columna Cruce)
-                        num_cols = len(df1.columns)
-                        for c_idx, col_name in enumerate(df1.columns, 1):
-                            cell = ws1.cell(row=1, column=c_idx, value=col_name)
-                            cell.font = Font(bold=True, size=11)
-                            cell.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-                            cell.border = border_original
-                        
-                        # Agregar encabezado de columna "Cruce"
-                        cell_cruce_header = ws1.cell(row=1, column=num_cols + 1, value="Cruce")
-                        cell_cruce_header.font = Font(bold=True, size=11)
-                        cell_cruce_header.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-                        cell_cruce_header.border = border_original
-                        cell_cruce_header.alignment = Alignment(horizontal='center', vertical='center')
-                        
-                        # Escribir datos preservando tipos y formatos originales
-                        for r_idx, (df_idx, row) in enumerate(df1.iterrows(), 2):
-                            # Escribir datos originales
-                            for c_idx, (col_name, value) in enumerate(zip(df1.columns, row), 1):
-                                cell = ws1.cell(row=r_idx, column=c_idx, value=value)
-                                cell.border = border_original
-                                
-                                # Preservar formato de fecha si es fecha
-                                if pd.api.types.is_datetime64_any_dtype(df1[col_name]):
-                                    try:
-                                        cell.number_format = 'dd/mm/yyyy'
-                                    except:
-                                        pass
-                                
-                                # Preservar formato numérico
-                                if pd.api.types.is_numeric_dtype(df1[col_name]) and not pd.isna(value):
-                                    cell.number_format = '#,##0.00'
-                                    cell.alignment = Alignment(horizontal='right', vertical='center')
-                            
-                            # Agregar columna "Cruce"
-                            # df_idx es el índice del DataFrame original (0-based)
-                            # El número de fila en Excel original es df_idx + 2 (1 para encabezado + 1 porque Excel empieza en 1)
-                            fila_num = int(df_idx) + 2 if isinstance(df_idx, (int, float)) else r_idx
-                            cruce_value = "OK" if fila_num in filas_banco_cruzadas else "NO CRUZA"
-                            cell_cruce = ws1.cell(row=r_idx, column=num_cols + 1, value=cruce_value)
-                            cell_cruce.border = border_original
-                            cell_cruce.alignment = Alignment(horizontal='center', vertical='center')
-                            
-                            # Formato de color para la columna Cruce
-                            if cruce_value == "OK":
-                                cell_cruce.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                                cell_cruce.font = Font(bold=True, color="006100")
-                            else:
-                                cell_cruce.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-                                cell_cruce.font = Font(bold=True, color="9C0006")
-                        
-                        # Ajustar ancho de columnas
-                        for c_idx, col_name in enumerate(df1.columns, 1):
-                            col_letter = get_column_letter(c_idx)
-                            ws1.column_dimensions[col_letter].width = max(len(str(col_name)), 12)
-                        # Ajustar ancho de columna Cruce
-                        col_letter_cruce = get_column_letter(num_cols + 1)
-                        ws1.column_dimensions[col_letter_cruce].width = 12
-                    
-                    # Agregar hoja con datos originales de la segunda hoja
-                    if 'original_df2' in original_data:
-                        df2 = original_data['original_df2']
-                        # Limpiar nombre de hoja (máximo 31 caracteres, sin caracteres inválidos)
-                        sheet_name2 = f"Original_{sheet_names[1]}"[:31].replace('/', '_').replace('\\', '_').replace('?', '_').replace('*', '_').replace('[', '_').replace(']', '_')
-                        ws2 = wb.create_sheet(title=sheet_name2)
-                        
-                        # Escribir encabezados con formato (incluyendo columna Cruce)
-                        num_cols2 = len(df2.columns)
-                        for c_idx, col_name in enumerate(df2.columns, 1):
-                            cell = ws2.cell(row=1, column=c_idx, value=col_name)
-                            cell.font = Font(bold=True, size=11)
-                            cell.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-                            cell.border = border_original
-                        
-                        # Agregar encabezado de columna "Cruce"
-                        cell_cruce_header2 = ws2.cell(row=1, column=num_cols2 + 1, value="Cruce")
-                        cell_cruce_header2.font = Font(bold=True, size=11)
-                        cell_cruce_header2.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-                        cell_cruce_header2.border = border_original
-                        cell_cruce_header2.alignment = Alignment(horizontal='center', vertical='center')
-                        
-                        # Escribir datos preservando tipos y formatos originales
-                        for r_idx, (df_idx, row) in enumerate(df2.iterrows(), 2):
-                            # Escribir datos originales
-                            for c_idx, (col_name, value) in enumerate(zip(df2.columns, row), 1):
-                                cell = ws2.cell(row=r_idx, column=c_idx, value=value)
-                                cell.border = border_original
-                                
-                                # Preservar formato de fecha si es fecha
-                                if pd.api.types.is_datetime64_any_dtype(df2[col_name]):
-                                    try:
-                                        cell.number_format = 'dd/mm/yyyy'
-                                    except:
-                                        pass
-                                
-                                # Preservar formato numérico
-                                if pd.api.types.is_numeric_dtype(df2[col_name]) and not pd.isna(value):
-                                    cell.number_format = '#,##0.00'
-                                    cell.alignment = Alignment(horizontal='right', vertical='center')
-                            
-                            # Agregar columna "Cruce"
-                            # df_idx es el índice del DataFrame original (0-based)
-                            # El número de fila en Excel original es df_idx + 2 (1 para encabezado + 1 porque Excel empieza en 1)
-                            fila_num = int(df_idx) + 2 if isinstance(df_idx, (int, float)) else r_idx
-                            cruce_value = "OK" if fila_num in filas_interno_cruzadas else "NO CRUZA"
-                            cell_cruce = ws2.cell(row=r_idx, column=num_cols2 + 1, value=cruce_value)
-                            cell_cruce.border = border_original
-                            cell_cruce.alignment = Alignment(horizontal='center', vertical='center')
-                            
-                            # Formato de color para la columna Cruce
-                            if cruce_value == "OK":
-                                cell_cruce.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                                cell_cruce.font = Font(bold=True, color="006100")
-                            else:
-                                cell_cruce.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-                                cell_cruce.font = Font(bold=True, color="9C0006")
-                        
-                        # Ajustar ancho de columnas
-                        for c_idx, col_name in enumerate(df2.columns, 1):
-                            col_letter = get_column_letter(c_idx)
-                            ws2.column_dimensions[col_letter].width = max(len(str(col_name)), 12)
-                        # Ajustar ancho de columna Cruce
-                        col_letter_cruce2 = get_column_letter(num_cols2 + 1)
-                        ws2.column_dimensions[col_letter_cruce2].width = 12
+                    add_original_sheets(wb, results, sheet_names, st.session_state['original_files_data'])
                 except Exception as e:
                     st.warning(f"Nota: No se pudieron incluir las hojas originales: {str(e)}")
             
@@ -1694,12 +1110,29 @@ def main():
                 label="📥 Descargar Excel Conciliado (con formato preservado)",
                 data=output.getvalue(),
                 file_name=f"conciliacion_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                mime=XLSX_MIME
             )
         except Exception as e:
             st.error(f"❌ Error al generar el archivo Excel: {str(e)}")
             st.exception(e)
         
+        # Copia del libro original con la columna Cruce (formatos, fórmulas y macros del usuario intactos)
+        libros = st.session_state.get('original_files_data', {}).get('libros', [])
+        if libros and st.checkbox("📎 Marcar también el libro original (columna Cruce en sus propias hojas)", value=False):
+            try:
+                marcados = mark_original_workbooks(results, sheet_names, [(contenido, hojas) for _, contenido, hojas in libros])
+                for i, ((nombre, _, _), data) in enumerate(zip(libros, marcados)):
+                    stem, ext = os.path.splitext(nombre)
+                    st.download_button(
+                        label=f"📥 Descargar {nombre} con columna Cruce",
+                        data=data,
+                        file_name=f"{stem}_cruce{ext}",
+                        mime=XLSM_MIME if ext.lower() == '.xlsm' else XLSX_MIME,
+                        key=f"libro_marcado_{i}"
+                    )
+            except Exception as e:
+                st.warning(f"Nota: No se pudo marcar el libro original: {str(e)}")
+        
         # Botón para limpiar
         if st.button("🔄 Nueva Conciliación"):
             if 'results' in st.session_state:
@@ -0,0 +1,47 @@
+"""
+Benchmark de la exportación a Excel: libro normal contra libro de solo escritura
+
+Uso:
+    python benchmarks/bench_exportacion.py [filas_por_lado]
+
+Concilia los lados sintéticos de bench_conciliacion.py y exporta la hoja de
+resultados con create_excel_with_format en ambos modos, midiendo el tiempo
+(armado + guardado) y el pico de memoria de Python (tracemalloc).
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conciliacion
+import exportacion
+from bench_conciliacion import build_side, timed
+
+
+def export(results, path, write_only):
+    wb = exportacion.create_excel_with_format(results, ("Banco", "Interno"), write_only=write_only)
+    wb.save(path)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    banco, interno = build_side(rows, 1), build_side(rows, 2)
+    results = conciliacion.reconcile(banco, interno, engine='vectorizado')
+    print(f"Filas por lado: {rows:,}  (resultados: {len(results):,})")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for label, write_only in (('normal', False), ('solo escritura', True)):
+            path = os.path.join(directory, f"{write_only}.xlsx")
+            tracemalloc.start()
+            _, elapsed = timed(export, results, path, write_only)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {label:15s} {elapsed:8.2f} s  pico {peak / 2**20:8.1f} MB  "
+                  f"archivo {os.path.getsize(path) / 2**20:6.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark de ingesta: ruta fila por fila (df.iterrows) contra ruta columnar
+
+Uso:
+    python benchmarks/bench_ingesta.py [filas]
+
+Genera un extracto sintético con formatos mixtos (fechas datetime, texto con
+y sin hora y seriales de Excel; montos numéricos y en texto europeo/americano; referencias
+LOG/PV/número), procesa ambas rutas, verifica que los registros sean idénticos
+y reporta los tiempos.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+import conciliacion
+
+
+def build_extract(rows, seed=42):
+    """Crea un DataFrame parecido a un extracto bancario real"""
+    rng = np.random.default_rng(seed)
+    base = pd.Timestamp('2025-11-01')
+    days = rng.integers(0, 30, rows)
+    fechas = (base + pd.to_timedelta(days, unit='D')).to_numpy(dtype=object)
+    # Un 20% de las fechas llegan como texto (DD/MM/YYYY o, la mitad, con hora) y un 5% como serial de Excel
+    as_text = rng.random(rows) < 0.20
+    as_serial = rng.random(rows) < 0.05
+    for i in np.flatnonzero(as_text):
+        fechas[i] = fechas[i].strftime('%d/%m/%Y %H:%M:%S' if i % 2 else '%d/%m/%Y')
+    for i in np.flatnonzero(as_serial & ~as_text):
+        fechas[i] = float((fechas[i] - pd.Timestamp('1899-12-30')).days)
+
+    montos = np.round(rng.uniform(1000, 5000000, rows), 2).astype(object)
+    as_text_amount = rng.random(rows) < 0.30
+    for i in np.flatnonzero(as_text_amount):
+        value = montos[i]
+        if i % 2:
+            montos[i] = f"${value:,.2f}"
+        else:
+            montos[i] = f"{value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+    pvs = rng.integers(1, 400, rows)
+    prefixes = np.array(['PV', 'LOG', 'PV ', '', 'Venta PV'])
+    refs = [f"{prefixes[i % len(prefixes)]}{pv}" for i, pv in enumerate(pvs)]
+
+    return pd.DataFrame({
+        'Fecha': fechas,
+        'Valor': montos,
+        'Referencia': refs,
+        'Descripcion': [f"Recaudo punto {pv}" for pv in pvs],
+        'Oficina': rng.integers(1, 50, rows),
+    })
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    df = build_extract(rows)
+    columns = ('Fecha', 'Valor', 'Referencia', 'Descripcion')
+
+    (records, error), row_time = timed(conciliacion.process_dataframe, df, *columns)
+    (frame, error_col), col_time = timed(conciliacion.process_dataframe, df, *columns, columnar=True)
+    assert error is None and error_col is None
+
+    columnar_records = frame.to_dict('records')
+    assert len(records) == len(columnar_records)
+    for row, col in zip(records, columnar_records):
+        row = {k: v for k, v in row.items() if k != '_original'}
+        assert row == col, (row, col)
+
+    print(f"Filas: {rows:,}  (registros válidos: {len(records):,})")
+    print(f"Fila por fila (iterrows): {row_time:8.2f} s")
+    print(f"Columnar:                 {col_time:8.2f} s")
+    print(f"Aceleración:              {row_time / col_time:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Benchmark de escalado del motor 'paralelo' (fragmentos por fecha en varios procesos)
+
+Uso:
+    python benchmarks/bench_paralelo.py [filas_por_lado] [tolerancia_dias]
+
+Usa los mismos lados sintéticos que bench_conciliacion.py, mide el motor
+vectorizado como referencia y el motor paralelo con 1, 2, 4 y 8 procesos, y
+verifica que todos den resultados idénticos.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conciliacion
+from bench_conciliacion import build_side, plain, timed
+
+WORKERS = (1, 2, 4, 8)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    date_tolerance = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    banco, interno = build_side(rows, 1), build_side(rows, 2)
+    expected, base_time = timed(conciliacion.reconcile, banco, interno, engine='vectorizado',
+                                date_tolerance=date_tolerance)
+    expected = plain(expected)
+    print(f"Filas por lado: {rows:,}  tolerancia: ±{date_tolerance} días  CPUs: {os.cpu_count()}")
+    print(f"  vectorizado:     {base_time:8.2f} s")
+    for workers in WORKERS:
+        results, elapsed = timed(conciliacion.reconcile, banco, interno, engine='paralelo',
+                                 workers=workers, date_tolerance=date_tolerance)
+        assert plain(results) == expected
+        print(f"  paralelo x{workers}:     {elapsed:8.2f} s  ({base_time / elapsed:4.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark del extractor de PV: versión de seis regex por llamada contra la de un solo recorrido memoizada
+
+Uso:
+    python benchmarks/bench_pv.py [filas] [valores_distintos]
+
+Genera una columna de referencias con pocos valores distintos repetidos (como
+las hojas reales), verifica que extract_pv dé exactamente lo mismo que la
+implementación anterior (incluida la regla LOG -> PV) y mide llamadas por
+segundo de ambas, además de extract_pv_column.
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+import conciliacion
+
+
+def extract_pv_reference(text):
+    """extract_pv anterior (una regex por caso, sin memoria), como referencia"""
+    if pd.isna(text) or text == '':
+        return ''
+    text_str = str(text).upper().strip()
+    if not text_str:
+        return ''
+    log_match = re.search(r'LOG\s*0*(\d+)', text_str)
+    if log_match:
+        return f"PV{log_match.group(1).zfill(3)}"
+    pv_match = re.search(r'PV\s*0*(\d+)', text_str)
+    if pv_match:
+        return f"PV{pv_match.group(1).zfill(3)}"
+    num_match = re.match(r'^0*(\d+)$', text_str)
+    if num_match:
+        return f"PV{num_match.group(1).zfill(3)}"
+    numbers = re.findall(r'(\d{2,})', text_str)
+    if numbers:
+        return f"PV{numbers[-1].zfill(3)}"
+    any_num = re.search(r'(\d+)', text_str)
+    if any_num:
+        return f"PV{any_num.group(1).zfill(3)}"
+    cleaned = re.sub(r'[^A-Z0-9]', '', text_str)
+    if cleaned and len(cleaned) >= 2:
+        num_in_cleaned = re.search(r'(\d+)', cleaned)
+        if num_in_cleaned:
+            return f"PV{num_in_cleaned.group(1).zfill(3)}"
+    return ''
+
+
+def build_references(rows, distinct, seed=3):
+    """Referencias con formatos variados (LOG, PV, número solo, texto libre) y muchos repetidos"""
+    rng = np.random.default_rng(seed)
+    numbers = rng.integers(1, 2000, distinct)
+    formats = ['LOG{}', 'LOG {:03d}', 'PV{}', 'PV {:04d}', '{}', '{:05d}', 'Recaudo punto {} ref 7',
+               'TRANSF 2025-{} ', 'pago pv-{}', 'Abono']
+    pool = [formats[i % len(formats)].format(n) for i, n in enumerate(numbers)]
+    return [pool[i] for i in rng.integers(0, distinct, rows)] + [None, float('nan'), 81, 81.0, '']
+
+
+def calls_per_second(func, values):
+    start = time.perf_counter()
+    for value in values:
+        func(value)
+    return len(values) / (time.perf_counter() - start)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    values = build_references(rows, distinct)
+    assert [extract_pv_reference(v) for v in values] == [conciliacion.extract_pv(v) for v in values]
+    assert list(conciliacion.extract_pv_column(values)) == [extract_pv_reference(v) for v in values]
+    print(f"{len(values):,} referencias, {distinct} valores distintos: resultados idénticos")
+
+    conciliacion._extract_pv_text.cache_clear()
+    before = calls_per_second(extract_pv_reference, values)
+    after = calls_per_second(conciliacion.extract_pv, values)
+    print(f"  anterior:           {before:14,.0f} llamadas/s")
+    print(f"  un recorrido + LRU: {after:14,.0f} llamadas/s  ({after / before:.1f}x)")
+    print(f"  {conciliacion._extract_pv_text.cache_info()}")
+
+    start = time.perf_counter()
+    conciliacion.extract_pv_column(values)
+    print(f"  extract_pv_column:  {len(values) / (time.perf_counter() - start):14,.0f} filas/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark de memoria: pd.read_excel + modo columnar contra lectura en streaming
+
+Uso:
+    python benchmarks/bench_streaming.py [escala] [filas_por_bloque]
+
+Construye un libro con la hoja 'EXTRACTO BANCO' de public/sample/EXTRACTO_BANCO.xlsm
+repetida `escala` veces, lo procesa en un proceso hijo por cada modo y reporta el
+pico de memoria residente (RSS) de cada uno. Requiere el módulo `resource` (Linux/macOS).
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE = os.path.join(ROOT, 'public', 'sample', 'EXTRACTO_BANCO.xlsm')
+SHEET = 'EXTRACTO BANCO'
+
+
+def build_scaled_workbook(path, scale):
+    """Escribe la hoja de ejemplo repetida `scale` veces"""
+    import openpyxl
+
+    source = openpyxl.load_workbook(SAMPLE, read_only=True, data_only=True)
+    ws = source[SHEET]
+    # La hoja de ejemplo declara 1.048.576 filas; solo interesan las que tienen datos
+    ws.reset_dimensions()
+    rows = [row for row in ws.iter_rows(values_only=True) if any(v is not None for v in row)]
+    source.close()
+    header, data = rows[0], rows[1:]
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(SHEET)
+    ws.append(header)
+    for _ in range(scale):
+        for row in data:
+            ws.append(row)
+    wb.save(path)
+    return len(data) * scale
+
+
+def run_mode(mode, path, chunk_size):
+    """Procesa el libro en este proceso y retorna filas, segundos y pico de RSS"""
+    import resource
+
+    import conciliacion
+
+    start = time.perf_counter()
+    if mode == 'read_excel':
+        data, error = conciliacion.process_excel_file(path, SHEET, columnar=True)
+    else:
+        data, error = conciliacion.process_excel_file_streaming(path, SHEET, chunk_size=chunk_size)
+    elapsed = time.perf_counter() - start
+    if error:
+        raise SystemExit(error)
+
+    # ru_maxrss está en KiB en Linux y en bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    return {'rows': len(data), 'seconds': elapsed, 'peak_rss_mb': peak_mb}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        print(json.dumps(run_mode(sys.argv[2], sys.argv[3], int(sys.argv[4]))))
+        return
+
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'extracto_escalado.xlsx')
+        rows = build_scaled_workbook(path, scale)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(f"Libro: {rows:,} filas x escala {scale} ({size_mb:,.1f} MB en disco)")
+
+        results = {}
+        for mode in ('read_excel', 'streaming'):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run', mode, path, str(chunk_size)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    for mode, r in results.items():
+        print(f"{mode:>11}: {r['rows']:>9,} registros  {r['seconds']:7.1f} s  pico RSS {r['peak_rss_mb']:8.1f} MB")
+    saved = results['read_excel']['peak_rss_mb'] - results['streaming']['peak_rss_mb']
+    print(f"Diferencia de pico RSS: {saved:,.1f} MB menos en streaming")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3041 @@
+"""
+Núcleo de la conciliación bancaria, sin interfaz
+
+Lectura y normalización de hojas Excel, motores de cruce y utilidades que no
+dependen de Streamlit. app.py construye la interfaz sobre este módulo; también
+puede importarse desde scripts o procesos de trabajo sin cargar Streamlit.
+"""
+import pandas as pd
+import numpy as np
+import openpyxl
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.io.parsers import TextParser
+from datetime import datetime
+from collections import OrderedDict, deque
+from functools import lru_cache
+from collections.abc import Mapping
+from contextlib import closing, contextmanager
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import gc
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from io import BytesIO
+
+def normalize_date(date_value):
+    """Normaliza fechas a formato YYYY-MM-DD - Versión mejorada para coincidencias exactas"""
+    if pd.isna(date_value) or date_value == '':
+        return ''
+    
+    # Si es datetime o Timestamp, convertir directamente
+    if isinstance(date_value, (pd.Timestamp, datetime)):
+        try:
+            return date_value.strftime('%Y-%m-%d')
+        except:
+            return ''
+    
+    # Si es string, intentar parsear
+    if isinstance(date_value, str):
+        date_str = str(date_value).strip()
+        
+        # Si ya está en formato YYYY-MM-DD, retornar directamente
+        if re.match(r'^\d{4}-\d{2}-\d{2}$', date_str):
+            return date_str
+        
+        # Formatos comunes con regex más estricto
+        patterns = [
+            # DD/MM/YYYY o D/M/YYYY
+            (r'^(\d{1,2})[/\-](\d{1,2})[/\-](\d{4})$', lambda m: f"{m.group(3)}-{m.group(2).zfill(2)}-{m.group(1).zfill(2)}"),
+            # YYYY-MM-DD o YYYY/MM/DD
+            (r'^(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})$', lambda m: f"{m.group(1)}-{m.group(2).zfill(2)}-{m.group(3).zfill(2)}"),
+            # DD.MM.YYYY
+            (r'^(\d{1,2})\.(\d{1,2})\.(\d{4})$', lambda m: f"{m.group(3)}-{m.group(2).zfill(2)}-{m.group(1).zfill(2)}"),
+            # YYYY.MM.DD
+            (r'^(\d{4})\.(\d{1,2})\.(\d{1,2})$', lambda m: f"{m.group(1)}-{m.group(2).zfill(2)}-{m.group(3).zfill(2)}"),
+        ]
+        
+        for pattern, formatter in patterns:
+            match = re.match(pattern, date_str)
+            if match:
+                try:
+                    formatted = formatter(match)
+                    # Validar que la fecha sea válida
+                    year, month, day = map(int, formatted.split('-'))
+                    if 1900 <= year <= 2100 and 1 <= month <= 12 and 1 <= day <= 31:
+                        return formatted
+                except:
+                    continue
+        
+        # Intentar parsear con pandas (más flexible)
+        try:
+            parsed = pd.to_datetime(date_str, dayfirst=True, errors='coerce')
+            if pd.notna(parsed):
+                return parsed.strftime('%Y-%m-%d')
+        except:
+            pass
+        
+        # Si no se pudo parsear, retornar string vacío para evitar falsos positivos
+        return ''
+    
+    # Si es número (fecha serial de Excel), convertir
+    if isinstance(date_value, (int, float)):
+        try:
+            # Intentar convertir desde fecha serial de Excel
+            if date_value > 1 and date_value < 1000000:  # Rango razonable para fechas Excel
+                excel_date = pd.Timestamp('1900-01-01') + pd.Timedelta(days=int(date_value) - 2)
+                return excel_date.strftime('%Y-%m-%d')
+        except:
+            pass
+    
+    return ''
+
+# Un solo recorrido del texto para extract_pv: LOG###, PV### y corridas de dígitos,
+# de izquierda a derecha. Ninguna alternativa puede consumir el inicio de otra
+# (LOG y PV empiezan con letras distintas y las corridas solo tienen dígitos), así
+# que la primera de cada tipo es la misma que daría re.search con su patrón
+_PV_SCANNER = re.compile(r'LOG\s*0*(\d+)|PV\s*0*(\d+)|(\d+)')
+_PV_NORMALIZED = re.compile(r'^PV\d+$')
+_DIGITS = re.compile(r'(\d+)')
+_ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# Valores distintos de referencia recordados por extract_pv (las columnas repiten pocos valores)
+PV_CACHE_SIZE = 65536
+
+def extract_pv(text):
+    """Extrae código PV de un texto - Versión mejorada para coincidencias exactas, incluyendo LOG
+    
+    Prioridad: LOG### (se normaliza a PV###), PV###, el texto es solo un
+    número, el último número de 2 o más dígitos y, por último, el primer
+    dígito. Memoizado por texto (ver _extract_pv_text).
+    """
+    if type(text) is str:
+        return _extract_pv_text(text) if text else ''
+    if pd.isna(text) or text == '':
+        return ''
+    return _extract_pv_text(str(text))
+
+@lru_cache(maxsize=PV_CACHE_SIZE)
+def _extract_pv_text(text):
+    text_str = text.upper().strip()
+    
+    # Si está vacío después de limpiar, retornar vacío
+    if not text_str:
+        return ''
+    
+    pv_num = None
+    runs = []
+    for match in _PV_SCANNER.finditer(text_str):
+        log_num, num, run = match.groups()
+        if log_num is not None:
+            # Caso 1: LOG seguido de números (LOG81 -> PV081), gana sobre todo lo demás
+            return f"PV{log_num.zfill(3)}"
+        if num is not None:
+            # Caso 2: PV### (con o sin ceros a la izquierda)
+            if pv_num is None:
+                pv_num = num
+        elif pv_num is None:
+            runs.append(match)
+    if pv_num is not None:
+        return f"PV{pv_num.zfill(3)}"
+    if not runs:
+        return ''
+    
+    # Caso 3: Es solo un número (sin PV ni LOG) - como "81": sin ceros a la izquierda
+    if len(runs) == 1 and runs[0].start() == 0 and runs[0].end() == len(text_str):
+        return f"PV{(runs[0].group(3).lstrip('0') or '0').zfill(3)}"
+    
+    # Caso 4: el último número de 2 o más dígitos (más probable que sea el PV)
+    for match in reversed(runs):
+        if len(match.group(3)) >= 2:
+            return f"PV{match.group(3).zfill(3)}"
+    
+    # Caso 5: el primer número (todos son de un dígito)
+    return f"PV{runs[0].group(3).zfill(3)}"
+
+def normalize_amount(value):
+    """Normaliza montos a número"""
+    if pd.isna(value):
+        return 0.0
+    
+    if isinstance(value, (int, float)):
+        return abs(float(value))
+    
+    if isinstance(value, str):
+        # Limpiar string
+        cleaned = re.sub(r'[$€£¥₱₹¢\s]', '', value)
+        
+        # Detectar formato
+        if ',' in cleaned and '.' in cleaned:
+            # Determinar cuál es decimal
+            last_comma = cleaned.rfind(',')
+            last_dot = cleaned.rfind('.')
+            if last_comma > last_dot:
+                # Formato europeo: 1.234,56
+                cleaned = cleaned.replace('.', '').replace(',', '.')
+            else:
+                # Formato americano: 1,234.56
+                cleaned = cleaned.replace(',', '')
+        elif ',' in cleaned:
+            # Solo coma, puede ser decimal
+            if re.search(r',\d{1,2}$', cleaned):
+                cleaned = cleaned.replace(',', '.')
+            else:
+                cleaned = cleaned.replace(',', '')
+        else:
+            # Solo punto o sin separadores
+            pass
+        
+        try:
+            return abs(float(re.sub(r'[^0-9.-]', '', cleaned)))
+        except:
+            return 0.0
+
+    return 0.0
+
+# ---------------------------------------------------------------------------
+# Normalización por columnas (modo columnar)
+# Cada función recibe una columna completa, tal como la vería df.iterrows(), y
+# devuelve celda a celda exactamente lo mismo que la función escalar. Los casos
+# comunes se resuelven con operaciones vectorizadas de pandas/NumPy y las celdas
+# que no encajan se delegan a la función escalar.
+# ---------------------------------------------------------------------------
+
+# Patrones de normalize_date restringidos a dígitos ASCII: (patrón, grupos año/mes/día)
+_DATE_PATTERNS_COLUMNAR = [
+    (r'^([0-9]{1,2})[/\-]([0-9]{1,2})[/\-]([0-9]{4})$', (2, 1, 0)),
+    (r'^([0-9]{4})[/\-]([0-9]{1,2})[/\-]([0-9]{1,2})$', (0, 1, 2)),
+    (r'^([0-9]{1,2})\.([0-9]{1,2})\.([0-9]{4})$', (2, 1, 0)),
+    (r'^([0-9]{4})\.([0-9]{1,2})\.([0-9]{1,2})$', (0, 1, 2)),
+]
+
+# Formatos de fecha (con hora o mes abreviado) que normalize_date solo resuelve en su
+# respaldo pd.to_datetime(dayfirst=True). Cada candidato es una cadena de formatos fijos
+# que se prueban en orden: con dayfirst, pandas lee "2025-01-02 10:30" como 1 de febrero
+# cuando puede, de ahí las variantes con día y mes invertidos. infer_date_format se
+# queda solo con los que dan lo mismo que normalize_date en esta versión de pandas
+_DATE_FORMAT_CANDIDATES = [
+    ('%d/%m/%Y %H:%M:%S',),
+    ('%d/%m/%Y %H:%M',),
+    ('%d/%m/%Y %I:%M:%S %p',),
+    ('%d-%m-%Y %H:%M:%S',),
+    ('%d-%m-%Y %H:%M',),
+    ('%d.%m.%Y %H:%M:%S',),
+    ('%d-%b-%Y',),
+    ('%d %b %Y',),
+    ('%Y-%d-%m %H:%M:%S', '%Y-%m-%d %H:%M:%S'),
+    ('%Y-%m-%d %H:%M:%S',),
+    ('%Y-%d-%m %H:%M', '%Y-%m-%d %H:%M'),
+    ('%Y-%m-%d %H:%M',),
+    ('%Y-%d-%m %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S.%f'),
+    ('%Y-%m-%d %H:%M:%S.%f',),
+    ('%Y-%d-%mT%H:%M:%S', '%Y-%m-%dT%H:%M:%S'),
+    ('%Y-%m-%dT%H:%M:%S',),
+    ('%Y/%d/%m %H:%M:%S', '%Y/%m/%d %H:%M:%S'),
+    ('%Y/%m/%d %H:%M:%S',),
+]
+
+# Celdas de texto que se miran para elegir el formato de una columna
+DATE_FORMAT_SAMPLE = 200
+
+# Fechas seriales de Excel que se convierten vectorizadas; el resto va a la ruta escalar
+_MAX_SERIAL_COLUMNAR = 100000
+
+def _apply_scalar(values, mask, func, result):
+    """Aplica la función escalar a las celdas marcadas en mask"""
+    if mask.any():
+        # Iterar el array NumPy conserva los escalares numpy que entrega iterrows()
+        result[mask] = [func(v) for v in values[mask].to_numpy()]
+
+def _format_datetimes(values):
+    """Formatea una lista de Timestamps/datetime como YYYY-MM-DD, con respaldo escalar"""
+    try:
+        index = pd.DatetimeIndex(values)
+        if len(index) and index.year.min() >= 1000:
+            return index.strftime('%Y-%m-%d').tolist()
+    except Exception:
+        pass
+    return [normalize_date(v) for v in values]
+
+def _excel_serials_to_dates(values):
+    """Convierte números seriales de Excel a YYYY-MM-DD igual que normalize_date"""
+    values = np.asarray(values, dtype='float64')
+    result = np.full(len(values), '', dtype=object)
+    in_range = (values > 1) & (values < 1000000)
+    fast = in_range & (values < _MAX_SERIAL_COLUMNAR)
+    if fast.any():
+        days = np.trunc(values[fast]).astype('int64') - 2
+        dates = np.datetime64('1900-01-01', 'D') + days.astype('timedelta64[D]')
+        result[fast] = np.datetime_as_string(dates, unit='D').astype(object)
+    slow = in_range & ~fast
+    if slow.any():
+        result[slow] = [normalize_date(v) for v in values[slow].tolist()]
+    return result
+
+# Clasificación de celdas de columnas object por tipo Python exacto
+_KIND_OTHER, _KIND_STR, _KIND_NUMBER, _KIND_DATETIME = 0, 1, 2, 3
+_VALUE_KINDS = {
+    str: _KIND_STR,
+    int: _KIND_NUMBER,
+    float: _KIND_NUMBER,
+    np.float64: _KIND_NUMBER,
+    pd.Timestamp: _KIND_DATETIME,
+    datetime: _KIND_DATETIME,
+}
+
+def _value_kinds(values, nulls):
+    """Clase de cada celda de una columna object (_KIND_*); las nulas quedan como -1"""
+    kinds = np.fromiter((_VALUE_KINDS.get(type(v), _KIND_OTHER) for v in values.tolist()),
+                        dtype='int8', count=len(values))
+    kinds[nulls] = -1
+    return kinds
+
+def _parse_date_formats(text, formats):
+    """Parsea textos con una cadena de formatos fijos, vectorizado; '' donde ninguno aplica"""
+    result = np.full(len(text), '', dtype=object)
+    pending = np.ones(len(text), dtype=bool)
+    for fmt in formats:
+        if not pending.any():
+            break
+        parsed = pd.to_datetime(text[pending], format=fmt, errors='coerce')
+        ok = parsed.notna().to_numpy()
+        if ok.any():
+            hit = np.flatnonzero(pending)[ok]
+            result[hit] = _format_datetimes(parsed[ok].tolist())
+            pending[hit] = False
+    return result
+
+@lru_cache(maxsize=None)
+def _date_candidate_agrees(formats):
+    """True si la cadena de formatos lee una fecha de prueba ambigua igual que normalize_date"""
+    probe = datetime(2001, 2, 3, 16, 5, 6).strftime(formats[-1])
+    return _parse_date_formats(pd.Series([probe]), formats)[0] == normalize_date(probe)
+
+def infer_date_format(text, sample_size=DATE_FORMAT_SAMPLE):
+    """Cadena de formatos (de _DATE_FORMAT_CANDIDATES) que más textos de una muestra reconoce
+    
+    Se mira una vez por columna, sobre los primeros sample_size textos. Solo
+    cuentan los candidatos que dan exactamente lo mismo que normalize_date en
+    la muestra y en una fecha de prueba ambigua. None si ninguno reconoce nada.
+    """
+    sample = pd.Series(text).head(sample_size).reset_index(drop=True)
+    if sample.empty:
+        return None
+    expected = None
+    best, best_hits = None, 0
+    for formats in _DATE_FORMAT_CANDIDATES:
+        parsed = _parse_date_formats(sample, formats)
+        hits = int((parsed != '').sum())
+        if hits <= best_hits or not _date_candidate_agrees(formats):
+            continue
+        if expected is None:
+            expected = np.array([normalize_date(v) for v in sample.tolist()], dtype=object)
+        if (parsed[parsed != ''] == expected[parsed != '']).all():
+            best, best_hits = formats, hits
+    return best
+
+def normalize_date_column(values, cache=None):
+    """Versión columnar de normalize_date: retorna un array de strings YYYY-MM-DD ('' si no es fecha)
+    
+    cache: NormalizationCache opcional para los textos que pasan a la ruta escalar.
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    result = np.full(len(values), '', dtype=object)
+    if values.empty:
+        return result
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        valid = values.notna().to_numpy()
+        if valid.any():
+            result[valid] = _format_datetimes(values[valid])
+        return result
+
+    if values.dtype == np.float64:
+        return _excel_serials_to_dates(values.to_numpy())
+
+    # Texto con dtype propio de pandas (str): mismas celdas que una columna object
+    if values.dtype != object and pd.api.types.is_string_dtype(values):
+        values = values.astype(object)
+
+    if values.dtype != object:
+        _apply_scalar(values, np.ones(len(values), dtype=bool), normalize_date, result)
+        return result
+
+    nulls = values.isna().to_numpy()
+    kinds = _value_kinds(values, nulls)
+    is_str = kinds == _KIND_STR
+    is_number = kinds == _KIND_NUMBER
+    is_datetime = kinds == _KIND_DATETIME
+    other = kinds == _KIND_OTHER
+
+    if is_number.any():
+        result[is_number] = _excel_serials_to_dates(values[is_number].astype('float64'))
+    if is_datetime.any():
+        result[is_datetime] = _format_datetimes(values[is_datetime].tolist())
+    _apply_scalar(values, other, normalize_date, result)
+
+    if is_str.any():
+        positions = np.flatnonzero(is_str)
+        text = values[is_str].str.strip().reset_index(drop=True)
+        pending = np.ones(len(text), dtype=bool)
+
+        # Ya en formato YYYY-MM-DD
+        iso = text.str.match(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}$').to_numpy(dtype=bool)
+        result[positions[iso]] = text[iso].tolist()
+        pending &= ~iso
+
+        # Patrones en el orden en que más aparecen en una muestra: casi siempre basta el primero
+        sample = text[pending].head(DATE_FORMAT_SAMPLE)
+        patterns = sorted(_DATE_PATTERNS_COLUMNAR, key=lambda item: -int(sample.str.match(item[0]).sum()))
+        for pattern, (y, m, d) in patterns:
+            if not pending.any():
+                break
+            parts = text[pending].str.extract(pattern)
+            matched = parts[0].notna().to_numpy()
+            if not matched.any():
+                continue
+            parts = parts[matched]
+            year = parts[y].astype('int64')
+            month = parts[m].astype('int64')
+            day = parts[d].astype('int64')
+            ok = ((year >= 1900) & (year <= 2100) & (month >= 1) & (month <= 12) &
+                  (day >= 1) & (day <= 31)).to_numpy()
+            formatted = parts[y] + '-' + parts[m].str.zfill(2) + '-' + parts[d].str.zfill(2)
+            # Fechas coincidentes pero inválidas siguen pendientes para la ruta escalar
+            hit = np.flatnonzero(pending)[np.flatnonzero(matched)[ok]]
+            result[positions[hit]] = formatted[ok].tolist()
+            pending[hit] = False
+
+        # Fechas con hora o mes abreviado: un formato fijo inferido de la muestra, en una sola llamada
+        if pending.any():
+            formats = infer_date_format(text[pending])
+            if formats is not None:
+                parsed = _parse_date_formats(text[pending], formats)
+                ok = parsed != ''
+                hit = np.flatnonzero(pending)[ok]
+                result[positions[hit]] = parsed[ok].tolist()
+                pending[hit] = False
+
+        # Formatos restantes: ruta escalar (incluye el respaldo con pd.to_datetime), una vez por texto distinto
+        if pending.any():
+            leftovers = values[is_str].iloc[np.flatnonzero(pending)]
+            codes, uniques = pd.factorize(leftovers)
+            if cache is not None:
+                normalized = cache.apply('fecha', normalize_date, uniques.tolist())
+            else:
+                normalized = [normalize_date(v) for v in uniques]
+            result[positions[pending]] = np.array(normalized, dtype=object)[codes]
+
+    return result
+
+# ---------------------------------------------------------------------------
+# Montos por columna: configuración regional detectada una vez por columna
+# Cada celda de texto aporta evidencia del separador decimal (ambos separadores,
+# un separador repetido o uno seguido de 1-2 dígitos al final). La región de la
+# columna es la que domina esa evidencia en una muestra; las celdas que no se
+# deciden solas ("1.234", "1,234") se leen con ella, y si la muestra no alcanza
+# se marcan como ambiguas en lugar de adivinarse fila por fila.
+# ---------------------------------------------------------------------------
+
+AMOUNT_LOCALE_SAMPLE = 500
+AMOUNT_LOCALE_MIN_SHARE = 0.9
+# Región -> (separador decimal, separador de miles)
+AMOUNT_LOCALES = {
+    'europeo': (',', '.'),
+    'americano': ('.', ','),
+}
+_AMOUNT_SYMBOLS = r'[$€£¥₱₹¢\s]'
+
+def _amount_evidence(cleaned):
+    """Separador decimal que muestra cada texto por sí solo: ',' , '.' o '' si no se decide
+
+    También retorna la máscara de celdas indecisas (un único separador seguido
+    de exactamente 3 dígitos al final).
+    """
+    has_comma = cleaned.str.contains(',', regex=False).to_numpy(dtype=bool)
+    has_dot = cleaned.str.contains('.', regex=False).to_numpy(dtype=bool)
+    last_comma = cleaned.str.rfind(',').to_numpy()
+    last_dot = cleaned.str.rfind('.').to_numpy()
+    evidence = np.full(len(cleaned), '', dtype=object)
+
+    # Ambos separadores: el último es el decimal
+    both = has_comma & has_dot
+    evidence[both & (last_comma > last_dot)] = ','
+    evidence[both & (last_comma < last_dot)] = '.'
+
+    undecided = np.zeros(len(cleaned), dtype=bool)
+    for sep, other in ((',', '.'), ('.', ',')):
+        only = (has_comma if sep == ',' else has_dot) & ~both
+        if not only.any():
+            continue
+        repeated = only & (cleaned.str.count(re.escape(sep)).to_numpy() > 1)
+        # Separador repetido: son miles, el decimal es el otro
+        evidence[repeated] = other
+        single = only & ~repeated
+        thousands_like = single & cleaned.str.contains(re.escape(sep) + r'\d{3}$', regex=True).to_numpy(dtype=bool)
+        undecided |= thousands_like
+        # Cualquier otro caso (1-2 dígitos, o más de 3) solo puede ser decimal
+        evidence[single & ~thousands_like] = sep
+    return evidence, undecided
+
+def detect_amount_locale(values, sample_size=AMOUNT_LOCALE_SAMPLE):
+    """Región de los montos en texto de una columna ('europeo', 'americano' o None)
+
+    Se decide con las primeras sample_size celdas que muestran su separador
+    decimal; None si no hay evidencia o si ninguna región llega a
+    AMOUNT_LOCALE_MIN_SHARE de la muestra.
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    text = values[[type(v) is str for v in values.tolist()]]
+    evidence, _ = _amount_evidence(text.str.replace(_AMOUNT_SYMBOLS, '', regex=True))
+    return _locale_from_evidence(evidence[evidence != ''][:sample_size])
+
+def _locale_from_evidence(evidence):
+    if not len(evidence):
+        return None
+    decimal_comma = float(np.mean(evidence == ','))
+    if decimal_comma >= AMOUNT_LOCALE_MIN_SHARE:
+        return 'europeo'
+    if 1 - decimal_comma >= AMOUNT_LOCALE_MIN_SHARE:
+        return 'americano'
+    return None
+
+def _amount_cents(amounts):
+    """Centavos int64 de montos float ya absolutos, iguales a int(round(round(x, 2) * 100))"""
+    amounts = np.asarray(amounts, dtype='float64')
+    cents = np.zeros(len(amounts), dtype='int64')
+    finite = np.isfinite(amounts)
+    scaled = amounts[finite] * 100
+    exact = np.rint(scaled)
+    # Los casi empates dependen del redondeo decimal exacto de round(): ruta escalar
+    tie = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) < 1e-6
+    if tie.any():
+        exact[tie] = [int(round(round(x, 2) * 100)) for x in amounts[finite][tie].tolist()]
+    cents[finite] = exact.astype('int64')
+    return cents
+
+def _text_cents(cleaned):
+    """Centavos de textos ya normalizados a punto decimal (sin separador de miles)"""
+    cleaned = cleaned.str.replace(r'[^0-9.-]', '', regex=True)
+    cents = np.zeros(len(cleaned), dtype='int64')
+    # Solo lo que float() acepta; el resto es 0 igual que en normalize_amount
+    parseable = cleaned.str.match(r'^-?([0-9]+\.?[0-9]*|\.[0-9]+)$').to_numpy(dtype=bool)
+    if not parseable.any():
+        return cents
+    text = cleaned[parseable].str.lstrip('-')
+    parts = text.str.extract(r'^(\d*)\.?(\d*)$')
+    whole, fraction = parts[0], parts[1]
+    # Hasta 2 decimales y 15 dígitos enteros: centavos exactos sin pasar por float
+    exact = ((fraction.str.len() <= 2) & (whole.str.len() <= 15)).to_numpy(dtype=bool)
+    parsed = np.zeros(len(text), dtype='int64')
+    if exact.any():
+        parsed[exact] = (whole[exact].replace('', '0').astype('int64').to_numpy() * 100
+                         + fraction[exact].str.ljust(2, '0').astype('int64').to_numpy())
+    if (~exact).any():
+        parsed[~exact] = _amount_cents(text[~exact].to_numpy(dtype=object).astype('float64'))
+    cents[parseable] = parsed
+    return cents
+
+def parse_amount_column(values, sample_size=AMOUNT_LOCALE_SAMPLE, locale=None):
+    """Montos de una columna en centavos int64, con la región detectada una vez por columna
+
+    Retorna (centavos, ambiguos, región). Las celdas de texto que muestran su
+    separador decimal se leen con él; las indecisas ("1.234") se leen con la
+    región de la columna (locale, o la detectada con detect_amount_locale). Si
+    no hay región, conservan la lectura de normalize_amount y quedan marcadas
+    en ambiguos. Los números y demás tipos siguen a normalize_amount.
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    cents = np.zeros(len(values), dtype='int64')
+    ambiguous = np.zeros(len(values), dtype=bool)
+    if values.empty:
+        return cents, ambiguous, locale
+
+    if values.dtype.kind in 'iuf':
+        return _amount_cents(np.abs(values.astype('float64').fillna(0.0).to_numpy())), ambiguous, locale
+    if values.dtype != object:
+        values = values.astype(object)
+
+    nulls = values.isna().to_numpy()
+    kinds = _value_kinds(values, nulls)
+    is_str = kinds == _KIND_STR
+    is_number = kinds == _KIND_NUMBER
+    # Fechas y demás tipos pasan por la función escalar
+    other = (kinds == _KIND_OTHER) | (kinds == _KIND_DATETIME)
+
+    if is_number.any():
+        cents[is_number] = _amount_cents(np.abs(values[is_number].astype('float64').to_numpy()))
+    if other.any():
+        cents[other] = _amount_cents([normalize_amount(v) for v in values[other].to_numpy()])
+    if not is_str.any():
+        return cents, ambiguous, locale
+
+    cleaned = values[is_str].str.replace(_AMOUNT_SYMBOLS, '', regex=True)
+    evidence, undecided = _amount_evidence(cleaned)
+    if locale is None:
+        locale = _locale_from_evidence(evidence[evidence != ''][:sample_size])
+
+    if locale is not None:
+        evidence[undecided] = AMOUNT_LOCALES[locale][0]
+    else:
+        # Lectura de normalize_amount: la coma con 3 dígitos es de miles y el punto, decimal
+        evidence[undecided] = '.'
+        positions = np.flatnonzero(is_str)
+        ambiguous[positions[undecided]] = True
+
+    decimal_comma = evidence == ','
+    decimal_dot = evidence == '.'
+    # Coma decimal: fuera los puntos de miles y la coma pasa a punto
+    cleaned = cleaned.mask(decimal_comma, cleaned.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    # Punto decimal: fuera las comas de miles
+    cleaned = cleaned.mask(decimal_dot, cleaned.str.replace(',', '', regex=False))
+    cents[is_str] = _text_cents(cleaned)
+    return cents, ambiguous, locale
+
+def extract_pv_column(values):
+    """Versión columnar de extract_pv: retorna un array de códigos PV### ('' si no hay)
+    
+    Las columnas de referencia repiten pocos valores distintos: extract_pv se
+    aplica una vez por texto distinto y el resultado se reparte por código.
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    result = np.full(len(values), '', dtype=object)
+    if values.empty:
+        return result
+
+    valid = ~values.isna().to_numpy()
+    if not valid.any():
+        return result
+    # Por texto (como str() en extract_pv): 1 y True son iguales como claves, no como texto
+    codes, uniques = pd.factorize(values[valid].map(str))
+    result[valid] = np.array([_extract_pv_text(text) if text else '' for text in uniques], dtype=object)[codes]
+    return result
+
+# ---------------------------------------------------------------------------
+# Detección de columnas
+# Primero por nombre (los patrones de cada campo, en orden de prioridad) y, si
+# ningún nombre coincide, por contenido: una muestra acotada de todas las
+# columnas se clasifica en una sola pasada vectorizada y cada columna recibe un
+# puntaje por campo (proporción de celdas con pinta de fecha, monto, etc.).
+# ---------------------------------------------------------------------------
+
+COLUMN_PATTERNS = {
+    'fecha': [
+        'fecha', 'date', 'fec', 'dia', 'day', 'fechapago', 'fechaoperacion',
+        'fechacontabilizacion', 'fechavencimiento', 'foperacion', 'fpago',
+        'fechadecontabilizacion', 'fechadevencimiento'
+    ],
+    'monto': [
+        'monto', 'amount', 'importe', 'valor', 'total', 'cantidad', 'pago', 
+        'abono', 'cargo', 'credito', 'debito', 'value', 'cargoabono',
+        'cargoabonoml', 'saldo', 'suma'
+    ],
+    'referencia': [
+        'referencia', 'ref', 'reference', 'pv', 'puntoventa', 'puntoventa',
+        'numero', 'num', 'codigopv', 'codpv', 'nro', 'no', 'voucher',
+        'comprobante', 'ticket', 'folio', 'numerooperacion', 'nrooperacion',
+        'comentarios', 'codpv', 'codigopuntoventa'
+    ],
+    'descripcion': [
+        'descripcion', 'description', 'desc', 'concepto', 'detalle', 
+        'observacion', 'nota', 'comentario', 'memo', 'nombredelacuentadecontrapartida',
+        'nombrepv', 'glosa'
+    ],
+}
+COLUMN_FIELDS = tuple(COLUMN_PATTERNS)
+# Filas de la muestra para la detección por contenido
+COLUMN_DETECTION_SAMPLE = 200
+# Puntaje de contenido mínimo para elegir una columna de fecha o monto sin nombre conocido
+COLUMN_DETECTION_MIN_SCORE = 0.5
+
+_MONTH_NAMES = r'(ene|feb|mar|abr|may|jun|jul|ago|sep|set|oct|nov|dic|jan|apr|aug|dec)[a-z]*\.?'
+_DATE_LIKE = (r'^(\d{4}[-/.]\d{1,2}[-/.]\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4}'
+              r'|\d{1,2}[-/ ]' + _MONTH_NAMES + r'[-/ ]\d{2,4})([ T]\d{1,2}:\d{2}.*)?$')
+_AMOUNT_LIKE = r'^[-+(]?\d[\d.,]*\)?-?$'
+
+def score_columns(df, sample_size=COLUMN_DETECTION_SAMPLE):
+    """Puntaje de contenido (0 a 1) de cada columna para cada campo, sobre las primeras sample_size filas
+    
+    Retorna un DataFrame con una fila por columna (en el orden de df) y las
+    columnas fecha, monto, referencia y descripcion: la proporción de celdas no
+    vacías de la muestra que parecen fechas, montos distintos de cero, textos o
+    números con dígitos, y textos con letras. Todas las celdas de la muestra se
+    clasifican juntas, sin recorrer columna por columna.
+    """
+    sample = df.head(sample_size)
+    rows, width = sample.shape
+    scores = pd.DataFrame(0.0, index=df.columns, columns=list(COLUMN_FIELDS))
+    if not rows or not width:
+        return scores
+
+    # Todas las celdas de la muestra en una sola Series, columna tras columna
+    values = pd.Series(sample.to_numpy(dtype=object).ravel(order='F'))
+    columns = np.repeat(np.arange(width), rows)
+    nulls = values.isna().to_numpy().copy()
+    kinds = _value_kinds(values, nulls)
+    is_str = kinds == _KIND_STR
+    is_number = kinds == _KIND_NUMBER
+
+    date_like = kinds == _KIND_DATETIME
+    amount_like = is_number & (values.where(is_number, 0).astype('float64').to_numpy() != 0)
+    has_digit = is_number.copy()
+    has_letter = np.zeros(len(values), dtype=bool)
+    if is_str.any():
+        text = values[is_str].str.strip()
+        # Los textos vacíos (celdas en blanco en streaming) cuentan como vacíos
+        nulls[np.flatnonzero(is_str)[(text == '').to_numpy()]] = True
+        text_date = text.str.match(_DATE_LIKE, case=False).to_numpy(dtype=bool)
+        date_like[is_str] = text_date
+        amount = text.str.replace(_AMOUNT_SYMBOLS, '', regex=True)
+        amount_like[is_str] = (amount.str.match(_AMOUNT_LIKE).to_numpy(dtype=bool) & ~text_date &
+                               amount.str.contains(r'[1-9]', regex=True).to_numpy(dtype=bool))
+        has_digit[is_str] = text.str.contains(r'\d', regex=True).to_numpy(dtype=bool)
+        has_letter[is_str] = text.str.contains(r'[^\W\d_]', regex=True).to_numpy(dtype=bool)
+
+    present = np.bincount(columns[~nulls], minlength=width)
+    for field, hits in (('fecha', date_like), ('monto', amount_like),
+                        ('referencia', has_digit), ('descripcion', has_letter)):
+        counts = np.bincount(columns[hits & ~nulls], minlength=width)
+        scores[field] = counts / np.maximum(present, 1)
+    return scores
+
+def _header_positions(df):
+    """Posición de la columna para cada nombre normalizado (la última gana, como siempre)"""
+    columns_lower = {}
+    for position, col in enumerate(df.columns):
+        # Normalizar nombre de columna
+        normalized = str(col).lower().strip()
+        # Remover espacios, guiones, puntos, barras, paréntesis, etc. ("Cargo/Abono (ML)" -> cargoabonoml)
+        normalized_clean = re.sub(r'[\W_]', '', normalized)
+        columns_lower[normalized_clean] = position
+        # También guardar versión con espacios
+        columns_lower[normalized] = position
+    return columns_lower
+
+def _column_ranking(df, sample_size=COLUMN_DETECTION_SAMPLE):
+    """Por campo, [(posición, prioridad del nombre o None, puntaje de contenido)] de mejor a peor
+    
+    Las columnas con nombre conocido van primero, en el orden de los patrones;
+    después las demás, por puntaje de contenido y posición.
+    """
+    columns_lower = _header_positions(df)
+    scores = score_columns(df, sample_size)
+    ranking = {}
+    for field, patterns in COLUMN_PATTERNS.items():
+        header = {}
+        for priority, pattern in enumerate(patterns):
+            if pattern in columns_lower:
+                header.setdefault(columns_lower[pattern], priority)
+        content = scores[field].to_numpy()
+        candidates = [(position, header.get(position), float(content[position]))
+                      for position in range(len(df.columns))
+                      if position in header or content[position] > 0]
+        candidates.sort(key=lambda item: (item[1] is None, item[1] or 0, -item[2], item[0]))
+        ranking[field] = candidates
+    return ranking
+
+def column_candidates(df, sample_size=COLUMN_DETECTION_SAMPLE):
+    """Columnas candidatas para cada campo, de mejor a peor, con su confianza (0 a 1)
+    
+    Retorna {'fecha': [(columna, confianza), ...], 'monto': ..., 'referencia': ...,
+    'descripcion': ...}. La confianza suma 0.5 si el nombre coincide con un
+    patrón del campo y 0.5 por el puntaje de contenido de score_columns.
+    """
+    return {
+        field: [(df.columns[position], round(0.5 * (priority is not None) + 0.5 * content, 3))
+                for position, priority, content in candidates]
+        for field, candidates in _column_ranking(df, sample_size).items()
+    }
+
+def detect_columns(df):
+    """Detecta automáticamente las columnas de fecha, monto, referencia y descripción
+    
+    Se queda con la primera candidata de column_candidates. Referencia y
+    descripción solo se detectan por nombre; fecha y monto, si ningún nombre
+    coincide, por contenido con un puntaje de al menos COLUMN_DETECTION_MIN_SCORE.
+    """
+    if df.empty or len(df.columns) == 0:
+        return None, None, None, None
+    
+    ranking = _column_ranking(df)
+    detected = {}
+    for field in COLUMN_FIELDS:
+        for position, priority, content in ranking[field]:
+            if priority is None:
+                if field not in ('fecha', 'monto') or content < COLUMN_DETECTION_MIN_SCORE:
+                    break
+                # Por contenido, la columna de fecha no sirve también de monto
+                if field == 'monto' and position == detected.get('fecha'):
+                    continue
+            detected[field] = position
+            break
+    
+    return tuple(df.columns[detected[field]] if field in detected else None for field in COLUMN_FIELDS)
+
+# Límite por defecto de la caché de libros parseados (bytes en memoria de los DataFrames)
+WORKBOOK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+def _file_bytes(file):
+    """Retorna el contenido completo de un archivo subido, bytes o ruta"""
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if isinstance(file, str):
+        with open(file, 'rb') as fh:
+            return fh.read()
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    file.seek(0)
+    data = file.read()
+    file.seek(0)
+    return data
+
+class WorkbookCache:
+    """Caché LRU de hojas Excel ya parseadas, limitada por bytes
+    
+    La clave es el SHA-256 del contenido del archivo, el nombre de la hoja y las
+    opciones del lector, así que cada hoja de un mismo archivo se parsea una sola
+    vez aunque se suba de nuevo o se consulte desde varias etapas. Los DataFrames
+    retornados se comparten entre llamadas y no deben modificarse.
+    """
+
+    def __init__(self, max_bytes=WORKBOOK_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # clave -> (valor, tamaño en bytes)
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][0]
+            self.misses += 1
+            return False, None
+
+    def _store(self, key, value, size):
+        with self._lock:
+            if size > self.max_bytes or key in self._entries:
+                return
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            # Expulsar las entradas menos usadas hasta respetar el límite
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def get_sheet_names(self, file):
+        """Nombres de las hojas del libro"""
+        data = _file_bytes(file)
+        key = (hashlib.sha256(data).hexdigest(), None, 'sheet_names')
+        found, names = self._lookup(key)
+        if not found:
+            with pd.ExcelFile(BytesIO(data), engine='openpyxl') as excel_file:
+                names = list(excel_file.sheet_names)
+            self._store(key, names, sum(len(n) for n in names))
+        return list(names)
+
+    def get_sheet(self, file, sheet_name=0, **options):
+        """DataFrame de una hoja, parseado con pd.read_excel solo la primera vez"""
+        data = _file_bytes(file)
+        key = (hashlib.sha256(data).hexdigest(), sheet_name, repr(sorted(options.items())))
+        found, df = self._lookup(key)
+        if not found:
+            df = pd.read_excel(BytesIO(data), sheet_name=sheet_name, engine='openpyxl', **options)
+            self._store(key, df, int(df.memory_usage(index=True, deep=True).sum()))
+        return df
+
+    def stats(self):
+        """Contadores de aciertos/fallos y ocupación actual"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+# Versión de las reglas de normalización de fechas (normalize_date). Subirla al
+# cambiar esas reglas invalida lo guardado en las cachés de normalización en disco.
+NORMALIZATION_RULES_VERSION = 1
+# Límite por defecto de entradas de la caché de normalización en disco
+NORMALIZATION_CACHE_MAX_ENTRIES = 1000000
+# Parámetros por consulta (por debajo del límite de SQLite)
+_SQLITE_BATCH = 500
+
+class NormalizationCache:
+    """Caché persistente (SQLite) de texto crudo -> valor normalizado, compartida entre ejecuciones
+    
+    Cada entrada guarda la función (por ahora 'fecha'), el texto, el resultado, la
+    versión de las reglas con que se calculó y cuándo se usó por última vez. Al
+    abrirla se descartan las entradas de otra versión, y al pasar de max_entries
+    se expulsan las menos usadas. La misma ruta sirve a la vez a las sesiones de
+    la app (hilos) y a los procesos de la CLI.
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS normalizados (
+        funcion TEXT NOT NULL,
+        valor TEXT NOT NULL,
+        resultado TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        usado INTEGER NOT NULL,
+        PRIMARY KEY (funcion, valor)
+    );
+    CREATE INDEX IF NOT EXISTS normalizados_usado ON normalizados (usado);
+    """
+
+    def __init__(self, path, max_entries=NORMALIZATION_CACHE_MAX_ENTRIES, version=NORMALIZATION_RULES_VERSION):
+        self.path = path
+        self.max_entries = max_entries
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL: lectores y un escritor a la vez desde varios procesos
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+        self.connection.execute("DELETE FROM normalizados WHERE version != ?", (version,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, funcion, texts):
+        """Resultados guardados para los textos: dict texto -> resultado (solo los encontrados)"""
+        found = {}
+        now = int(time.time())
+        with self._lock:
+            for start in range(0, len(texts), _SQLITE_BATCH):
+                batch = texts[start:start + _SQLITE_BATCH]
+                marks = ', '.join('?' * len(batch))
+                found.update(self.connection.execute(
+                    f"SELECT valor, resultado FROM normalizados WHERE funcion = ? AND version = ? AND valor IN ({marks})",
+                    [funcion, self.version, *batch]
+                ).fetchall())
+            if found:
+                hits = list(found)
+                for start in range(0, len(hits), _SQLITE_BATCH):
+                    batch = hits[start:start + _SQLITE_BATCH]
+                    self.connection.execute(
+                        f"UPDATE normalizados SET usado = ? WHERE funcion = ? AND valor IN ({', '.join('?' * len(batch))})",
+                        [now, funcion, *batch]
+                    )
+                self.connection.commit()
+            self.hits += len(found)
+            self.misses += len(set(texts)) - len(found)
+        return found
+
+    def store(self, funcion, results):
+        """Guarda un dict texto -> resultado y expulsa las entradas menos usadas si sobra"""
+        if not results:
+            return
+        now = int(time.time())
+        with self._lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO normalizados (funcion, valor, resultado, version, usado) VALUES (?, ?, ?, ?, ?)",
+                [(funcion, text, result, self.version, now) for text, result in results.items()]
+            )
+            excess = self.connection.execute("SELECT COUNT(*) FROM normalizados").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.connection.execute(
+                    "DELETE FROM normalizados WHERE rowid IN (SELECT rowid FROM normalizados ORDER BY usado LIMIT ?)",
+                    (excess,)
+                )
+            self.connection.commit()
+
+    def apply(self, funcion, func, texts):
+        """Lista de func(texto) para textos distintos: lo guardado se lee, el resto se calcula y se guarda"""
+        found = self.lookup(funcion, texts)
+        computed = {text: func(text) for text in texts if text not in found}
+        self.store(funcion, computed)
+        found.update(computed)
+        return [found[text] for text in texts]
+
+    def stats(self):
+        """Contadores de aciertos/fallos y entradas guardadas"""
+        with self._lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM normalizados").fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'version': self.version,
+            }
+
+    def clear(self):
+        with self._lock:
+            self.connection.execute("DELETE FROM normalizados")
+            self.connection.commit()
+
+def process_excel_file(file, sheet_name=None, fecha_col=None, monto_col=None, referencia_col=None, descripcion_col=None, columnar=False, cache=None, normalization_cache=None):
+    """Procesa un archivo Excel y retorna datos normalizados
+    
+    cache: WorkbookCache de hojas parseadas; normalization_cache: NormalizationCache
+    en disco para el modo columnar.
+    """
+    try:
+        if cache is not None:
+            df = cache.get_sheet(file, sheet_name or 0)
+        elif sheet_name:
+            df = pd.read_excel(file, sheet_name=sheet_name, engine='openpyxl')
+        else:
+            df = pd.read_excel(file, engine='openpyxl')
+        
+        return process_dataframe(df, fecha_col, monto_col, referencia_col, descripcion_col, columnar=columnar,
+                                 normalization_cache=normalization_cache)
+    except Exception as e:
+        return None, f"Error al procesar archivo: {str(e)}"
+
+class NormalizedRecord(Mapping):
+    """Registro normalizado compacto (__slots__) con acceso de solo lectura tipo dict
+    
+    En lugar de copiar la fila original completa en cada registro, guarda una
+    referencia al DataFrame fuente y la posición de la fila: record['_original']
+    se arma solo cuando alguien lo pide (por ejemplo, una exportación). Las
+    claves con valor None se consideran ausentes, igual que en los dicts previos.
+    """
+    __slots__ = ('fecha', 'monto', 'referencia', 'descripcion', 'origen',
+                 '_excel_row', '_index_original', '_source', '_position')
+    _KEYS = ('fecha', 'monto', 'referencia', 'descripcion', 'origen', '_excel_row', '_index_original')
+
+    def __init__(self, fecha, monto, referencia='', descripcion='', excel_row=None, origen=None,
+                 index_original=None, source=None, position=None):
+        self.fecha = fecha
+        self.monto = monto
+        self.referencia = referencia
+        self.descripcion = descripcion
+        self.origen = origen
+        self._excel_row = excel_row
+        self._index_original = index_original
+        self._source = source  # DataFrame fuente (con position) o dict original ya armado
+        self._position = position
+
+    def original(self):
+        """Valores originales de la fila, leídos del DataFrame fuente"""
+        if self._source is None:
+            return {}
+        if isinstance(self._source, pd.DataFrame):
+            return self._source.iloc[self._position].to_dict()
+        return self._source
+
+    def __getitem__(self, key):
+        if key == '_original':
+            return self.original()
+        if key in self._KEYS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (key for key in self._KEYS if getattr(self, key) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"NormalizedRecord({dict(self)!r})"
+
+def _resolve_columns(df, fecha_col=None, monto_col=None, referencia_col=None, descripcion_col=None):
+    """Completa las columnas no indicadas con las detectadas automáticamente"""
+    if not fecha_col or not monto_col:
+        detected_fecha, detected_monto, detected_ref, detected_desc = detect_columns(df)
+        
+        if not fecha_col:
+            fecha_col = detected_fecha
+        if not monto_col:
+            monto_col = detected_monto
+        if not referencia_col:
+            referencia_col = detected_ref
+        if not descripcion_col:
+            descripcion_col = detected_desc
+    
+    return fecha_col, monto_col, referencia_col, descripcion_col
+
+def process_dataframe(df, fecha_col=None, monto_col=None, referencia_col=None, descripcion_col=None, columnar=False, normalization_cache=None):
+    """Normaliza un DataFrame ya leído - En modo columnar retorna un DataFrame tipado en vez de una lista de dicts"""
+    fecha_col, monto_col, referencia_col, descripcion_col = _resolve_columns(
+        df, fecha_col, monto_col, referencia_col, descripcion_col
+    )
+    
+    if not fecha_col or not monto_col:
+        # Preparar información de columnas disponibles para el error
+        available_cols = ", ".join(df.columns.astype(str).tolist())
+        return None, f"No se pudieron detectar las columnas de fecha y monto. Columnas disponibles: {available_cols}"
+    
+    # El modo columnar necesita nombres de columna únicos para leer cada columna como Series
+    if columnar and df.columns.is_unique:
+        return process_dataframe_columnar(df, fecha_col, monto_col, referencia_col, descripcion_col,
+                                          normalization_cache=normalization_cache), None
+    
+    # Normalizar datos - Guardar índice real del DataFrame
+    processed_data = []
+    for position, (idx, row) in enumerate(df.iterrows()):
+        fecha = normalize_date(row.get(fecha_col, ''))
+        monto = normalize_amount(row.get(monto_col, 0))
+        referencia = extract_pv(row.get(referencia_col, '')) if referencia_col else ''
+        descripcion = str(row.get(descripcion_col, '')) if descripcion_col else ''
+        
+        if fecha and monto > 0:
+            # Guardar el índice real del DataFrame (idx puede ser cualquier número)
+            # El número de fila en Excel será idx + 2 (1 para encabezado + 1 porque Excel empieza en 1)
+            # La fila original no se copia: el registro apunta a df por posición
+            processed_data.append(NormalizedRecord(
+                fecha,
+                round(monto, 2),
+                referencia,
+                descripcion,
+                excel_row=int(idx) + 2,  # +2 porque Excel: fila 1 = encabezado, fila 2+ = datos
+                source=df,
+                position=position
+            ))
+    
+    return processed_data, None
+
+def _column_as_iterrows(df, col, row_dtype, default):
+    """Retorna la columna con los mismos tipos de valor que entrega df.iterrows() para cada fila"""
+    if col not in df.columns:
+        return pd.Series([default] * len(df), dtype=object)
+    values = df[col].reset_index(drop=True)
+    if row_dtype == object:
+        # Fechas y floats conservan su semántica; el resto (int64, bool, extensiones) pasa a objetos Python
+        if values.dtype.kind not in 'fM':
+            values = values.astype(object)
+    elif values.dtype != row_dtype:
+        values = values.astype(row_dtype)
+    return values
+
+def process_dataframe_columnar(df, fecha_col, monto_col, referencia_col=None, descripcion_col=None, amount_locale=None,
+                               normalization_cache=None):
+    """Normaliza columnas completas con pandas/NumPy y retorna un DataFrame tipado
+    
+    Columnas: fecha (YYYY-MM-DD), monto (float64, 2 decimales), referencia (PV###),
+    descripcion y _excel_row (int64). Las filas coinciden una a una con las de la
+    ruta fila por fila de process_dataframe (salvo _original, que no se copia),
+    excepto los montos en texto, que se leen con la región de la columna
+    (parse_amount_column). En attrs quedan esa región ('locale_monto') y las
+    filas de Excel con montos ambiguos ('montos_ambiguos'). normalization_cache:
+    NormalizationCache opcional para las fechas de texto (ver normalize_date_column).
+    """
+    # Tipo común de las filas tal como lo calcula df.iterrows()
+    row_dtype = df.head(0).to_numpy().dtype
+    
+    fechas = normalize_date_column(_column_as_iterrows(df, fecha_col, row_dtype, ''), normalization_cache)
+    cents, ambiguous, amount_locale = parse_amount_column(
+        _column_as_iterrows(df, monto_col, row_dtype, 0), locale=amount_locale
+    )
+    valid = (fechas != '') & (cents > 0)
+    
+    if referencia_col:
+        referencias = extract_pv_column(_column_as_iterrows(df, referencia_col, row_dtype, '')[valid])
+    else:
+        referencias = np.full(int(valid.sum()), '', dtype=object)
+    
+    if descripcion_col:
+        # Celdas vacías como str(nan), que es lo que produce read_excel para celdas sin valor
+        descripciones = _column_as_iterrows(df, descripcion_col, row_dtype, '')[valid]
+        descripciones = descripciones.where(descripciones.notna(), np.nan).map(str).to_numpy(dtype=object)
+    else:
+        descripciones = np.full(int(valid.sum()), '', dtype=object)
+    
+    excel_rows = np.asarray(df.index, dtype='int64') + 2
+    # centavos / 100 es el float más cercano, igual que round(monto, 2) de la ruta escalar
+    records = pd.DataFrame({
+        'fecha': fechas[valid],
+        'monto': cents[valid] / 100,
+        'referencia': referencias,
+        'descripcion': descripciones,
+        '_excel_row': excel_rows[valid]
+    })
+    records.attrs['locale_monto'] = amount_locale
+    records.attrs['montos_ambiguos'] = excel_rows[valid & ambiguous].tolist()
+    return records
+
+# ---------------------------------------------------------------------------
+# Lectura en streaming (openpyxl read_only + values_only)
+# La hoja se recorre fila a fila sin cargar el libro completo; cada bloque de
+# filas se convierte con las mismas reglas que pd.read_excel y se normaliza de
+# inmediato, así que la memoria queda acotada por el tamaño del bloque.
+# ---------------------------------------------------------------------------
+
+STREAMING_CHUNK_ROWS = 50000
+
+def _excel_source(file):
+    """Origen aceptado por openpyxl.load_workbook para rutas, bytes o archivos subidos"""
+    if isinstance(file, str):
+        return file
+    if isinstance(file, (bytes, bytearray)):
+        return BytesIO(file)
+    file.seek(0)
+    return file
+
+def _convert_excel_value(value):
+    """Convierte un valor de celda igual que el lector openpyxl de pandas"""
+    if value is None:
+        return ''
+    if type(value) is float and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in ERROR_CODES:
+        return np.nan
+    return value
+
+def _trim_excel_row(row):
+    """Quita las celdas vacías al final de la fila, como hace pandas"""
+    end = len(row)
+    while end and row[end - 1] is None:
+        end -= 1
+    return row[:end]
+
+def _convert_excel_row(row, width):
+    """Fila de valores convertida y ajustada al ancho de la hoja"""
+    converted = [_convert_excel_value(v) for v in row[:width]]
+    if len(converted) < width:
+        converted.extend([''] * (width - len(converted)))
+    return converted
+
+def iter_excel_chunks(file, sheet_name=None, chunk_size=STREAMING_CHUNK_ROWS):
+    """Genera DataFrames de hasta chunk_size filas de una hoja, leídos en streaming
+    
+    El índice de cada bloque es la posición de la fila de datos en la hoja (la
+    misma que daría pd.read_excel), así que _excel_row sigue siendo idx + 2. Las
+    filas completamente vacías se omiten sin alterar la numeración. El ancho de
+    la hoja se fija con el encabezado y el primer bloque; las celdas más allá de
+    ese ancho en bloques posteriores se ignoran.
+    """
+    wb = openpyxl.load_workbook(_excel_source(file), read_only=True, data_only=True, keep_links=False)
+    try:
+        if sheet_name is None or isinstance(sheet_name, int):
+            ws = wb.worksheets[sheet_name or 0]
+        else:
+            ws = wb[sheet_name]
+        # La dimensión declarada en el XML no es confiable (a veces abarca la hoja entera)
+        ws.reset_dimensions()
+        
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            yield pd.DataFrame()
+            return
+        header = _trim_excel_row(header)
+        width = None
+        
+        buffer, positions = [], []
+        emitted = False
+        for position, row in enumerate(rows):
+            row = _trim_excel_row(row)
+            if not row:
+                continue
+            buffer.append(row)
+            positions.append(position)
+            if len(buffer) >= chunk_size:
+                if width is None:
+                    width = max([len(header)] + [len(r) for r in buffer])
+                yield _build_excel_chunk(header, buffer, positions, width)
+                emitted = True
+                buffer, positions = [], []
+        if buffer or not emitted:
+            if width is None:
+                width = max([len(header)] + [len(r) for r in buffer])
+            yield _build_excel_chunk(header, buffer, positions, width)
+    finally:
+        wb.close()
+
+def _build_excel_chunk(header, rows, positions, width):
+    """Convierte un bloque de filas crudas en DataFrame con las reglas de pd.read_excel"""
+    data = [_convert_excel_row(header, width)] + [_convert_excel_row(r, width) for r in rows]
+    chunk = TextParser(data, header=0, skip_blank_lines=False).read()
+    chunk.index = pd.Index(positions, dtype='int64')
+    return chunk
+
+def read_excel_preview(file, sheet_name=None, nrows=3):
+    """Primeras filas de una hoja sin leer el resto del libro"""
+    chunks = iter_excel_chunks(file, sheet_name, chunk_size=nrows)
+    try:
+        return next(chunks).head(nrows)
+    finally:
+        chunks.close()
+
+def iter_excel_records(file, sheet_name=None, fecha_col=None, monto_col=None, referencia_col=None, descripcion_col=None, chunk_size=STREAMING_CHUNK_ROWS,
+                       normalization_cache=None):
+    """Genera bloques ya normalizados (DataFrames del modo columnar) leyendo la hoja en streaming
+    
+    Las columnas que no se indiquen se detectan con el primer bloque, y la región
+    de los montos, con el primer bloque que la muestre.
+    """
+    chunks = iter_excel_chunks(file, sheet_name, chunk_size)
+    try:
+        first = next(chunks)
+        fecha_col, monto_col, referencia_col, descripcion_col = _resolve_columns(
+            first, fecha_col, monto_col, referencia_col, descripcion_col
+        )
+        if not fecha_col or not monto_col:
+            available_cols = ", ".join(first.columns.astype(str).tolist())
+            raise ValueError(f"No se pudieron detectar las columnas de fecha y monto. Columnas disponibles: {available_cols}")
+        records = process_dataframe_columnar(first, fecha_col, monto_col, referencia_col, descripcion_col,
+                                             normalization_cache=normalization_cache)
+        amount_locale = records.attrs['locale_monto']
+        yield records
+        del first, records
+        for chunk in chunks:
+            records = process_dataframe_columnar(chunk, fecha_col, monto_col, referencia_col, descripcion_col, amount_locale,
+                                                 normalization_cache)
+            amount_locale = records.attrs['locale_monto']
+            yield records
+    finally:
+        chunks.close()
+
+def process_excel_file_streaming(file, sheet_name=None, fecha_col=None, monto_col=None, referencia_col=None, descripcion_col=None, chunk_size=STREAMING_CHUNK_ROWS,
+                                 normalization_cache=None):
+    """Como process_excel_file(columnar=True), pero sin cargar la hoja completa en memoria"""
+    try:
+        frames = list(iter_excel_records(file, sheet_name, fecha_col, monto_col, referencia_col, descripcion_col, chunk_size,
+                                         normalization_cache))
+        # Los bloques sin filas válidas no aportan nada y alterarían los tipos al concatenar
+        ambiguous = [row for f in frames for row in f.attrs['montos_ambiguos']]
+        locales = [f.attrs['locale_monto'] for f in frames]
+        frames = [f for f in frames if len(f)] or frames[:1]
+        records = pd.concat(frames, ignore_index=True)
+        records.attrs['locale_monto'] = locales[-1]
+        records.attrs['montos_ambiguos'] = ambiguous
+        return records, None
+    except Exception as e:
+        return None, f"Error al procesar archivo: {str(e)}"
+
+def normalize_for_matching(fecha, monto, referencia):
+    """Normaliza valores para comparación exacta"""
+    # Normalizar fecha: asegurar formato YYYY-MM-DD consistente
+    fecha_norm = ''
+    if fecha:
+        fecha_str = str(fecha).strip()
+        # Si ya está en formato YYYY-MM-DD, usar directamente
+        if _ISO_DATE.match(fecha_str):
+            fecha_norm = fecha_str
+        else:
+            # Normalizar usando la función normalize_date
+            fecha_norm = normalize_date(fecha)
+    
+    # Normalizar monto: redondear a 2 decimales y usar tolerancia
+    monto_norm = 0.0
+    if monto:
+        try:
+            monto_float = float(monto)
+            monto_norm = round(abs(monto_float), 2)
+        except:
+            monto_norm = 0.0
+    
+    # Normalizar referencia/PV: extraer y normalizar PV
+    ref_norm = ''
+    if referencia:
+        if type(referencia) is str:
+            ref_norm = _normalize_reference_text(referencia)
+        else:
+            ref_norm = _normalize_reference(referencia, str(referencia))
+    
+    return fecha_norm, monto_norm, ref_norm
+
+@lru_cache(maxsize=PV_CACHE_SIZE)
+def _normalize_reference_text(referencia):
+    return _normalize_reference(referencia, referencia)
+
+def _normalize_reference(referencia, text):
+    """Referencia de normalize_for_matching; text es str(referencia)"""
+    ref_str = text.strip().upper()
+    # Si ya está en formato PV### (ya normalizada), solo se ajusta a 3 dígitos sin pasar por extract_pv
+    if _PV_NORMALIZED.match(ref_str):
+        return f"PV{_DIGITS.search(ref_str).group(1).zfill(3)}"
+    # Extraer PV usando extract_pv (siempre devuelve PV### o vacío)
+    return extract_pv(referencia)
+
+class MatchKeyEncoder:
+    """Traduce fecha, PV y monto normalizados a claves enteras para el cruce
+    
+    - fecha: ordinal del día (date.toordinal); las cadenas que no son una fecha
+      real reciben códigos negativos propios, así solo coinciden consigo mismas.
+    - PV: id entero por PV distinto; 0 significa "sin PV".
+    - monto: centavos enteros, sin comparar flotantes.
+    
+    Un mismo codificador debe usarse para ambos lados del cruce.
+    """
+    NO_PV = 0
+
+    def __init__(self):
+        self._days = {}
+        self._invalid_days = 0
+        self._pvs = {'': self.NO_PV}
+
+    def day(self, fecha):
+        """Ordinal del día de una fecha YYYY-MM-DD"""
+        code = self._days.get(fecha)
+        if code is None:
+            try:
+                if len(fecha) != 10 or fecha[4] != '-' or fecha[7] != '-':
+                    raise ValueError(fecha)
+                code = datetime(int(fecha[:4]), int(fecha[5:7]), int(fecha[8:10])).toordinal()
+            except ValueError:
+                self._invalid_days += 1
+                code = -self._invalid_days
+            self._days[fecha] = code
+        return code
+
+    def pv(self, referencia):
+        """Id entero del PV normalizado (0 = sin PV)"""
+        code = self._pvs.get(referencia)
+        if code is None:
+            code = self._pvs[referencia] = len(self._pvs)
+        return code
+
+    @staticmethod
+    def cents(monto):
+        """Monto normalizado (2 decimales) en centavos enteros"""
+        return int(round(monto * 100))
+
+    def keys(self, record):
+        """(día, pv, centavos) de un registro normalizado"""
+        return self.day(record['fecha']), self.pv(record['referencia']), self.cents(record['monto'])
+
+def _iter_input_records(data):
+    """Filas de entrada de reconcile_data: lista de dicts/registros o DataFrame del modo columnar"""
+    if not isinstance(data, pd.DataFrame):
+        return data
+    columns = [c for c in ('fecha', 'monto', 'referencia', 'descripcion', '_excel_row') if c in data.columns]
+    return [dict(zip(columns, values)) for values in zip(*(data[c].tolist() for c in columns))]
+
+def _record_source(row):
+    """Referencia a la fila original de un registro de entrada, sin copiarla"""
+    if isinstance(row, NormalizedRecord):
+        return {'source': row._source, 'position': row._position}
+    original = row.get('_original') if isinstance(row, dict) else None
+    return {'source': original or None, 'position': None}
+
+class _FreeSlots:
+    """Posiciones aún libres de una lista ordenada (union-find en ambos sentidos)
+    
+    next_free(i) / prev_free(i) saltan las posiciones ya usadas en tiempo casi
+    constante amortizado, así cada entrada se recorre un número acotado de veces.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._next = list(range(size + 1))  # size es el centinela final
+        self._prev = list(range(size + 1))  # desplazado en 1: 0 es el centinela inicial
+
+    @staticmethod
+    def _find(parent, i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def next_free(self, i):
+        """Primera posición libre >= i, o None"""
+        j = self._find(self._next, i)
+        return j if j < self.size else None
+
+    def prev_free(self, i):
+        """Última posición libre <= i, o None"""
+        if i < 0:
+            return None
+        j = self._find(self._prev, i + 1)
+        return j - 1 if j > 0 else None
+
+    def remove(self, i):
+        self._next[i] = i + 1
+        self._prev[i + 1] = i
+
+class _SortedSlots:
+    """Lista ordenada de (clave, posición) con las entradas usadas salteadas vía _FreeSlots"""
+
+    def __init__(self):
+        self.keys = []
+        self.positions = []
+        self.free = None
+
+    def append(self, key, position):
+        self.keys.append(key)
+        self.positions.append(position)
+
+    def close(self):
+        self.free = _FreeSlots(len(self.keys))
+
+    def nearest(self, key):
+        """Índices libres más cercanos a key por debajo y por arriba (la menor posición de su clave)"""
+        cut = bisect_left(self.keys, key)
+        above = self.free.next_free(cut)
+        below = self.free.prev_free(cut - 1)
+        if below is not None:
+            # Entre las libres con la misma clave, la primera es la de menor posición
+            below = self.free.next_free(bisect_left(self.keys, self.keys[below]))
+        return [k for k in (below, above) if k is not None]
+
+def match_within_date_window(left, right, tolerance):
+    """Cruce uno a uno con ventana de ±tolerance días sobre un índice ordenado
+    
+    left y right son secuencias de (posición, grupo, día, centavos) de filas aún
+    libres; grupo es la clave que debe coincidir (id de PV o centavos). Por cada
+    grupo de right (y por cada grupo y monto) se arma una lista de días ordenada;
+    cada fila de left (en su orden) busca con bisect el día libre más cercano,
+    saltando las entradas ya usadas, así el costo total es O(n log n). Se prefiere
+    el mismo monto, luego la menor distancia en días y luego el orden de aparición.
+    Las fechas inválidas (día negativo) no entran en la ventana.
+    
+    Devuelve [(posición1, posición2, días de diferencia)].
+    """
+    by_group = {}
+    by_amount = {}
+    slot_of = {}
+    for pos2, group, day, cents in sorted(right, key=lambda r: (r[1], r[2], r[0])):
+        if day >= 0:
+            group_slots = by_group.setdefault(group, _SortedSlots())
+            amount_slots = by_amount.setdefault((group, cents), _SortedSlots())
+            slot_of[pos2] = (group_slots, len(group_slots.keys), amount_slots, len(amount_slots.keys))
+            group_slots.append(day, pos2)
+            amount_slots.append(day, pos2)
+    for slots in list(by_group.values()) + list(by_amount.values()):
+        slots.close()
+    
+    matches = []
+    for pos1, group, day, cents in left:
+        if day < 0 or group not in by_group:
+            continue
+        best = None
+        # Primero el mismo monto; si no hay ninguno libre en la ventana, cualquiera del grupo
+        for slots in (by_amount.get((group, cents)), by_group[group]):
+            if slots is None:
+                continue
+            for k in slots.nearest(day):
+                rank = (abs(slots.keys[k] - day), slots.positions[k])
+                if rank[0] <= tolerance and (best is None or rank < best[0]):
+                    best = (rank, slots.positions[k], slots.keys[k] - day)
+            if best is not None:
+                break
+        if best is not None:
+            group_slots, k1, amount_slots, k2 = slot_of[best[1]]
+            group_slots.free.remove(k1)
+            amount_slots.free.remove(k2)
+            matches.append((pos1, best[1], best[2]))
+    return matches
+
+def amount_tolerance_cents(cents, amount_tolerance=0.0, amount_tolerance_pct=0.0):
+    """Diferencia máxima admitida (en centavos) para un monto: la mayor entre la absoluta y la relativa"""
+    return max(int(round(amount_tolerance * 100)), int(round(cents * amount_tolerance_pct / 100)))
+
+def match_within_amount_band(left, right, date_tolerance, amount_tolerance=0.0, amount_tolerance_pct=0.0):
+    """Cruce uno a uno por fecha (±date_tolerance días) y monto dentro de una banda de tolerancia
+    
+    left y right son secuencias de (posición, día, centavos) de filas aún libres.
+    right se indexa por día como lista de centavos ordenada; cada fila de left
+    busca con bisect, en cada día de su ventana, el monto libre más cercano por
+    debajo y por arriba, saltando las entradas ya usadas (costo logarítmico por
+    consulta). Se prefiere la menor diferencia de monto, luego la menor distancia
+    en días y luego el orden de aparición.
+    
+    Devuelve [(posición1, posición2, días de diferencia, diferencia en centavos, tolerancia en centavos)].
+    """
+    index = {}
+    slot_of = {}
+    for pos2, day, cents in sorted(right, key=lambda r: (r[1], r[2], r[0])):
+        slots = index.setdefault(day, _SortedSlots())
+        slot_of[pos2] = (slots, len(slots.keys))
+        slots.append(cents, pos2)
+    for slots in index.values():
+        slots.close()
+    
+    matches = []
+    for pos1, day, cents in left:
+        tolerance = amount_tolerance_cents(cents, amount_tolerance, amount_tolerance_pct)
+        # Las fechas inválidas (día negativo) solo se comparan consigo mismas
+        days = range(day - date_tolerance, day + date_tolerance + 1) if day >= 0 else (day,)
+        best = None
+        for day2 in days:
+            if day2 not in index:
+                continue
+            slots = index[day2]
+            for k in slots.nearest(cents):
+                difference = slots.keys[k] - cents
+                rank = (abs(difference), abs(day2 - day), slots.positions[k])
+                if rank[0] <= tolerance and (best is None or rank < best[0]):
+                    best = (rank, slots.positions[k], day2 - day, difference)
+        if best is not None:
+            slots, k = slot_of[best[1]]
+            slots.free.remove(k)
+            matches.append((pos1, best[1], best[2], best[3], tolerance))
+    return matches
+
+# Límites de la pasada de agregados: candidatos por grupo y tiempo total (segundos)
+AGGREGATE_MAX_CANDIDATES = 24
+AGGREGATE_TIME_LIMIT = 2.0
+
+class _AggregateTimeout(Exception):
+    pass
+
+def _subset_sums(amounts, offset, deadline):
+    """Todas las sumas de subconjuntos de amounts como (suma, máscara de bits desde offset)"""
+    sums = [(0, 0)]
+    for i, amount in enumerate(amounts):
+        if time.perf_counter() > deadline:
+            raise _AggregateTimeout()
+        bit = 1 << (offset + i)
+        sums += [(total + amount, mask | bit) for total, mask in sums]
+    return sums
+
+def find_subset_sum(amounts, target, tolerance=0, deadline=None):
+    """Subconjunto de amounts cuya suma queda a ±tolerance de target (meet-in-the-middle)
+    
+    Enumera las sumas de cada mitad (2^(n/2) cada una), ordena las de la derecha y
+    por cada suma de la izquierda busca con bisect el complemento. Devuelve la
+    lista de índices más cercana al objetivo, o None si no hay ninguno o si se
+    supera deadline (time.perf_counter()).
+    """
+    deadline = float('inf') if deadline is None else deadline
+    half = len(amounts) // 2
+    try:
+        left = _subset_sums(amounts[:half], 0, deadline)
+        right = sorted(_subset_sums(amounts[half:], half, deadline))
+    except _AggregateTimeout:
+        return None
+    right_sums = [total for total, _ in right]
+    
+    best = None
+    for step, (total, mask) in enumerate(left):
+        if step % 4096 == 0 and time.perf_counter() > deadline:
+            return None
+        needed = target - total
+        lo = bisect_left(right_sums, needed - tolerance)
+        hi = bisect_right(right_sums, needed + tolerance)
+        # El más cercano al complemento dentro de la banda
+        k = bisect_left(right_sums, needed, lo, hi)
+        for j in (k - 1, k):
+            if lo <= j < hi and (mask or right[j][1]):
+                rank = (abs(right_sums[j] - needed), mask | right[j][1])
+                if best is None or rank < best:
+                    best = rank
+    if best is None:
+        return None
+    return [i for i in range(len(amounts)) if best[1] >> i & 1]
+
+def match_aggregates(left, right, by_pv=False, amount_tolerance=0.0, amount_tolerance_pct=0.0,
+                     max_candidates=AGGREGATE_MAX_CANDIDATES, time_limit=AGGREGATE_TIME_LIMIT):
+    """Cruce muchos a uno: filas libres de right (misma fecha y, si by_pv, mismo PV) que suman un monto de left
+    
+    left y right son secuencias de (posición, día, pv, centavos) de filas aún
+    libres. Los grupos con menos de 2 o más de max_candidates filas se omiten;
+    la pasada completa se corta al superar time_limit segundos.
+    
+    Devuelve [(posición1, [posiciones2], diferencia en centavos, tolerancia en centavos)].
+    """
+    by_day = {}
+    by_day_pv = {}
+    for pos2, day, pv, cents in right:
+        by_day.setdefault(day, []).append((pos2, cents))
+        if by_pv:
+            by_day_pv.setdefault((day, pv), []).append((pos2, cents))
+    
+    deadline = time.perf_counter() + time_limit
+    used = set()
+    matches = []
+    for pos1, day, pv, cents in left:
+        if time.perf_counter() > deadline:
+            break
+        # Sin PV en la fila del banco, se agrupa solo por fecha
+        if by_pv and pv != MatchKeyEncoder.NO_PV:
+            group = by_day_pv.get((day, pv), ())
+        else:
+            group = by_day.get(day, ())
+        candidates = [entry for entry in group if entry[0] not in used]
+        if not 2 <= len(candidates) <= max_candidates:
+            continue
+        tolerance = amount_tolerance_cents(cents, amount_tolerance, amount_tolerance_pct)
+        amounts = [c for _, c in candidates]
+        total = sum(amounts)
+        # Caso común: el abono del banco es el total del día
+        if abs(total - cents) <= tolerance:
+            chosen = list(range(len(candidates)))
+        else:
+            chosen = find_subset_sum(amounts, cents, tolerance, deadline)
+        if not chosen or len(chosen) < 2:
+            continue
+        positions = [candidates[i][0] for i in chosen]
+        used.update(positions)
+        matches.append((pos1, sorted(positions), sum(amounts[i] for i in chosen) - cents, tolerance))
+    return matches
+
+def _aggregate_origen(by_pv, pv):
+    """Etiqueta de origen de un cruce agregado (por fecha+PV solo si la fila del banco tiene PV)"""
+    return 'agregado_fecha_pv' if by_pv and pv != MatchKeyEncoder.NO_PV else 'agregado_fecha'
+
+def reconcile_data(data1, data2, name1="Hoja 1", name2="Hoja 2", date_tolerance=0,
+                   amount_tolerance=0.0, amount_tolerance_pct=0.0, aggregate=False, aggregate_by_pv=False):
+    """Reconcilia dos conjuntos de datos - Busca automáticamente valores iguales por Fecha y PV
+    
+    Con date_tolerance > 0, las filas que no cruzan en su misma fecha se buscan
+    además en una ventana de ±date_tolerance días (pasadas fecha+PV y fecha+monto).
+    Con amount_tolerance (absoluta, en pesos) o amount_tolerance_pct (% del monto
+    de data1), una última pasada fecha+monto acepta diferencias dentro de esa banda.
+    Con aggregate, las filas de data1 aún libres se cruzan contra varias filas
+    libres de data2 de la misma fecha (y PV, si aggregate_by_pv) cuya suma da su
+    monto: un resultado por fila de data2, con el mismo grupo_agregado.
+    """
+    # Aceptar también los DataFrames tipados del modo columnar
+    data1 = _iter_input_records(data1)
+    data2 = _iter_input_records(data2)
+
+    results = []
+    matched1 = set()
+    matched2 = set()
+    
+    # Normalizar y validar datos antes de cruzar - NORMALIZACIÓN MEJORADA
+    normalized_data1 = []
+    normalized_data2 = []
+    
+    for idx, row in enumerate(data1):
+        if row.get('fecha') and row.get('monto', 0) > 0:
+            fecha_norm, monto_norm, ref_norm = normalize_for_matching(
+                row.get('fecha', ''),
+                row.get('monto', 0),
+                row.get('referencia', '')
+            )
+            if fecha_norm:  # Solo agregar si tiene fecha válida
+                # Usar _excel_row si existe (número de fila real en Excel), sino calcular desde índice
+                excel_row = row.get('_excel_row')
+                if excel_row is None:
+                    # Si no tiene _excel_row, usar el índice + 2 (asumiendo que data1 viene de un DataFrame)
+                    excel_row = idx + 2
+                
+                # Registro compacto con el origen ya asignado: los resultados lo referencian sin copiarlo
+                normalized_data1.append(NormalizedRecord(
+                    fecha_norm,
+                    monto_norm,
+                    ref_norm,
+                    str(row.get('descripcion', '')),
+                    excel_row=excel_row,  # Número de fila real en Excel
+                    origen=name1,
+                    index_original=idx,
+                    **_record_source(row)
+                ))
+    
+    for idx, row in enumerate(data2):
+        if row.get('fecha') and row.get('monto', 0) > 0:
+            fecha_norm, monto_norm, ref_norm = normalize_for_matching(
+                row.get('fecha', ''),
+                row.get('monto', 0),
+                row.get('referencia', '')
+            )
+            if fecha_norm:  # Solo agregar si tiene fecha válida
+                # Usar _excel_row si existe (número de fila real en Excel), sino calcular desde índice
+                excel_row = row.get('_excel_row')
+                if excel_row is None:
+                    # Si no tiene _excel_row, usar el índice + 2 (asumiendo que data2 viene de un DataFrame)
+                    excel_row = idx + 2
+                
+                # Registro compacto con el origen ya asignado: los resultados lo referencian sin copiarlo
+                normalized_data2.append(NormalizedRecord(
+                    fecha_norm,
+                    monto_norm,
+                    ref_norm,
+                    str(row.get('descripcion', '')),
+                    excel_row=excel_row,  # Número de fila real en Excel
+                    origen=name2,
+                    index_original=idx,
+                    **_record_source(row)
+                ))
+    
+    # Claves enteras (día, pv, centavos): hashing y comparación exactos y baratos
+    encoder = MatchKeyEncoder()
+    keys1 = [encoder.keys(row) for row in normalized_data1]
+    keys2 = [encoder.keys(row) for row in normalized_data2]
+    
+    # Crear índices para búsqueda rápida en data2
+    # PRIORIDAD 1: Fecha + PV + Monto (coincidencia EXACTA - máxima prioridad)
+    data2_by_exact = {}  # (día, pv, centavos) -> [indices]
+    # PRIORIDAD 2: Fecha + PV (sin importar monto) - LO MÁS IMPORTANTE
+    data2_by_date_pv = {}  # (día, pv) -> [indices]
+    # PRIORIDAD 3: Fecha + Monto (sin PV)
+    data2_by_date_amount = {}  # (día, centavos) -> [indices]
+    
+    for idx, (day, pv, cents) in enumerate(keys2):
+        if pv != MatchKeyEncoder.NO_PV:
+            data2_by_exact.setdefault((day, pv, cents), []).append(idx)
+            data2_by_date_pv.setdefault((day, pv), []).append(idx)
+        data2_by_date_amount.setdefault((day, cents), []).append(idx)
+    
+    def add_match(idx1, idx2, origen, dias_diferencia=0, diferencia_cents=0, tolerancia_cents=0, grupo=None):
+        row1 = normalized_data1[idx1]
+        row2 = normalized_data2[idx2]
+        # Usar _excel_row para obtener el número de fila real en Excel
+        fila_banco = row1.get('_excel_row', idx1 + 2)
+        fila_interno = row2.get('_excel_row', idx2 + 2)
+        results.append({
+            'banco': row1,
+            'interno': row2,
+            'estado': 'Conciliado',
+            'origen': origen,
+            'fila_banco': fila_banco,
+            'fila_interno': fila_interno,
+            'dias_diferencia': dias_diferencia,
+            'diferencia_monto': diferencia_cents / 100,
+            'tolerancia_monto': tolerancia_cents / 100,
+            'grupo_agregado': grupo
+        })
+        matched1.add(idx1)
+        matched2.add(idx2)
+    
+    def free_rows(keys, matched, group):
+        return [(idx, key[group], key[0], key[2]) for idx, key in enumerate(keys) if idx not in matched]
+    
+    # PASO 1: PRIORIDAD MÁXIMA - Coincidencias EXACTAS por FECHA + PV + MONTO
+    # Primero buscar coincidencias exactas (todos los campos iguales)
+    for idx1, (day, pv, cents) in enumerate(keys1):
+        if pv == MatchKeyEncoder.NO_PV:
+            continue
+        
+        # PRIORIDAD 1: Coincidencia EXACTA (fecha + PV + monto); la clave entera ya es exacta
+        # PRIORIDAD 2: Coincidencia por FECHA + PV (sin importar monto)
+        for origen, candidates in (('exacto_fecha_pv_monto', data2_by_exact.get((day, pv, cents), ())),
+                                   ('fecha_pv', data2_by_date_pv.get((day, pv), ()))):
+            idx2 = next((i for i in candidates if i not in matched2), None)
+            if idx2 is not None:
+                add_match(idx1, idx2, origen)
+                break
+    
+    # PASO 1b: Fecha + PV dentro de la ventana de ±date_tolerance días (filas aún libres)
+    if date_tolerance:
+        left = [r for r in free_rows(keys1, matched1, 1) if r[1] != MatchKeyEncoder.NO_PV]
+        right = [r for r in free_rows(keys2, matched2, 1) if r[1] != MatchKeyEncoder.NO_PV]
+        for idx1, idx2, dias in match_within_date_window(left, right, date_tolerance):
+            add_match(idx1, idx2, 'fecha_pv', dias)
+    
+    # PASO 2: Coincidencias por fecha + monto (sin PV) - Solo si no se encontró por fecha+PV
+    for idx1, (day, _, cents) in enumerate(keys1):
+        if idx1 in matched1:
+            continue
+        candidates = data2_by_date_amount.get((day, cents), ())
+        idx2 = next((i for i in candidates if i not in matched2), None)
+        if idx2 is not None:
+            add_match(idx1, idx2, 'fecha_monto')
+    
+    # PASO 2b: Fecha + Monto dentro de la ventana de ±date_tolerance días
+    if date_tolerance:
+        matches = match_within_date_window(free_rows(keys1, matched1, 2), free_rows(keys2, matched2, 2), date_tolerance)
+        for idx1, idx2, dias in matches:
+            add_match(idx1, idx2, 'fecha_monto', dias)
+    
+    # PASO 2c: Fecha (con su ventana) + Monto dentro de la banda de tolerancia
+    if amount_tolerance or amount_tolerance_pct:
+        matches = match_within_amount_band(
+            [(idx, key[0], key[2]) for idx, key in enumerate(keys1) if idx not in matched1],
+            [(idx, key[0], key[2]) for idx, key in enumerate(keys2) if idx not in matched2],
+            date_tolerance, amount_tolerance, amount_tolerance_pct
+        )
+        for idx1, idx2, dias, diferencia, tolerancia in matches:
+            add_match(idx1, idx2, 'fecha_monto', dias, diferencia, tolerancia)
+    
+    # PASO 2d: Agregados - un monto de hoja 1 igual a la suma de varias filas de hoja 2
+    if aggregate:
+        matches = match_aggregates(
+            [(idx,) + key for idx, key in enumerate(keys1) if idx not in matched1],
+            [(idx,) + key for idx, key in enumerate(keys2) if idx not in matched2],
+            aggregate_by_pv, amount_tolerance, amount_tolerance_pct
+        )
+        for grupo, (idx1, positions, diferencia, tolerancia) in enumerate(matches, 1):
+            origen = _aggregate_origen(aggregate_by_pv, keys1[idx1][1])
+            for idx2 in positions:
+                add_match(idx1, idx2, origen, 0, diferencia, tolerancia, grupo)
+    
+    # PASO 3: No conciliados de hoja 1
+    for idx1, row1 in enumerate(normalized_data1):
+        if idx1 not in matched1:
+            # Usar _excel_row para obtener el número de fila real en Excel
+            fila_banco = row1.get('_excel_row', idx1 + 2)
+            results.append({
+                'banco': row1,
+                'interno': None,
+                'estado': 'No conciliado',
+                'origen': name1,
+                'fila_banco': fila_banco,
+                'fila_interno': None,
+                'dias_diferencia': None,
+                'diferencia_monto': None,
+                'tolerancia_monto': None,
+                'grupo_agregado': None
+            })
+    
+    # PASO 4: No conciliados de hoja 2
+    for idx2, row2 in enumerate(normalized_data2):
+        if idx2 not in matched2:
+            # Usar _excel_row para obtener el número de fila real en Excel
+            fila_interno = row2.get('_excel_row', idx2 + 2)
+            results.append({
+                'banco': {'fecha': '', 'monto': 0, 'referencia': '', 'descripcion': '', 'origen': ''},
+                'interno': row2,
+                'estado': 'No conciliado',
+                'origen': name2,
+                'fila_banco': None,
+                'fila_interno': fila_interno,
+                'dias_diferencia': None,
+                'diferencia_monto': None,
+                'tolerancia_monto': None,
+                'grupo_agregado': None
+            })
+    
+    return results
+
+# ---------------------------------------------------------------------------
+# Motor vectorizado (joins)
+# Mismas prioridades y misma semántica uno a uno que reconcile_data, pero cada
+# pasada se resuelve con joins de pandas sobre claves enteras. Los duplicados se
+# emparejan por orden de aparición (cumcount), que es el mismo orden en el que
+# reconcile_data consume los candidatos.
+# ---------------------------------------------------------------------------
+
+# Códigos de tipo de cruce del motor vectorizado
+_MATCH_NONE, _MATCH_EXACT, _MATCH_DATE_PV, _MATCH_DATE_AMOUNT = 0, 1, 2, 3
+_MATCH_DATE_PV_WINDOW, _MATCH_DATE_AMOUNT_WINDOW, _MATCH_AMOUNT_BAND, _MATCH_AGGREGATE = 4, 5, 6, 7
+_MATCH_EXCLUDED = -1  # fila fuera del cruce (ver pending1 en _reconcile_sides)
+_MATCH_ORIGEN = {
+    _MATCH_EXACT: 'exacto_fecha_pv_monto',
+    _MATCH_DATE_PV: 'fecha_pv',
+    _MATCH_DATE_AMOUNT: 'fecha_monto',
+    _MATCH_DATE_PV_WINDOW: 'fecha_pv',
+    _MATCH_DATE_AMOUNT_WINDOW: 'fecha_monto',
+    _MATCH_AMOUNT_BAND: 'fecha_monto',
+}
+
+def _object_array(values):
+    """Lista -> array de objetos de una dimensión (sin que numpy desarme tuplas o listas)"""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+def _matching_inputs(data):
+    """Columnas de entrada como listas y, si existen, las referencias a las filas originales"""
+    if isinstance(data, pd.DataFrame):
+        n = len(data)
+        def column(name, default):
+            return data[name].tolist() if name in data.columns else [default] * n
+        return (column('fecha', None), column('monto', 0), column('referencia', ''),
+                column('descripcion', ''), column('_excel_row', None), None)
+    return ([row.get('fecha') for row in data],
+            [row.get('monto', 0) for row in data],
+            [row.get('referencia', '') for row in data],
+            [row.get('descripcion', '') for row in data],
+            [row.get('_excel_row') for row in data],
+            [_record_source(row) for row in data])
+
+def _distinct_values(values):
+    """Códigos por valor distinto y un representante de cada uno
+    
+    El tipo forma parte de la clave: 1, 1.0 y '1' pueden normalizarse distinto.
+    """
+    values = _object_array(values)
+    if len(values) == 0:
+        return np.zeros(0, dtype='int64'), values
+    value_codes, _ = pd.factorize(values, use_na_sentinel=False)
+    type_codes, _ = pd.factorize(np.fromiter((v.__class__ for v in values), dtype=object, count=len(values)))
+    combined = value_codes.astype('int64') * (int(type_codes.max()) + 1) + type_codes
+    _, first, codes = np.unique(combined, return_index=True, return_inverse=True)
+    return codes.reshape(-1), values[first]
+
+def _normalize_matching_side(data):
+    """Normaliza un lado con las mismas reglas que reconcile_data, una vez por valor distinto"""
+    fechas, montos, referencias, descripciones, excel_rows, sources = _matching_inputs(data)
+    
+    fecha_codes, fecha_values = _distinct_values(fechas)
+    fecha_norm = _object_array([normalize_for_matching(v, 0, '')[0] for v in fecha_values])
+    fecha_ok = np.array([bool(v) and bool(n) for v, n in zip(fecha_values, fecha_norm)], dtype=bool)
+    
+    monto_codes, monto_values = _distinct_values(montos)
+    monto_norm = np.array([normalize_for_matching('', v, '')[1] for v in monto_values], dtype='float64')
+    monto_ok = np.array([v > 0 for v in monto_values], dtype=bool)
+    
+    # Filas que reconcile_data considera: fecha y monto positivos, y fecha normalizable
+    index = np.flatnonzero(fecha_ok[fecha_codes] & monto_ok[monto_codes])
+    
+    ref_codes, ref_values = _distinct_values([referencias[i] for i in index.tolist()])
+    ref_norm = _object_array([normalize_for_matching('', 0, v)[2] for v in ref_values])
+    
+    index_list = index.tolist()
+    return {
+        'fecha': fecha_norm[fecha_codes[index]].tolist(),
+        'monto': monto_norm[monto_codes[index]].tolist(),
+        'referencia': ref_norm[ref_codes].tolist(),
+        'descripcion': [str(descripciones[i]) for i in index_list],
+        'excel_row': [excel_rows[i] if excel_rows[i] is not None else i + 2 for i in index_list],
+        'index': index_list,
+        'sources': [sources[i] for i in index_list] if sources is not None else None,
+    }
+
+def _side_records(side, origen):
+    """Registros compactos de un lado ya normalizado"""
+    columns = (side['fecha'], side['monto'], side['referencia'], side['descripcion'], side['excel_row'])
+    if side['sources'] is None:
+        return [NormalizedRecord(fecha, monto, referencia, descripcion, excel_row, origen, idx)
+                for fecha, monto, referencia, descripcion, excel_row, idx in zip(*columns, side['index'])]
+    return [NormalizedRecord(fecha, monto, referencia, descripcion, excel_row, origen, idx,
+                             source['source'], source['position'])
+            for fecha, monto, referencia, descripcion, excel_row, idx, source
+            in zip(*columns, side['index'], side['sources'])]
+
+def _pair_by_rank(left, right, keys):
+    """Empareja la k-ésima fila de cada clave en left con la k-ésima en right (orden de posición)"""
+    if left.empty or right.empty:
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+    left = left.assign(_rank=left.groupby(keys, sort=False).cumcount())
+    right = right.assign(_rank=right.groupby(keys, sort=False).cumcount())
+    pairs = left[keys + ['_rank', 'pos']].merge(
+        right[keys + ['_rank', 'pos']], on=keys + ['_rank'], suffixes=('1', '2')
+    )
+    return pairs['pos1'].to_numpy(), pairs['pos2'].to_numpy()
+
+def _greedy_date_pv(left, right, match2, kind):
+    """Pasada fecha+PV fila a fila (misma lógica que reconcile_data) para grupos mixtos"""
+    groups = {}
+    for fecha, pv, pos2, cents in zip(right['fecha'].tolist(), right['pv'].tolist(),
+                                      right['pos'].tolist(), right['cents'].tolist()):
+        order, by_cents = groups.setdefault((fecha, pv), ([], {}))
+        order.append(pos2)
+        by_cents.setdefault(cents, deque()).append(pos2)
+    
+    used = set()
+    pointers = {}
+    for fecha, pv, pos1, cents in zip(left['fecha'].tolist(), left['pv'].tolist(),
+                                      left['pos'].tolist(), left['cents'].tolist()):
+        group = groups.get((fecha, pv))
+        if group is None:
+            continue
+        order, by_cents = group
+        # PRIORIDAD 1: primer candidato libre con el mismo monto
+        queue = by_cents.get(cents)
+        while queue and queue[0] in used:
+            queue.popleft()
+        if queue:
+            pos2 = queue.popleft()
+            match_kind = _MATCH_EXACT
+        else:
+            # PRIORIDAD 2: primer candidato libre de la misma fecha y PV
+            pointer = pointers.get((fecha, pv), 0)
+            while pointer < len(order) and order[pointer] in used:
+                pointer += 1
+            pointers[(fecha, pv)] = pointer
+            if pointer == len(order):
+                continue
+            pos2 = order[pointer]
+            match_kind = _MATCH_DATE_PV
+        used.add(pos2)
+        match2[pos1] = pos2
+        kind[pos1] = match_kind
+
+@contextmanager
+def _gc_paused():
+    """Pausa el recolector cíclico mientras se crean millones de objetos sin ciclos"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def reconcile_data_vectorized(data1, data2, name1="Hoja 1", name2="Hoja 2", date_tolerance=0,
+                              amount_tolerance=0.0, amount_tolerance_pct=0.0, aggregate=False, aggregate_by_pv=False):
+    """Reconcilia con joins de pandas sobre claves enteras - Mismo resultado que reconcile_data"""
+    with _gc_paused():
+        return _reconcile_vectorized(data1, data2, name1, name2, date_tolerance=date_tolerance,
+                                     amount_tolerance=amount_tolerance, amount_tolerance_pct=amount_tolerance_pct,
+                                     aggregate=aggregate, aggregate_by_pv=aggregate_by_pv)
+
+def _window_rows(frame, mask, group):
+    """Filas de frame (según mask) como tuplas (posición, grupo, día, centavos) para la ventana de fechas"""
+    rows = frame[mask]
+    return list(zip(rows['pos'].tolist(), rows[group].tolist(), rows['fecha'].tolist(), rows['cents'].tolist()))
+
+def _subset_side(side, positions):
+    """Lado normalizado restringido a las posiciones indicadas (en ese orden)"""
+    subset = {key: [values[p] for p in positions] for key, values in side.items() if values is not None}
+    subset['sources'] = subset.get('sources')
+    return subset
+
+def _side_key_frame(side, encoder):
+    """Claves enteras de un lado normalizado como DataFrame (pos, fecha, pv, cents)"""
+    fecha_codes, fecha_values = pd.factorize(_object_array(side['fecha']))
+    pv_codes, pv_values = pd.factorize(_object_array(side['referencia']))
+    return pd.DataFrame({
+        'pos': np.arange(len(side['fecha'])),
+        'fecha': np.array([encoder.day(f) for f in fecha_values], dtype='int32')[fecha_codes],
+        'pv': np.array([encoder.pv(r) for r in pv_values], dtype='int32')[pv_codes],
+        'cents': np.rint(np.array(side['monto'], dtype='float64') * 100).astype('int64'),
+    })
+
+def _key_frames(side1, side2):
+    """Claves enteras de ambos lados, con un solo MatchKeyEncoder (día ordinal, id de PV y centavos)"""
+    encoder = MatchKeyEncoder()
+    return _side_key_frame(side1, encoder), _side_key_frame(side2, encoder)
+
+def _reconcile_vectorized(data1, data2, name1, name2, **options):
+    side1 = _normalize_matching_side(data1)
+    side2 = _normalize_matching_side(data2)
+    return _reconcile_sides(side1, side2, name1, name2, **options)
+
+def _reconcile_sides(side1, side2, name1, name2, date_tolerance=0, amount_tolerance=0.0, amount_tolerance_pct=0.0,
+                     aggregate=False, aggregate_by_pv=False, keys=None, pending1=None, available2=None, records2=None):
+    """Cruce vectorizado de dos lados ya normalizados (ver _normalize_matching_side)
+    
+    keys: (left, right) ya calculados con un encoder común; pending1 / available2:
+    máscaras de las filas que participan (el resto no se cruza ni se reporta);
+    records2: registros ya armados del lado 2, para reutilizarlos entre llamadas.
+    """
+    left, right = keys if keys is not None else _key_frames(side1, side2)
+    state = _match_key_frames(left, right, date_tolerance, amount_tolerance, amount_tolerance_pct,
+                              aggregate, aggregate_by_pv, pending1, available2)
+    return _build_results(side1, side2, name1, name2, state, left['pv'].to_numpy(), aggregate_by_pv, records2)
+
+def _match_key_frames(left, right, date_tolerance=0, amount_tolerance=0.0, amount_tolerance_pct=0.0,
+                      aggregate=False, aggregate_by_pv=False, pending1=None, available2=None):
+    """Pasadas de cruce sobre las claves enteras de ambos lados (ver _key_frames)
+    
+    Solo usa enteros y DataFrames de claves, así puede ejecutarse en otro proceso.
+    Devuelve (match2, kind, dias, diferencia, tolerancia, aggregates, matched_right)
+    indexados por posición en left / right.
+    """
+    n1, n2 = len(left), len(right)
+    
+    match2 = np.full(n1, -1, dtype='int64')
+    kind = np.zeros(n1, dtype='int8')
+    if pending1 is not None:
+        kind[~pending1] = _MATCH_EXCLUDED
+    dias = np.zeros(n1, dtype='int32')
+    diferencia = np.zeros(n1, dtype='int64')  # centavos
+    tolerancia = np.zeros(n1, dtype='int64')  # centavos
+    
+    # Las filas no disponibles del lado 2 cuentan como ya cruzadas desde el inicio
+    matched_right = np.zeros(n2, dtype=bool) if available2 is None else ~available2
+    
+    # PASO 1: Fecha + PV (+ monto). Los grupos fecha+PV son independientes entre sí.
+    left_pv = left[(left['pv'] != MatchKeyEncoder.NO_PV).to_numpy() & (kind == _MATCH_NONE)]
+    right_pv = right[(right['pv'] != MatchKeyEncoder.NO_PV).to_numpy() & ~matched_right]
+    if not left_pv.empty and not right_pv.empty:
+        exact_keys = ['fecha', 'pv', 'cents']
+        count1 = left_pv.groupby(exact_keys).size().rename('count1')
+        count2 = right_pv.groupby(exact_keys).size().rename('count2')
+        counts = left_pv.join(count1, on=exact_keys).join(count2, on=exact_keys)
+        counts['count2'] = counts['count2'].fillna(0)
+        counts['all_exact'] = counts['count1'] <= counts['count2']
+        counts['any_exact'] = counts['count2'] > 0
+        group_type = counts.groupby(['fecha', 'pv']).agg(all_exact=('all_exact', 'all'), any_exact=('any_exact', 'any'))
+        
+        left_group = left_pv.join(group_type, on=['fecha', 'pv'])
+        right_group = right_pv.join(group_type, on=['fecha', 'pv'], how='inner')
+        
+        # Grupos donde cada fila encuentra su monto: todo se cruza exacto, en orden
+        only_exact = left_group['all_exact'].to_numpy(dtype=bool)
+        right_only_exact = right_group['all_exact'].to_numpy(dtype=bool)
+        pos1, pos2 = _pair_by_rank(left_group[only_exact], right_group[right_only_exact], exact_keys)
+        match2[pos1] = pos2
+        kind[pos1] = _MATCH_EXACT
+        
+        # Grupos sin ningún monto coincidente: se toma el primer candidato libre, en orden
+        no_exact = ~left_group['any_exact'].to_numpy(dtype=bool)
+        right_no_exact = ~right_group['any_exact'].to_numpy(dtype=bool)
+        pos1, pos2 = _pair_by_rank(left_group[no_exact], right_group[right_no_exact], ['fecha', 'pv'])
+        match2[pos1] = pos2
+        kind[pos1] = _MATCH_DATE_PV
+        
+        # Grupos mixtos: la prioridad exacta y el respaldo fecha+PV interactúan fila a fila
+        mixed = ~only_exact & ~no_exact
+        if mixed.any():
+            right_mixed = ~(right_only_exact | right_no_exact)
+            _greedy_date_pv(left_group[mixed], right_group[right_mixed], match2, kind)
+    
+    matched_right[match2[match2 >= 0]] = True
+    
+    # PASO 1b: Fecha + PV dentro de la ventana de ±date_tolerance días (mismo índice ordenado que reconcile_data)
+    if date_tolerance:
+        has_pv1 = left['pv'].to_numpy() != MatchKeyEncoder.NO_PV
+        has_pv2 = right['pv'].to_numpy() != MatchKeyEncoder.NO_PV
+        matches = match_within_date_window(_window_rows(left, (kind == _MATCH_NONE) & has_pv1, 'pv'),
+                                           _window_rows(right, ~matched_right & has_pv2, 'pv'), date_tolerance)
+        for pos1, pos2, delta in matches:
+            match2[pos1], kind[pos1], dias[pos1] = pos2, _MATCH_DATE_PV_WINDOW, delta
+            matched_right[pos2] = True
+    
+    # PASO 2: Fecha + Monto entre las filas que siguen libres
+    pos1, pos2 = _pair_by_rank(left[kind == _MATCH_NONE], right[~matched_right], ['fecha', 'cents'])
+    match2[pos1] = pos2
+    kind[pos1] = _MATCH_DATE_AMOUNT
+    matched_right[pos2] = True
+    
+    # PASO 2b: Fecha + Monto dentro de la ventana de ±date_tolerance días
+    if date_tolerance:
+        matches = match_within_date_window(_window_rows(left, kind == _MATCH_NONE, 'cents'),
+                                           _window_rows(right, ~matched_right, 'cents'), date_tolerance)
+        for pos1, pos2, delta in matches:
+            match2[pos1], kind[pos1], dias[pos1] = pos2, _MATCH_DATE_AMOUNT_WINDOW, delta
+            matched_right[pos2] = True
+    
+    # PASO 2c: Fecha (con su ventana) + Monto dentro de la banda de tolerancia
+    if amount_tolerance or amount_tolerance_pct:
+        free1, free2 = left[kind == _MATCH_NONE], right[~matched_right]
+        matches = match_within_amount_band(
+            list(zip(free1['pos'].tolist(), free1['fecha'].tolist(), free1['cents'].tolist())),
+            list(zip(free2['pos'].tolist(), free2['fecha'].tolist(), free2['cents'].tolist())),
+            date_tolerance, amount_tolerance, amount_tolerance_pct
+        )
+        for pos1, pos2, delta, diff, tol in matches:
+            match2[pos1], kind[pos1], dias[pos1] = pos2, _MATCH_AMOUNT_BAND, delta
+            diferencia[pos1], tolerancia[pos1] = diff, tol
+            matched_right[pos2] = True
+    
+    # PASO 2d: Agregados - un monto de hoja 1 igual a la suma de varias filas de hoja 2
+    aggregates = []
+    if aggregate:
+        free1, free2 = left[kind == _MATCH_NONE], right[~matched_right]
+        aggregates = match_aggregates(
+            list(zip(free1['pos'].tolist(), free1['fecha'].tolist(), free1['pv'].tolist(), free1['cents'].tolist())),
+            list(zip(free2['pos'].tolist(), free2['fecha'].tolist(), free2['pv'].tolist(), free2['cents'].tolist())),
+            aggregate_by_pv, amount_tolerance, amount_tolerance_pct
+        )
+        for pos1, positions, _, _ in aggregates:
+            kind[pos1] = _MATCH_AGGREGATE
+            matched_right[positions] = True
+    
+    return match2, kind, dias, diferencia, tolerancia, aggregates, matched_right
+
+def _build_results(side1, side2, name1, name2, state, pvs, aggregate_by_pv=False, records2=None):
+    """Resultados en el mismo orden que reconcile_data a partir del estado de _match_key_frames"""
+    match2, kind, dias, diferencia, tolerancia, aggregates, matched_right = state
+    records1 = _side_records(side1, name1)
+    if records2 is None:
+        records2 = _side_records(side2, name2)
+    matched = np.concatenate([
+        np.flatnonzero((kind == _MATCH_EXACT) | (kind == _MATCH_DATE_PV)),
+        np.flatnonzero(kind == _MATCH_DATE_PV_WINDOW),
+        np.flatnonzero(kind == _MATCH_DATE_AMOUNT),
+        np.flatnonzero(kind == _MATCH_DATE_AMOUNT_WINDOW),
+        np.flatnonzero(kind == _MATCH_AMOUNT_BAND),
+    ])
+    results = [{
+        'banco': row1,
+        'interno': row2,
+        'estado': 'Conciliado',
+        'origen': _MATCH_ORIGEN[match_kind],
+        'fila_banco': row1._excel_row,
+        'fila_interno': row2._excel_row,
+        'dias_diferencia': delta,
+        'diferencia_monto': diff / 100,
+        'tolerancia_monto': tol / 100,
+        'grupo_agregado': None
+    } for row1, row2, match_kind, delta, diff, tol in zip(
+        [records1[i] for i in matched.tolist()],
+        [records2[j] for j in match2[matched].tolist()],
+        kind[matched].tolist(),
+        dias[matched].tolist(),
+        diferencia[matched].tolist(),
+        tolerancia[matched].tolist()
+    )]
+    for grupo, (pos1, positions, diff, tol) in enumerate(aggregates, 1):
+        row1 = records1[pos1]
+        origen = _aggregate_origen(aggregate_by_pv, int(pvs[pos1]))
+        results.extend({
+            'banco': row1,
+            'interno': row2,
+            'estado': 'Conciliado',
+            'origen': origen,
+            'fila_banco': row1._excel_row,
+            'fila_interno': row2._excel_row,
+            'dias_diferencia': 0,
+            'diferencia_monto': diff / 100,
+            'tolerancia_monto': tol / 100,
+            'grupo_agregado': grupo
+        } for row2 in [records2[j] for j in positions])
+    results.extend({
+        'banco': row1,
+        'interno': None,
+        'estado': 'No conciliado',
+        'origen': name1,
+        'fila_banco': row1._excel_row,
+        'fila_interno': None,
+        'dias_diferencia': None,
+        'diferencia_monto': None,
+        'tolerancia_monto': None,
+        'grupo_agregado': None
+    } for row1 in [records1[i] for i in np.flatnonzero(kind == _MATCH_NONE).tolist()])
+    results.extend({
+        'banco': {'fecha': '', 'monto': 0, 'referencia': '', 'descripcion': '', 'origen': ''},
+        'interno': row2,
+        'estado': 'No conciliado',
+        'origen': name2,
+        'fila_banco': None,
+        'fila_interno': row2._excel_row,
+        'dias_diferencia': None,
+        'diferencia_monto': None,
+        'tolerancia_monto': None,
+        'grupo_agregado': None
+    } for row2 in [records2[j] for j in np.flatnonzero(~matched_right).tolist()])
+    
+    return results
+
+def balanced_days(left, right):
+    """Días cuyos totales cuadran en ambos lados: misma cantidad de filas, mismo total y mismos montos
+    
+    left y right son DataFrames de claves (fecha, cents). La comparación por día
+    usa groupby vectorizados; los días con igual cantidad y total se confirman
+    comparando la lista ordenada de montos, para poder emparejarlos directamente.
+    """
+    totals1 = left.groupby('fecha')['cents'].agg(['size', 'sum'])
+    totals2 = right.groupby('fecha')['cents'].agg(['size', 'sum'])
+    totals = totals1.join(totals2, how='inner', lsuffix='1', rsuffix='2')
+    candidates = totals.index[(totals['size1'] == totals['size2']) & (totals['sum1'] == totals['sum2'])]
+    if len(candidates) == 0:
+        return candidates
+    
+    # Mismo multiconjunto de montos: ambos lados ordenados por (fecha, monto) deben coincidir fila a fila
+    sorted1 = left[left['fecha'].isin(candidates)].sort_values(['fecha', 'cents'])
+    sorted2 = right[right['fecha'].isin(candidates)].sort_values(['fecha', 'cents'])
+    differs = sorted1['cents'].to_numpy() != sorted2['cents'].to_numpy()
+    return pd.Index(candidates).difference(sorted1['fecha'].to_numpy()[differs])
+
+def reconcile_data_hierarchical(data1, data2, name1="Hoja 1", name2="Hoja 2", **options):
+    """Reconciliación jerárquica: totales diarios primero, detalle solo en lo que no cuadra
+    
+    Los días que cuadran (ver balanced_days) se cruzan solos con las pasadas del
+    mismo día (fecha+PV+monto, fecha+PV y fecha+monto); lo que quede libre se
+    suma a los días que no cuadran, que pasan por el cruce detallado del motor
+    vectorizado con las mismas opciones. Con tolerancia de fecha, un día cuyas
+    filas con PV no se cruzan todas en el mismo día va entero al detalle, porque
+    la ventana fecha+PV se aplica antes que fecha+monto. El resultado es el mismo
+    que el de reconcile_data.
+    """
+    with _gc_paused():
+        side1 = _normalize_matching_side(data1)
+        side2 = _normalize_matching_side(data2)
+        left, right = _key_frames(side1, side2)
+        days = balanced_days(left, right)
+        in_balanced1 = left['fecha'].isin(days).to_numpy()
+        in_balanced2 = right['fecha'].isin(days).to_numpy()
+        
+        # Días que cuadran: solo las pasadas del mismo día, sin ventanas ni agregados
+        match2, kind, _, _, _, _, matched_right = _match_key_frames(
+            left, right, pending1=in_balanced1, available2=in_balanced2
+        )
+        done1 = in_balanced1 & (kind != _MATCH_NONE)
+        done2 = in_balanced2 & matched_right
+        
+        if options.get('date_tolerance', 0):
+            same_pv1 = (kind == _MATCH_EXACT) | (kind == _MATCH_DATE_PV)
+            same_pv2 = np.zeros(len(right), dtype=bool)
+            same_pv2[match2[same_pv1]] = True
+            has_pv1 = left['pv'].to_numpy() != MatchKeyEncoder.NO_PV
+            has_pv2 = right['pv'].to_numpy() != MatchKeyEncoder.NO_PV
+            open_days = np.union1d(left['fecha'].to_numpy()[in_balanced1 & has_pv1 & ~same_pv1],
+                                   right['fecha'].to_numpy()[in_balanced2 & has_pv2 & ~same_pv2])
+            if len(open_days):
+                done1 &= ~left['fecha'].isin(open_days).to_numpy()
+                done2 &= ~right['fecha'].isin(open_days).to_numpy()
+        
+        # Lo que sigue libre (días que no cuadran y sobrantes): cruce detallado
+        state = _match_key_frames(left, right, pending1=~done1, available2=~done2, **options)
+        state = (np.where(done1, match2, state[0]), np.where(done1, kind, state[1])) + state[2:]
+        return _build_results(side1, side2, name1, name2, state, left['pv'].to_numpy(),
+                              options.get('aggregate_by_pv', False))
+
+def date_shards(left, right, date_tolerance=0, count=1):
+    """Reparte las filas en hasta count fragmentos por rangos de fechas independientes entre sí
+    
+    left y right son DataFrames de claves (fecha, ...). Los días consecutivos a
+    más de date_tolerance días de distancia no interactúan en ninguna pasada, así
+    que solo se corta entre ellos; los bloques resultantes se agrupan en rangos
+    contiguos con una cantidad de filas parecida.
+    
+    Devuelve [(posiciones1, posiciones2)] con las posiciones de cada lado en orden.
+    """
+    fechas1, fechas2 = left['fecha'].to_numpy(), right['fecha'].to_numpy()
+    days = np.unique(np.concatenate([fechas1, fechas2]))
+    if len(days) == 0:
+        return []
+    day1, day2 = np.searchsorted(days, fechas1), np.searchsorted(days, fechas2)
+    day_rows = np.bincount(day1, minlength=len(days)) + np.bincount(day2, minlength=len(days))
+    block = np.concatenate([[0], np.cumsum(np.diff(days) > date_tolerance)])
+    block_rows = np.bincount(block, weights=day_rows).astype('int64')
+    # Cada bloque va al fragmento donde cae su primera fila
+    starts = np.cumsum(block_rows) - block_rows
+    day_shard = np.minimum(starts * count // block_rows.sum(), count - 1)[block]
+    shard1, shard2 = day_shard[day1], day_shard[day2]
+    return [(np.flatnonzero(shard1 == k), np.flatnonzero(shard2 == k))
+            for k in np.unique(day_shard).tolist()]
+
+def _match_shard(left, right, options):
+    """Pasadas de cruce de un fragmento, con posiciones locales (se ejecuta en un proceso de trabajo)"""
+    left = left.assign(pos=np.arange(len(left)))
+    right = right.assign(pos=np.arange(len(right)))
+    return _match_key_frames(left, right, **options)
+
+def reconcile_data_parallel(data1, data2, name1="Hoja 1", name2="Hoja 2", workers=None, **options):
+    """Reconciliación vectorizada repartida por fechas en varios procesos
+    
+    Ambos lados se normalizan y codifican una sola vez; las pasadas de cruce se
+    ejecutan por fragmento de fechas (ver date_shards) en un ProcessPoolExecutor
+    de workers procesos (por defecto, uno por CPU) y los estados se combinan por
+    posición antes de armar los resultados. El resultado es idéntico al del motor
+    vectorizado; con agregados, el límite de tiempo corre por fragmento.
+    """
+    workers = workers or os.cpu_count() or 1
+    with _gc_paused():
+        side1 = _normalize_matching_side(data1)
+        side2 = _normalize_matching_side(data2)
+        left, right = _key_frames(side1, side2)
+        shards = date_shards(left, right, options.get('date_tolerance', 0), workers)
+        frames = [(left.iloc[pos1], right.iloc[pos2], options) for pos1, pos2 in shards]
+        if workers == 1 or len(shards) <= 1:
+            states = [_match_shard(*frame) for frame in frames]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+                states = list(executor.map(_match_shard, *zip(*frames)))
+        
+        n1, n2 = len(left), len(right)
+        match2 = np.full(n1, -1, dtype='int64')
+        kind = np.zeros(n1, dtype='int8')
+        dias = np.zeros(n1, dtype='int32')
+        diferencia = np.zeros(n1, dtype='int64')
+        tolerancia = np.zeros(n1, dtype='int64')
+        matched_right = np.zeros(n2, dtype=bool)
+        aggregates = []
+        for (pos1, pos2), (shard_match2, shard_kind, shard_dias, shard_diferencia, shard_tolerancia,
+                           shard_aggregates, shard_matched_right) in zip(shards, states):
+            hit = shard_match2 >= 0
+            match2[pos1[hit]] = pos2[shard_match2[hit]]
+            kind[pos1], dias[pos1] = shard_kind, shard_dias
+            diferencia[pos1], tolerancia[pos1] = shard_diferencia, shard_tolerancia
+            matched_right[pos2] = shard_matched_right
+            aggregates.extend((int(pos1[p1]), pos2[positions].tolist(), diff, tol)
+                              for p1, positions, diff, tol in shard_aggregates)
+        # Mismo orden de grupos que una sola pasada: por posición en el lado 1
+        aggregates.sort(key=lambda match: match[0])
+        
+        state = (match2, kind, dias, diferencia, tolerancia, aggregates, matched_right)
+        return _build_results(side1, side2, name1, name2, state, left['pv'].to_numpy(),
+                              options.get('aggregate_by_pv', False))
+
+class LedgerIndex:
+    """Índice compartido del libro mayor para cruzarlo contra varias hojas de cuentas
+    
+    El libro se normaliza, se codifica y se convierte en registros una sola vez;
+    cada hoja de cuenta se codifica con el mismo encoder y se consulta contra
+    estas claves sin reconstruirlas.
+    """
+
+    def __init__(self, ledger, name="Libro mayor"):
+        self.name = name
+        self.encoder = MatchKeyEncoder()
+        self.side = _normalize_matching_side(ledger)
+        self.keys = _side_key_frame(self.side, self.encoder)
+        self.records = _side_records(self.side, name)
+        self._positions = {id(record): pos for pos, record in enumerate(self.records)}
+
+    def __len__(self):
+        return len(self.records)
+
+    def encode(self, account):
+        """Normaliza una hoja de cuenta y la codifica con el encoder del libro"""
+        side = _normalize_matching_side(account)
+        return side, _side_key_frame(side, self.encoder)
+
+    def position(self, record):
+        """Posición en el libro de un registro devuelto en los resultados"""
+        return self._positions[id(record)]
+
+def _split_account_results(results, ledger, positions1):
+    """Separa los resultados de una cuenta en cruces y filas sin cruce
+    
+    Devuelve (filas de la cuenta, filas del libro, resultados) de cada cruce como
+    arrays/lista paralelos, y la lista de resultados sin cruce de la cuenta.
+    """
+    pos1, pos2, matched, unmatched = [], [], [], []
+    for result in results:
+        if result['estado'] == 'Conciliado':
+            pos1.append(positions1[result['banco']['_index_original']])
+            pos2.append(ledger.position(result['interno']))
+            matched.append(result)
+        elif result['interno'] is None:
+            unmatched.append(result)
+    return np.array(pos1, dtype='int64'), np.array(pos2, dtype='int64'), matched, unmatched
+
+def reconcile_multi(accounts, ledger, ledger_name="Libro mayor", max_workers=None, **options):
+    """Reconcilia el libro mayor contra varias hojas de cuentas a la vez
+    
+    accounts: dict (ordenado) nombre de hoja -> datos. Cada fila del libro cruza
+    con una sola fila de cuenta en total. Las cuentas se procesan en paralelo
+    contra un LedgerIndex compartido; si dos cuentas reclaman la misma fila del
+    libro, gana la que aparece primero y las filas perdedoras de las demás se
+    vuelven a cruzar en otra ronda contra lo que quedó libre (como mucho una
+    ronda por cuenta).
+    
+    Devuelve una sola lista de resultados: por cada cuenta sus cruces y sus filas
+    sin cruce, y al final las filas del libro que no cruzaron con ninguna cuenta.
+    """
+    with _gc_paused():
+        index = ledger if isinstance(ledger, LedgerIndex) else LedgerIndex(ledger, ledger_name)
+        names = list(accounts)
+        encoded = {name: index.encode(accounts[name]) for name in names}
+        positions1 = {name: {idx: pos for pos, idx in enumerate(encoded[name][0]['index'])} for name in names}
+        
+        available = np.ones(len(index), dtype=bool)
+        pending = {name: np.ones(len(encoded[name][0]['fecha']), dtype=bool) for name in names}
+        matches = {name: [] for name in names}
+        unmatched = {}
+        groups = 0  # los grupos agregados se renumeran para que no se repitan entre cuentas ni rondas
+        
+        def run(name):
+            side, keys = encoded[name]
+            return _reconcile_sides(side, index.side, name, index.name, keys=(keys, index.keys),
+                                    pending1=pending[name], available2=available, records2=index.records, **options)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while names:
+                round_results = list(executor.map(run, names))
+                retry = []
+                for name, results in zip(names, round_results):
+                    pos1, pos2, claimed, unmatched[name] = _split_account_results(results, index, positions1[name])
+                    # Un cruce (o grupo agregado) se mantiene solo si todas sus filas del libro siguen libres
+                    free = pd.Series(available[pos2]).groupby(pos1).transform('all').to_numpy(dtype=bool)
+                    available[pos2[free]] = False
+                    pending[name][pos1[free]] = False
+                    kept = [result for result, keep in zip(claimed, free.tolist()) if keep]
+                    numbers = {}
+                    for result in kept:
+                        if result['grupo_agregado'] is not None:
+                            result['grupo_agregado'] = numbers.setdefault(result['grupo_agregado'],
+                                                                          groups + len(numbers) + 1)
+                    groups += len(numbers)
+                    matches[name].extend(kept)
+                    # Las filas que perdieron su cruce (y las que quedaron sin cruce) se reintentan
+                    if not free.all():
+                        retry.append(name)
+                names = retry
+        
+        results = []
+        for name in accounts:
+            results.extend(matches[name])
+            results.extend(unmatched[name])
+        results.extend({
+            'banco': {'fecha': '', 'monto': 0, 'referencia': '', 'descripcion': '', 'origen': ''},
+            'interno': index.records[pos2],
+            'estado': 'No conciliado',
+            'origen': index.name,
+            'fila_banco': None,
+            'fila_interno': index.records[pos2]._excel_row,
+            'dias_diferencia': None,
+            'diferencia_monto': None,
+            'tolerancia_monto': None,
+            'grupo_agregado': None
+        } for pos2 in np.flatnonzero(available).tolist())
+        return results
+
+def row_fingerprints(side):
+    """Huella de contenido de cada fila normalizada y su número de aparición
+    
+    La huella (uint64) cubre fecha, monto, referencia y descripción normalizados;
+    las filas idénticas se distinguen por su orden de aparición, así (hash, occ)
+    identifica una fila entre cargas aunque cambie su número de fila en el Excel.
+    """
+    frame = pd.DataFrame({column: side[column] for column in ('fecha', 'monto', 'referencia', 'descripcion')})
+    hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy(dtype='uint64')
+    occurrence = pd.Series(hashes).groupby(hashes, sort=False).cumcount().to_numpy(dtype='int64')
+    return pd.DataFrame({'hash': hashes, 'occ': occurrence})
+
+def _row_positions(side, records):
+    """Posiciones en side de registros de resultados (side['index'] está ordenado)"""
+    index = np.array([record._index_original for record in records], dtype='int64')
+    return np.searchsorted(np.asarray(side['index'], dtype='int64'), index)
+
+class IncrementalReconciliation:
+    """Conciliación incremental: filas normalizadas, huellas y cruces confirmados entre ejecuciones
+    
+    Cada update recibe los extractos completos (por ejemplo, el acumulado del
+    mes). Los cruces confirmados cuyas filas siguen presentes se conservan tal
+    cual; solo las filas abiertas (nuevas, modificadas o cuyo par desapareció)
+    pasan por el cruce vectorizado, así el costo del cruce depende de lo nuevo y
+    no del mes completo. Las opciones son las de reconcile_data; un estado
+    guardado con otras opciones no se reutiliza (ver open). El estado se guarda
+    en un archivo SQLite (solo datos, nunca objetos de Python).
+    """
+    VERSION = 2
+    _PAIR_COLUMNS = {
+        'hash1': 'uint64', 'occ1': 'int64', 'hash2': 'uint64', 'occ2': 'int64', 'origen': object,
+        'dias': 'int64', 'diferencia': 'float64', 'tolerancia': 'float64', 'grupo': 'int64',
+    }
+    _ROW_COLUMNS = ('hash', 'occ', 'fecha', 'monto', 'referencia', 'descripcion', 'excel_row')
+    # Las huellas (uint64) se guardan con sus mismos bits como INTEGER de SQLite (int64)
+    SCHEMA = """
+    CREATE TABLE estado (clave TEXT PRIMARY KEY, valor TEXT NOT NULL);
+    CREATE TABLE filas (
+        lado INTEGER NOT NULL, hash INTEGER NOT NULL, occ INTEGER NOT NULL, fecha TEXT,
+        monto REAL, referencia TEXT, descripcion TEXT, excel_row INTEGER
+    );
+    CREATE TABLE cruces (
+        hash1 INTEGER NOT NULL, occ1 INTEGER NOT NULL, hash2 INTEGER NOT NULL, occ2 INTEGER NOT NULL,
+        origen TEXT, dias INTEGER, diferencia REAL, tolerancia REAL, grupo INTEGER
+    );
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.rows = (None, None)
+        self.pairs = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in self._PAIR_COLUMNS.items()})
+        self.stats = {}
+
+    @classmethod
+    def open(cls, path, **options):
+        """Carga el estado guardado en path
+        
+        Devuelve uno vacío si el archivo no existe, no es un estado válido, es de
+        otra versión o usó otras opciones.
+        """
+        state = cls(**options)
+        if not os.path.exists(path):
+            return state
+        try:
+            with closing(sqlite3.connect(path)) as connection:
+                saved = dict(connection.execute("SELECT clave, valor FROM estado").fetchall())
+                if saved.get('version') != str(cls.VERSION) or saved.get('opciones') != json.dumps(options, sort_keys=True):
+                    return state
+                rows = pd.read_sql_query("SELECT * FROM filas ORDER BY rowid", connection)
+                pairs = pd.read_sql_query("SELECT * FROM cruces ORDER BY rowid", connection)
+        except sqlite3.DatabaseError:
+            return state
+        
+        rows['hash'] = rows['hash'].to_numpy(dtype='int64').view('uint64')
+        state.rows = tuple(
+            rows.loc[rows['lado'] == lado, list(cls._ROW_COLUMNS)].reset_index(drop=True)
+            if saved.get(f'filas{lado}') else None
+            for lado in (1, 2)
+        )
+        for column in ('hash1', 'hash2'):
+            pairs[column] = pairs[column].to_numpy(dtype='int64').view('uint64')
+        state.pairs = pairs.astype(cls._PAIR_COLUMNS)
+        return state
+
+    def save(self, path):
+        """Guarda el estado en path (SQLite); el archivo se reemplaza completo al terminar"""
+        temporary = path + '.tmp'
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        with closing(sqlite3.connect(temporary)) as connection:
+            connection.executescript(self.SCHEMA)
+            connection.executemany("INSERT INTO estado (clave, valor) VALUES (?, ?)", [
+                ('version', str(self.VERSION)),
+                ('opciones', json.dumps(self.options, sort_keys=True)),
+            ] + [(f'filas{lado}', '1') for lado, rows in enumerate(self.rows, 1) if rows is not None])
+            for lado, rows in enumerate(self.rows, 1):
+                if rows is not None:
+                    rows = rows[list(self._ROW_COLUMNS)].assign(lado=lado, hash=rows['hash'].to_numpy().view('int64'))
+                    rows.to_sql('filas', connection, if_exists='append', index=False)
+            self.pairs.assign(hash1=self.pairs['hash1'].to_numpy().view('int64'),
+                              hash2=self.pairs['hash2'].to_numpy().view('int64')
+                              ).to_sql('cruces', connection, if_exists='append', index=False)
+            connection.commit()
+        os.replace(temporary, path)
+
+    def _new_rows(self, side, keys):
+        """Máscara de las filas que no estaban en la carga anterior (nuevas o modificadas)"""
+        previous = self.rows[side]
+        if previous is None:
+            return np.ones(len(keys), dtype=bool)
+        seen = keys.merge(previous[['hash', 'occ']], on=['hash', 'occ'], how='left', indicator=True)
+        return np.array(seen['_merge'] == 'left_only', dtype=bool)
+
+    def update(self, data1, data2, name1="Hoja 1", name2="Hoja 2"):
+        """Concilia la nueva carga completa contra el estado y devuelve todos los resultados
+        
+        Primero los cruces conservados (en su orden original), luego los cruces
+        nuevos y las filas sin cruce, con el formato de reconcile_data. Solo se
+        cruzan las filas abiertas de los días (±date_tolerance) que tienen filas
+        nuevas, modificadas o reabiertas: las demás abiertas ya se compararon
+        entre sí con las mismas opciones.
+        """
+        with _gc_paused():
+            side1 = _normalize_matching_side(data1)
+            side2 = _normalize_matching_side(data2)
+            keys1, keys2 = row_fingerprints(side1), row_fingerprints(side2)
+            new1, new2 = self._new_rows(0, keys1), self._new_rows(1, keys2)
+            
+            # Cruces previos cuyas filas siguen presentes; un grupo agregado se conserva completo o no se conserva
+            pairs = self.pairs.merge(keys1.assign(pos1=np.arange(len(keys1))).rename(columns={'hash': 'hash1', 'occ': 'occ1'}),
+                                     on=['hash1', 'occ1'], how='left')
+            pairs = pairs.merge(keys2.assign(pos2=np.arange(len(keys2))).rename(columns={'hash': 'hash2', 'occ': 'occ2'}),
+                                on=['hash2', 'occ2'], how='left')
+            present = pairs['pos1'].notna() & pairs['pos2'].notna()
+            keep = present.groupby([pairs['hash1'], pairs['occ1']]).transform('all').to_numpy(dtype=bool)
+            kept = pairs[keep]
+            kept_pos1 = kept['pos1'].to_numpy(dtype='int64')
+            kept_pos2 = kept['pos2'].to_numpy(dtype='int64')
+            # Las filas que perdieron su par vuelven a cruzarse como si fueran nuevas
+            new1[pairs.loc[~keep, 'pos1'].dropna().to_numpy(dtype='int64')] = True
+            new2[pairs.loc[~keep, 'pos2'].dropna().to_numpy(dtype='int64')] = True
+            
+            open1 = np.ones(len(keys1), dtype=bool)
+            open1[kept_pos1] = False
+            open2 = np.ones(len(keys2), dtype=bool)
+            open2[kept_pos2] = False
+            
+            records1 = _side_records(_subset_side(side1, kept_pos1.tolist()), name1)
+            records2 = _side_records(_subset_side(side2, kept_pos2.tolist()), name2)
+            results = [{
+                'banco': row1,
+                'interno': row2,
+                'estado': 'Conciliado',
+                'origen': origen,
+                'fila_banco': row1._excel_row,
+                'fila_interno': row2._excel_row,
+                'dias_diferencia': dias,
+                'diferencia_monto': diferencia,
+                'tolerancia_monto': tolerancia,
+                'grupo_agregado': grupo or None
+            } for row1, row2, origen, dias, diferencia, tolerancia, grupo in zip(
+                records1, records2, kept['origen'].tolist(), kept['dias'].tolist(),
+                kept['diferencia'].tolist(), kept['tolerancia'].tolist(), kept['grupo'].tolist()
+            )]
+            
+            # Solo las filas abiertas de los días alcanzados por filas nuevas pasan por el cruce
+            left, right = _key_frames(side1, side2)
+            day1, day2 = left['fecha'].to_numpy(), right['fecha'].to_numpy()
+            tolerance = self.options.get('date_tolerance', 0)
+            days = np.unique(np.concatenate([day1[open1 & new1], day2[open2 & new2]]))
+            def near_new(day):
+                if len(days) == 0:
+                    return np.zeros(len(day), dtype=bool)
+                nearest = days[np.minimum(np.searchsorted(days, day - tolerance), len(days) - 1)]
+                return (nearest >= day - tolerance) & (nearest <= day + tolerance)
+            active1 = np.flatnonzero(open1 & near_new(day1))
+            active2 = np.flatnonzero(open2 & near_new(day2))
+            active_keys = (left.iloc[active1].assign(pos=np.arange(len(active1))),
+                           right.iloc[active2].assign(pos=np.arange(len(active2))))
+            opened = _reconcile_sides(_subset_side(side1, active1.tolist()), _subset_side(side2, active2.tolist()),
+                                      name1, name2, keys=active_keys, **self.options)
+            matched = [result for result in opened if result['estado'] == 'Conciliado']
+            offset = int(kept['grupo'].max()) if len(kept) else 0
+            for result in matched:
+                if result['grupo_agregado'] is not None:
+                    result['grupo_agregado'] += offset
+            results.extend(matched)
+            
+            pos1 = _row_positions(side1, [result['banco'] for result in matched])
+            pos2 = _row_positions(side2, [result['interno'] for result in matched])
+            open1[pos1] = False
+            open2[pos2] = False
+            # Filas sin cruce de ambos lados, en su orden, con el mismo formato que los demás motores
+            unmatched1 = _subset_side(side1, np.flatnonzero(open1).tolist())
+            unmatched2 = _subset_side(side2, np.flatnonzero(open2).tolist())
+            n1, n2 = len(unmatched1['fecha']), len(unmatched2['fecha'])
+            none = np.zeros(n1, dtype='int64')
+            state = (none - 1, none.astype('int8'), none, none, none, [], np.zeros(n2, dtype=bool))
+            results.extend(_build_results(unmatched1, unmatched2, name1, name2, state, None))
+            
+            new_pairs = pd.DataFrame({
+                'hash1': keys1['hash'].to_numpy()[pos1],
+                'occ1': keys1['occ'].to_numpy()[pos1],
+                'hash2': keys2['hash'].to_numpy()[pos2],
+                'occ2': keys2['occ'].to_numpy()[pos2],
+                'origen': [result['origen'] for result in matched],
+                'dias': [result['dias_diferencia'] for result in matched],
+                'diferencia': [result['diferencia_monto'] for result in matched],
+                'tolerancia': [result['tolerancia_monto'] for result in matched],
+                'grupo': [result['grupo_agregado'] or 0 for result in matched],
+            })
+            
+            self.stats = {
+                'conservados': len(kept),
+                'reabiertos': len(self.pairs) - len(kept),
+                'nuevas1': int(new1.sum()),
+                'nuevas2': int(new2.sum()),
+                'cruzadas1': len(active1),
+                'cruzadas2': len(active2),
+                'nuevos': len(new_pairs),
+            }
+            self.pairs = pd.concat([kept[list(self._PAIR_COLUMNS)], new_pairs], ignore_index=True).astype(self._PAIR_COLUMNS)
+            self.rows = tuple(
+                keys.assign(**{column: side[column] for column in ('fecha', 'monto', 'referencia', 'descripcion', 'excel_row')})
+                for keys, side in ((keys1, side1), (keys2, side2))
+            )
+            return results
+
+def _date_bounds(fechas, tolerance=0):
+    """(desde, hasta) YYYY-MM-DD de las fechas válidas, ampliado en ±tolerance días; None si no hay ninguna"""
+    encoder = MatchKeyEncoder()
+    days = [day for day in (encoder.day(fecha) for fecha in set(fechas)) if day >= 0]
+    if not days:
+        return None
+    return (datetime.fromordinal(max(min(days) - tolerance, 1)).strftime('%Y-%m-%d'),
+            datetime.fromordinal(max(days) + tolerance).strftime('%Y-%m-%d'))
+
+def _carried_side(items, side):
+    """Partidas arrastradas (primero, en orden de id) seguidas de las filas nuevas, como un solo lado
+    
+    Las arrastradas reciben índices negativos crecientes, así side['index'] sigue ordenado.
+    """
+    carried = len(items)
+    return {
+        'fecha': items['fecha'].tolist() + side['fecha'],
+        'monto': items['monto'].tolist() + side['monto'],
+        'referencia': items['referencia'].tolist() + side['referencia'],
+        'descripcion': items['descripcion'].tolist() + side['descripcion'],
+        'excel_row': items['excel_row'].tolist() + side['excel_row'],
+        'index': list(range(-carried, 0)) + side['index'],
+        'sources': None if side['sources'] is None else [{'source': None, 'position': None}] * carried + side['sources'],
+    }
+
+class ReconciliationStore:
+    """Almacén SQLite de movimientos normalizados y resultados de conciliación por período
+    
+    Cada período guarda sus movimientos (fecha, PV y centavos ya normalizados)
+    y los resultados del cruce. Las partidas que quedan abiertas se arrastran: al
+    conciliar un período, el cruce consulta las partidas abiertas de períodos
+    anteriores cuyas fechas caen en el rango de la nueva carga (±date_tolerance),
+    sobre los índices (fecha, pv, cents) y (fecha, cents), sin volver a leer los
+    archivos viejos. Volver a conciliar el último período reemplaza lo guardado
+    para él; un período con períodos posteriores guardados no se puede volver a
+    conciliar (sus partidas ya se arrastraron y cerraron más adelante).
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS movimientos (
+        id INTEGER PRIMARY KEY,
+        periodo TEXT NOT NULL,
+        lado INTEGER NOT NULL,
+        hoja TEXT,
+        fecha TEXT NOT NULL,
+        pv TEXT NOT NULL,
+        cents INTEGER NOT NULL,
+        monto REAL NOT NULL,
+        descripcion TEXT,
+        fila INTEGER,
+        abierto INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS movimientos_fecha_pv_cents ON movimientos (fecha, pv, cents);
+    CREATE INDEX IF NOT EXISTS movimientos_fecha_cents ON movimientos (fecha, cents);
+    CREATE INDEX IF NOT EXISTS movimientos_periodo ON movimientos (periodo);
+    CREATE TABLE IF NOT EXISTS resultados (
+        id INTEGER PRIMARY KEY,
+        periodo TEXT NOT NULL,
+        mov1 INTEGER REFERENCES movimientos (id),
+        mov2 INTEGER REFERENCES movimientos (id),
+        estado TEXT NOT NULL,
+        origen TEXT,
+        dias INTEGER,
+        diferencia REAL,
+        tolerancia REAL,
+        grupo INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS resultados_periodo ON resultados (periodo);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(self.SCHEMA)
+        self.stats = {}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open_items(self, lado, periodo, desde, hasta):
+        """Partidas abiertas de períodos anteriores a periodo, con fecha entre desde y hasta"""
+        return pd.read_sql_query(
+            "SELECT id, fecha, monto, pv AS referencia, descripcion, fila AS excel_row FROM movimientos "
+            "WHERE fecha BETWEEN ? AND ? AND lado = ? AND abierto = 1 AND periodo < ? ORDER BY id",
+            self.connection, params=(desde, hasta, lado, periodo)
+        )
+
+    def later_periods(self, periodo):
+        """Períodos guardados posteriores a periodo, en orden"""
+        return [row[0] for row in self.connection.execute(
+            "SELECT periodo FROM movimientos WHERE periodo > ? UNION "
+            "SELECT periodo FROM resultados WHERE periodo > ? ORDER BY 1", (periodo, periodo)
+        )]
+
+    def _clear_period(self, periodo):
+        """Quita lo guardado para periodo y reabre las partidas arrastradas que ese período había cerrado"""
+        self.connection.execute(
+            "UPDATE movimientos SET abierto = 1 WHERE id IN ("
+            "SELECT mov1 FROM resultados WHERE periodo = ? AND estado = 'Conciliado' UNION "
+            "SELECT mov2 FROM resultados WHERE periodo = ? AND estado = 'Conciliado')", (periodo, periodo)
+        )
+        self.connection.execute("DELETE FROM resultados WHERE periodo = ?", (periodo,))
+        self.connection.execute("DELETE FROM movimientos WHERE periodo = ?", (periodo,))
+
+    def _insert_movements(self, periodo, lado, hoja, side, first_id, matched):
+        """Inserta las filas nuevas de un lado con ids consecutivos desde first_id"""
+        cents = np.rint(np.array(side['monto'], dtype='float64') * 100).astype('int64').tolist()
+        self.connection.executemany(
+            "INSERT INTO movimientos (id, periodo, lado, hoja, fecha, pv, cents, monto, descripcion, fila, abierto) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            zip(range(first_id, first_id + len(cents)), [periodo] * len(cents), [lado] * len(cents),
+                [hoja] * len(cents), side['fecha'], side['referencia'], cents, side['monto'],
+                side['descripcion'], side['excel_row'], (~matched).astype(int).tolist())
+        )
+
+    def reconcile_period(self, periodo, data1, data2, name1="Hoja 1", name2="Hoja 2", **options):
+        """Concilia la carga de un período junto con las partidas abiertas arrastradas y la guarda
+        
+        periodo: texto ordenable (por ejemplo '2025-01'). options: las de
+        reconcile_data. Devuelve los resultados con el formato de siempre; las
+        partidas arrastradas aparecen con su fila del archivo original.
+        
+        ValueError si ya hay períodos posteriores guardados: sus resultados
+        apuntan a los movimientos de este período y a las partidas que cerraron.
+        """
+        later = self.later_periods(periodo)
+        if later:
+            raise ValueError(f"No se puede conciliar el período {periodo}: ya hay períodos posteriores "
+                             f"guardados ({', '.join(later)}). Solo se puede volver a conciliar el último.")
+        with _gc_paused():
+            self._clear_period(periodo)
+            new1 = _normalize_matching_side(data1)
+            new2 = _normalize_matching_side(data2)
+            # Sin fechas válidas en la carga, el rango queda vacío y no se arrastra nada
+            desde, hasta = _date_bounds(new1['fecha'] + new2['fecha'], options.get('date_tolerance', 0)) or ('', '')
+            carried = [self.open_items(lado, periodo, desde, hasta) for lado in (1, 2)]
+            side1, side2 = _carried_side(carried[0], new1), _carried_side(carried[1], new2)
+            results = _reconcile_sides(side1, side2, name1, name2, **options)
+            
+            # Ids de cada posición de los lados: los de las arrastradas y los nuevos, consecutivos
+            first_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM movimientos").fetchone()[0]
+            new_ids1 = np.arange(first_id, first_id + len(new1['fecha']))
+            new_ids2 = np.arange(first_id + len(new1['fecha']), first_id + len(new1['fecha']) + len(new2['fecha']))
+            ids1 = np.concatenate([carried[0]['id'].to_numpy(dtype='int64'), new_ids1])
+            ids2 = np.concatenate([carried[1]['id'].to_numpy(dtype='int64'), new_ids2])
+            
+            rows1 = [result for result in results if result['fila_banco'] is not None]
+            rows2 = [result for result in results if result['interno'] is not None]
+            mov1 = dict(zip(map(id, rows1), ids1[_row_positions(side1, [r['banco'] for r in rows1])].tolist()))
+            mov2 = dict(zip(map(id, rows2), ids2[_row_positions(side2, [r['interno'] for r in rows2])].tolist()))
+            closed1 = np.zeros(len(ids1), dtype=bool)
+            closed2 = np.zeros(len(ids2), dtype=bool)
+            matched = [result for result in results if result['estado'] == 'Conciliado']
+            closed1[_row_positions(side1, [r['banco'] for r in matched])] = True
+            closed2[_row_positions(side2, [r['interno'] for r in matched])] = True
+            
+            self._insert_movements(periodo, 1, name1, new1, first_id, closed1[len(carried[0]):])
+            self._insert_movements(periodo, 2, name2, new2, first_id + len(new1['fecha']), closed2[len(carried[1]):])
+            self.connection.executemany(
+                "UPDATE movimientos SET abierto = 0 WHERE id = ?",
+                [(mov,) for mov in np.concatenate([ids1[:len(carried[0])][closed1[:len(carried[0])]],
+                                                   ids2[:len(carried[1])][closed2[:len(carried[1])]]]).tolist()]
+            )
+            self.connection.executemany(
+                "INSERT INTO resultados (periodo, mov1, mov2, estado, origen, dias, diferencia, tolerancia, grupo) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(periodo, mov1.get(id(result)), mov2.get(id(result)), result['estado'], result['origen'],
+                  result['dias_diferencia'], result['diferencia_monto'], result['tolerancia_monto'],
+                  result['grupo_agregado']) for result in results]
+            )
+            self.connection.commit()
+        
+        self.stats = {
+            'arrastradas1': len(carried[0]),
+            'arrastradas2': len(carried[1]),
+            'cerradas': int(closed1[:len(carried[0])].sum() + closed2[:len(carried[1])].sum()),
+            'abiertas1': int((~closed1).sum()),
+            'abiertas2': int((~closed2).sum()),
+        }
+        return results
+
+    def period_results(self, periodo):
+        """Resultados guardados de un período, con los movimientos de ambos lados, como DataFrame"""
+        return pd.read_sql_query(
+            "SELECT r.estado, r.origen, m1.periodo AS periodo_1, m1.fila AS fila_1, m1.fecha AS fecha_1, "
+            "m1.monto AS monto_1, m1.pv AS pv_1, m2.periodo AS periodo_2, m2.fila AS fila_2, "
+            "m2.fecha AS fecha_2, m2.monto AS monto_2, m2.pv AS pv_2, r.dias, r.diferencia, r.tolerancia, r.grupo "
+            "FROM resultados r LEFT JOIN movimientos m1 ON m1.id = r.mov1 "
+            "LEFT JOIN movimientos m2 ON m2.id = r.mov2 WHERE r.periodo = ? ORDER BY r.id",
+            self.connection, params=(periodo,)
+        )
+
+# Motores de conciliación disponibles (clave -> función)
+RECONCILE_ENGINES = {
+    'python': reconcile_data,
+    'vectorizado': reconcile_data_vectorized,
+    'jerarquico': reconcile_data_hierarchical,
+    'paralelo': reconcile_data_parallel,
+}
+
+def reconcile(data1, data2, name1="Hoja 1", name2="Hoja 2", engine='python', **options):
+    """Reconcilia con el motor indicado ('python', 'vectorizado', 'jerarquico' o 'paralelo')
+    
+    options: date_tolerance, amount_tolerance, amount_tolerance_pct, aggregate y
+    aggregate_by_pv (ver reconcile_data), más workers para 'paralelo'. 'python',
+    'vectorizado', 'jerarquico' y 'paralelo' dan el mismo resultado; 'jerarquico'
+    cruza primero por separado los días cuyos totales cuadran.
+    """
+    if engine not in RECONCILE_ENGINES:
+        raise ValueError(f"Motor de conciliación desconocido: {engine}")
+    if options.get('date_tolerance', 0) < 0:
+        raise ValueError(f"La tolerancia de fecha no puede ser negativa: {options['date_tolerance']}")
+    if options.get('amount_tolerance', 0) < 0 or options.get('amount_tolerance_pct', 0) < 0:
+        raise ValueError("Las tolerancias de monto no pueden ser negativas")
+    if options.get('workers') is not None and options['workers'] < 1:
+        raise ValueError(f"La cantidad de procesos debe ser al menos 1: {options['workers']}")
+    return RECONCILE_ENGINES[engine](data1, data2, name1, name2, **options)
+
+def match_summary(results):
+    """Conteos de una conciliación contando cada fila una sola vez
+    
+    Un cruce por agregados produce un resultado por fila de data2, todos con la
+    misma fila de data1 y el mismo grupo_agregado: esa fila se cuenta (y su monto
+    se suma) una sola vez. Retorna conciliados1 / conciliados2 (filas de cada
+    lado con cruce), no_conciliados1 / no_conciliados2, monto_conciliado (montos
+    de data1), monto_no_conciliado y por_origen (filas de data1 por origen).
+    """
+    summary = {
+        'conciliados1': 0,
+        'conciliados2': 0,
+        'no_conciliados1': 0,
+        'no_conciliados2': 0,
+        'monto_conciliado': 0.0,
+        'monto_no_conciliado': 0.0,
+        'por_origen': {},
+    }
+    groups = set()
+    for result in results:
+        banco = result['banco']
+        interno = result.get('interno')
+        monto = (banco.get('monto', 0) or interno.get('monto', 0) if interno else banco.get('monto', 0)) or 0
+        if result['estado'] != 'Conciliado':
+            summary['no_conciliados2' if interno else 'no_conciliados1'] += 1
+            summary['monto_no_conciliado'] += monto
+            continue
+        summary['conciliados2'] += 1
+        grupo = result.get('grupo_agregado')
+        if grupo is not None:
+            if grupo in groups:
+                continue
+            groups.add(grupo)
+        summary['conciliados1'] += 1
+        summary['monto_conciliado'] += monto
+        summary['por_origen'][result['origen']] = summary['por_origen'].get(result['origen'], 0) + 1
+    return summary
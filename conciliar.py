@@ -0,0 +1,415 @@
+"""
+Conciliación por línea de comandos, sin Streamlit
+
+Uso:
+    python -m conciliar BANCO INTERNO [-o resultado.xlsx] [opciones]
+    python -m conciliar BANCO1 INTERNO1 BANCO2 INTERNO2 ... --jobs 4 -o salida/
+    python -m conciliar --lote cierre/2025-01/ --jobs 8 -o salida/
+
+Cada par (archivo del banco, archivo interno) se lee, se concilia y se guarda
+como libro Excel (hoja de resultados y hojas originales con la columna "Cruce")
+o como CSV o Parquet (si no caben en un libro, en un zip de varios libros); con --marcar-original se guarda además una copia de los libros
+originales con la columna "Cruce". Con varios pares, -o es un directorio y --jobs reparte los pares en
+varios procesos. Con --lote, los pares se arman a partir de un directorio o
+glob según el nombre de los archivos (ver find_pairs) y al final se escribe un
+resumen consolidado. Pensado para correr desde cron: no importa Streamlit y el
+código de salida es 1 si algún par falló.
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from conciliacion import (
+    RECONCILE_ENGINES,
+    NormalizationCache,
+    WorkbookCache,
+    match_summary,
+    process_excel_file,
+    process_excel_file_streaming,
+    reconcile,
+)
+from exportacion import (
+    EXCEL_MAX_ROWS,
+    add_original_sheets,
+    create_excel_with_format,
+    mark_original_workbooks,
+    write_results_csv,
+    write_results_parquet,
+    write_results_sharded,
+)
+
+SIDE_NAMES = ("Banco", "Interno")
+COLUMN_FIELDS = ('fecha', 'monto', 'referencia', 'descripcion')
+
+# Modo lote: palabra del nombre que indica el lado y reglas por defecto para separar la clave del par
+SIDE_WORDS = {'banco': 0, 'extracto': 0, 'interno': 1, 'libro': 1, 'mayor': 1}
+PAIRING_RULES = (
+    r'^(?P<clave>.+?)[ _.-]+(?P<lado>banco|extracto|interno|libro|mayor)$',
+    r'^(?P<lado>banco|extracto|interno|libro|mayor)[ _.-]+(?P<clave>.+)$',
+)
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+BATCH_SUMMARY_NAME = 'resumen_conciliacion'
+
+
+def _load_side(path, sheet, columns, streaming, cache, normalization_cache=None):
+    """Datos normalizados de un archivo (y su DataFrame original, salvo en streaming)"""
+    kwargs = {f'{field}_col': columns.get(field) for field in COLUMN_FIELDS}
+    if streaming:
+        data, error = process_excel_file_streaming(path, sheet, normalization_cache=normalization_cache, **kwargs)
+        return data, None, error
+    data, error = process_excel_file(path, sheet, columnar=True, cache=cache, normalization_cache=normalization_cache, **kwargs)
+    original = cache.get_sheet(path, sheet or 0) if not error else None
+    return data, original, error
+
+
+def reconcile_pair(job):
+    """Concilia un par de archivos y escribe la salida; devuelve un resumen del par
+
+    job es un dict (picklable, para ProcessPoolExecutor) con banco, interno,
+    salida, hojas, columnas, engine, options, streaming, originales, marcar,
+    filas_por_libro y cache_normalizacion (ruta de la NormalizationCache o None). Con más resultados que filas_por_libro, la salida xlsx pasa
+    a ser un zip de varios libros (ver write_results_sharded).
+    """
+    start = time.perf_counter()
+    summary = {'clave': job['clave'], 'banco': job['banco'], 'interno': job['interno'],
+               'salida': job['salida'], 'error': None}
+    cache = WorkbookCache()
+    # Cada proceso abre su propia conexión; SQLite coordina la escritura entre ellos
+    normalization_cache = NormalizationCache(job['cache_normalizacion']) if job['cache_normalizacion'] else None
+    sides = []
+    try:
+        for name, path, sheet, columns in zip(SIDE_NAMES, (job['banco'], job['interno']), job['hojas'], job['columnas']):
+            data, original, error = _load_side(path, sheet, columns, job['streaming'], cache, normalization_cache)
+            if error or data is None or len(data) == 0:
+                summary['error'] = f"{name} ({path}): {error or 'sin datos válidos'}"
+                summary['segundos'] = time.perf_counter() - start
+                return summary
+            sides.append((data, original))
+    finally:
+        if normalization_cache is not None:
+            normalization_cache.close()
+
+    (data1, original1), (data2, original2) = sides
+    results = reconcile(data1, data2, SIDE_NAMES[0], SIDE_NAMES[1], engine=job['engine'], **job['options'])
+
+    originals = {'original_df1': original1, 'original_df2': original2} if job['originales'] and not job['streaming'] else {}
+    if job['salida'].lower().endswith('.csv'):
+        write_results_csv(results, SIDE_NAMES, job['salida'])
+    elif job['salida'].lower().endswith('.parquet'):
+        write_results_parquet(results, SIDE_NAMES, job['salida'])
+    elif len(results) > job['filas_por_libro']:
+        # Más filas de las que caben en un libro: varios libros en un zip junto a la salida
+        summary['salida'] = os.path.splitext(job['salida'])[0] + '.zip'
+        write_results_sharded(results, SIDE_NAMES, summary['salida'], job['filas_por_libro'],
+                              original_files_data=originals)
+    else:
+        wb = create_excel_with_format(results, SIDE_NAMES, write_only=True)
+        if originals:
+            add_original_sheets(wb, results, SIDE_NAMES, originals)
+        wb.save(job['salida'])
+    if job['marcar']:
+        write_marked_copies(results, job)
+
+    # Cada fila una sola vez: un cruce por agregados repite la fila del banco en cada parte
+    counts = match_summary(results)
+    summary.update({
+        'filas_banco': len(data1),
+        'filas_interno': len(data2),
+        'conciliados': counts['conciliados1'],
+        'conciliados_interno': counts['conciliados2'],
+        'no_conciliados': counts['no_conciliados1'] + counts['no_conciliados2'],
+        'montos_ambiguos': len(data1.attrs.get('montos_ambiguos', [])) + len(data2.attrs.get('montos_ambiguos', [])),
+        'segundos': time.perf_counter() - start,
+    })
+    return summary
+
+
+def marked_copies(job):
+    """Copias marcadas de un par: [(libro original, salida, [(hoja, lado)])]
+
+    Junto a la salida, con el sufijo _original (o _original_banco / _original_interno
+    si los lados vienen de libros distintos) y la extensión del libro original.
+    """
+    root = os.path.splitext(job['salida'])[0]
+    books = {}
+    for side, (path, sheet) in enumerate(zip((job['banco'], job['interno']), job['hojas'])):
+        books.setdefault(path, []).append((0 if sheet is None else sheet, side))
+    copies = []
+    for path, sheets in books.items():
+        suffix = '_original' if len(books) == 1 else f"_original_{SIDE_NAMES[sheets[0][1]].lower()}"
+        copies.append((path, f"{root}{suffix}{os.path.splitext(path)[1]}", sheets))
+    return copies
+
+
+def write_marked_copies(results, job):
+    """Escribe las copias de los libros originales con la columna "Cruce" (ver mark_original_workbooks)"""
+    copies = marked_copies(job)
+    workbooks = []
+    for path, _, sheets in copies:
+        with open(path, 'rb') as f:
+            workbooks.append((f.read(), sheets))
+    for (_, salida, _), content in zip(copies, mark_original_workbooks(results, SIDE_NAMES, workbooks)):
+        with open(salida, 'wb') as f:
+            f.write(content)
+
+
+def run_jobs(jobs, max_jobs=1, progress=None):
+    """Ejecuta los pares (en paralelo si max_jobs > 1) y devuelve los resúmenes en el orden de jobs
+
+    progress(resumen) se llama a medida que termina cada par.
+    """
+    summaries = [None] * len(jobs)
+    def finish(i, run):
+        try:
+            summaries[i] = run()
+        except Exception as e:
+            summaries[i] = {'clave': jobs[i]['clave'], 'banco': jobs[i]['banco'], 'interno': jobs[i]['interno'],
+                            'salida': jobs[i]['salida'], 'error': str(e), 'segundos': None}
+        if progress:
+            progress(summaries[i])
+
+    if max_jobs <= 1 or len(jobs) <= 1:
+        for i, job in enumerate(jobs):
+            finish(i, lambda: reconcile_pair(job))
+        return summaries
+    with ProcessPoolExecutor(max_workers=min(max_jobs, len(jobs))) as executor:
+        futures = {executor.submit(reconcile_pair, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            finish(futures[future], future.result)
+    return summaries
+
+
+def format_summary(summary):
+    """Línea de texto con el resultado de un par"""
+    if summary['error']:
+        return f"ERROR {summary['banco']} / {summary['interno']}: {summary['error']}"
+    ambiguous = f", {summary['montos_ambiguos']} montos ambiguos" if summary.get('montos_ambiguos') else ''
+    return (f"OK    {summary['banco']} / {summary['interno']} -> {summary['salida']}: "
+            f"{summary['conciliados']} conciliados, {summary['no_conciliados']} no conciliados{ambiguous} "
+            f"({summary['segundos']:.2f} s)")
+
+
+def output_path(clave, salida, formato, multiple):
+    """Ruta de salida de un par: -o tal cual para un solo par, o un archivo por par en el directorio -o"""
+    if salida and not multiple:
+        return salida
+    return os.path.join(salida or '.', f"conciliacion_{clave}.{formato}")
+
+
+def find_pairs(source, rules=PAIRING_RULES):
+    """Arma los pares (clave, banco, interno) de los Excel de un directorio o glob según su nombre
+
+    Cada regla es una expresión regular (sin distinguir mayúsculas) sobre el
+    nombre sin extensión, con los grupos clave y lado; lado es una palabra de
+    SIDE_WORDS. Dos archivos forman un par si tienen la misma clave y lados
+    distintos, por ejemplo "2025-01_cta123_banco.xlsx" y "2025-01_cta123_interno.xlsx".
+    Devuelve los pares ordenados por clave y la lista de archivos sin par.
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    paths = sorted(path for path in paths if os.path.isfile(path) and path.lower().endswith(EXCEL_EXTENSIONS)
+                   and not os.path.basename(path).startswith('~$'))
+    compiled = [re.compile(rule, re.IGNORECASE) for rule in rules]
+    for rule in compiled:
+        if not {'clave', 'lado'} <= set(rule.groupindex):
+            raise ValueError(f"la regla {rule.pattern!r} debe tener los grupos clave y lado")
+
+    found = {}
+    unpaired = []
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        match = next((m for m in (rule.match(stem) for rule in compiled) if m), None)
+        side = SIDE_WORDS.get(match.group('lado').lower()) if match else None
+        if side is None or found.setdefault(match.group('clave'), [None, None])[side] is not None:
+            unpaired.append(path)
+            continue
+        found[match.group('clave')][side] = path
+
+    pairs = []
+    for clave, (banco, interno) in sorted(found.items()):
+        if banco and interno:
+            pairs.append((clave, banco, interno))
+        else:
+            unpaired.append(banco or interno)
+    return pairs, sorted(unpaired)
+
+
+def write_batch_summary(summaries, path):
+    """Resumen consolidado del lote: una fila por par, más una fila de totales (xlsx o csv según path)"""
+    frame = pd.DataFrame([{
+        'Clave': summary['clave'],
+        'Archivo banco': summary['banco'],
+        'Archivo interno': summary['interno'],
+        'Salida': None if summary['error'] else summary['salida'],
+        'Filas banco': summary.get('filas_banco'),
+        'Filas interno': summary.get('filas_interno'),
+        'Conciliados banco': summary.get('conciliados'),
+        'Conciliados interno': summary.get('conciliados_interno'),
+        'No conciliados': summary.get('no_conciliados'),
+        'Segundos': round(summary['segundos'], 2) if summary.get('segundos') is not None else None,
+        'Error': summary['error'],
+    } for summary in summaries])
+    totals = frame[['Filas banco', 'Filas interno', 'Conciliados banco', 'Conciliados interno',
+                    'No conciliados', 'Segundos']].sum()
+    frame.loc[len(frame)] = {'Clave': 'TOTAL', **totals.to_dict(),
+                             'Error': f"{frame['Error'].notna().sum()} pares con error"}
+    # Cada lado contra sus propias filas: un agregado cruza una fila del banco con varias internas
+    for lado in ('banco', 'interno'):
+        filas = frame[f'Filas {lado}']
+        frame[f'% {lado}'] = (frame[f'Conciliados {lado}'] / filas.where(filas > 0) * 100).round(1)
+    if path.lower().endswith('.csv'):
+        frame.to_csv(path, index=False, encoding='utf-8-sig')
+    else:
+        frame.to_excel(path, index=False, sheet_name='Resumen')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m conciliar',
+        description="Concilia archivos Excel del banco contra archivos internos, sin interfaz."
+    )
+    parser.add_argument('archivos', nargs='*', metavar='ARCHIVO',
+                        help="Pares BANCO INTERNO (uno o varios pares seguidos)")
+    parser.add_argument('--lote', metavar='DIRECTORIO_O_GLOB',
+                        help="Concilia todos los pares de un directorio o glob (pares por nombre de archivo)")
+    parser.add_argument('--regla', action='append', metavar='REGEX',
+                        help="Regla de emparejamiento del modo lote: regex con los grupos (?P<clave>...) "
+                             "y (?P<lado>banco|extracto|interno|libro|mayor); se puede repetir")
+    parser.add_argument('-o', '--salida',
+                        help="Archivo de salida (.xlsx, .csv o .parquet) o, con varios pares, directorio de salida")
+    parser.add_argument('--formato', choices=('xlsx', 'csv', 'parquet'),
+                        help="Formato de salida (por defecto según la extensión de -o, o xlsx)")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Pares a procesar en paralelo (procesos)")
+    parser.add_argument('--hoja-banco', help="Hoja del archivo del banco (por defecto la primera)")
+    parser.add_argument('--hoja-interno', help="Hoja del archivo interno (por defecto la primera)")
+    for side in ('banco', 'interno'):
+        for field in COLUMN_FIELDS:
+            parser.add_argument(f'--{side}-{field}', metavar='COLUMNA',
+                                help=f"Columna de {field} del archivo {side} (por defecto se detecta)")
+    parser.add_argument('--engine', choices=sorted(RECONCILE_ENGINES), default='vectorizado',
+                        help="Motor de conciliación")
+    parser.add_argument('--workers', type=int, help="Procesos del motor 'paralelo'")
+    parser.add_argument('--date-tolerance', type=int, default=0, help="Tolerancia de fecha (días)")
+    parser.add_argument('--amount-tolerance', type=float, default=0.0, help="Tolerancia de monto absoluta ($)")
+    parser.add_argument('--amount-tolerance-pct', type=float, default=0.0, help="Tolerancia de monto relativa (%%)")
+    parser.add_argument('--aggregate', action='store_true', help="Cruce por agregados")
+    parser.add_argument('--aggregate-by-pv', action='store_true', help="Agrupar agregados también por PV")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Lectura en streaming (archivos muy grandes; sin hojas originales)")
+    parser.add_argument('--sin-originales', action='store_true',
+                        help="No incluir las hojas originales en el libro de salida")
+    parser.add_argument('--filas-por-libro', type=int, default=EXCEL_MAX_ROWS - 1,
+                        help="Máximo de resultados por libro xlsx; si hay más, la salida es un zip con "
+                             "varios libros escritos en paralelo (por defecto el límite de filas de Excel)")
+    parser.add_argument('--marcar-original', action='store_true',
+                        help="Guardar además una copia de cada libro original (.xlsx/.xlsm) con la columna "
+                             "Cruce en sus propias hojas, conservando formatos, fórmulas y macros")
+    parser.add_argument('--cache-normalizacion', metavar='ARCHIVO',
+                        help="Caché SQLite de fechas de texto ya normalizadas, compartida entre "
+                             "ejecuciones, pares en paralelo y la app")
+    return parser
+
+
+def build_jobs(args, pairs, multiple=None):
+    """Trabajos (dicts) de cada par (clave, banco, interno) a partir de los argumentos"""
+    formato = args.formato or next((ext for ext in ('csv', 'parquet') if (args.salida or '').lower().endswith('.' + ext)),
+                                   'xlsx')
+    multiple = len(pairs) > 1 if multiple is None else multiple
+    if multiple and args.salida:
+        os.makedirs(args.salida, exist_ok=True)
+    options = {
+        'date_tolerance': args.date_tolerance,
+        'amount_tolerance': args.amount_tolerance,
+        'amount_tolerance_pct': args.amount_tolerance_pct,
+        'aggregate': args.aggregate,
+        'aggregate_by_pv': args.aggregate_by_pv,
+    }
+    if args.engine == 'paralelo' and args.workers:
+        options['workers'] = args.workers
+    columns = tuple({field: getattr(args, f'{side}_{field}') for field in COLUMN_FIELDS}
+                    for side in ('banco', 'interno'))
+    jobs = []
+    used = set()
+    for clave, banco, interno in pairs:
+        salida = output_path(clave, args.salida, formato, multiple)
+        # Dos pares con la misma clave no deben pisarse la salida
+        root, ext = os.path.splitext(salida)
+        n = 1
+        while salida in used:
+            n += 1
+            salida = f"{root}_{n}{ext}"
+        used.add(salida)
+        jobs.append((clave, banco, interno, salida))
+    return [{
+        'clave': clave,
+        'banco': banco,
+        'interno': interno,
+        'salida': salida,
+        'hojas': (args.hoja_banco, args.hoja_interno),
+        'columnas': columns,
+        'engine': args.engine,
+        'options': options,
+        'streaming': args.streaming,
+        'originales': not args.sin_originales,
+        'marcar': args.marcar_original,
+        'filas_por_libro': args.filas_por_libro,
+        'cache_normalizacion': args.cache_normalizacion,
+    } for clave, banco, interno, salida in jobs]
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.lote and args.archivos:
+        parser.error("use --lote o pares de archivos, no ambos")
+    if not args.lote and (not args.archivos or len(args.archivos) % 2):
+        parser.error("los archivos deben venir en pares BANCO INTERNO")
+    if args.jobs < 1:
+        parser.error("--jobs debe ser al menos 1")
+    if args.filas_por_libro < 1:
+        parser.error("--filas-por-libro debe ser al menos 1")
+
+    if args.lote:
+        try:
+            pairs, unpaired = find_pairs(args.lote, args.regla or PAIRING_RULES)
+        except (re.error, ValueError) as e:
+            parser.error(f"regla de emparejamiento inválida: {e}")
+        for path in unpaired:
+            print(f"AVISO sin par: {path}", file=sys.stderr, flush=True)
+        if not pairs:
+            print(f"No se encontraron pares en {args.lote}", file=sys.stderr)
+            return 1
+        jobs = build_jobs(args, pairs, multiple=True)
+    else:
+        archivos = args.archivos
+        pairs = [(os.path.splitext(os.path.basename(banco))[0], banco, interno)
+                 for banco, interno in zip(archivos[::2], archivos[1::2])]
+        jobs = build_jobs(args, pairs)
+
+    start = time.perf_counter()
+    done = []
+    def progress(summary):
+        done.append(summary)
+        print(f"[{len(done)}/{len(jobs)}] {format_summary(summary)}", flush=True)
+    summaries = run_jobs(jobs, args.jobs, progress=progress)
+
+    if args.lote:
+        summary_path = os.path.join(args.salida or '.', f"{BATCH_SUMMARY_NAME}.{'csv' if jobs[0]['salida'].endswith('.csv') else 'xlsx'}")
+        write_batch_summary(summaries, summary_path)
+        failed = sum(1 for summary in summaries if summary['error'])
+        print(f"Lote: {len(summaries) - failed} pares conciliados, {failed} con error, "
+              f"{time.perf_counter() - start:.2f} s en total. Resumen: {summary_path}", flush=True)
+    return 1 if any(summary['error'] for summary in summaries) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,517 @@
+"""
+Exportación de resultados de conciliación, sin interfaz
+
+Arma el libro Excel de resultados (con las hojas originales marcadas con la
+columna "Cruce"), un CSV o Parquet plano, o marca una copia del libro original
+subido. Los resultados que no caben en una hoja se reparten en varias hojas o,
+con write_results_sharded, en varios libros comprimidos en un zip. Lo usan app.py y la línea de comandos
+(conciliar.py); no importa Streamlit.
+"""
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+
+
+def describe_match(r, sheet_names, accounts=False):
+    """Tipo de coincidencia y mensaje legible de un resultado ("qué fila cruza con cuál")
+
+    Con accounts=True (libro mayor contra varias hojas de cuentas) el mensaje
+    nombra la hoja de cuenta de la fila en lugar de sheet_names[0].
+    """
+    tipo_coincidencia = ""
+    mensaje_cruce = ""
+    hoja = account_name(r, sheet_names) if accounts else sheet_names[0]
+    if r['estado'] == 'Conciliado':
+        fila_banco = r.get('fila_banco', '?')
+        if accounts:
+            fila_banco = f"{fila_banco} de {hoja}"
+        fila_interno = r.get('fila_interno', '?')
+
+        if r['origen'] == 'exacto_fecha_pv_monto':
+            tipo_coincidencia = "✅ EXACTA"
+            mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: Fecha+PV+Monto iguales"
+        elif r['origen'] == 'fecha_pv':
+            tipo_coincidencia = "🔄 FECHA+PV"
+            mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: Fecha y PV iguales"
+        elif r['origen'] == 'fecha_monto':
+            tipo_coincidencia = "📅 FECHA+MONTO"
+            mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: Fecha y Monto iguales"
+        elif r['origen'].startswith('agregado'):
+            tipo_coincidencia = "➕ AGREGADO"
+            mensaje_cruce = f"Fila {fila_banco} ↔ Fila {fila_interno}: parte de la suma #{r['grupo_agregado']} del abono"
+        if r.get('dias_diferencia'):
+            mensaje_cruce = mensaje_cruce.replace("Fecha y ", "") + f" (fechas a {r['dias_diferencia']:+d} días)"
+        if r.get('diferencia_monto'):
+            mensaje_cruce = mensaje_cruce.replace("Monto iguales", "Monto dentro de tolerancia") + \
+                f" (diferencia {r['diferencia_monto']:+,.2f}, tolerancia {r['tolerancia_monto']:,.2f})"
+    else:
+        tipo_coincidencia = "❌ NO CRUZADO"
+        if r.get('interno'):
+            mensaje_cruce = f"Fila {r.get('fila_interno', '?')} de {sheet_names[1]}: No tiene coincidencia"
+        else:
+            mensaje_cruce = f"Fila {r.get('fila_banco', '?')} de {hoja}: No tiene coincidencia"
+    return tipo_coincidencia, mensaje_cruce
+
+
+def account_name(r, sheet_names):
+    """Hoja de cuenta de la fila de data1 de un resultado ('' si solo tiene fila de data2)"""
+    if r.get('fila_banco') is None:
+        return ''
+    return r['banco'].get('origen') or sheet_names[0]
+
+
+def result_headers(sheet_names, accounts=False):
+    """Encabezados de la hoja de resultados (con accounts=True, más la columna Cuenta)"""
+    headers = [
+        'Estado', 'Tipo', 'Cruza',
+        f'Fila {sheet_names[0]}', f'Fecha {sheet_names[0]}', f'PV {sheet_names[0]}', f'Monto {sheet_names[0]}',
+        f'Fila {sheet_names[1]}', f'Fecha {sheet_names[1]}', f'PV {sheet_names[1]}', f'Monto {sheet_names[1]}',
+        'Diferencia Monto', 'Grupo Agregado'
+    ]
+    if accounts:
+        headers.append('Cuenta')
+    return headers
+
+
+def match_difference(r):
+    """Diferencia de monto de un resultado (valor absoluto)
+
+    En un cruce por agregados cada fila del banco se compara con la suma del grupo
+    (diferencia_monto), no con cada parte por separado.
+    """
+    interno = r.get('interno')
+    if not interno:
+        return 0
+    if r.get('grupo_agregado') is not None:
+        return abs(r['diferencia_monto'] or 0.0)
+    return abs((r['banco'].get('monto', 0) or 0) - (interno.get('monto', 0) or 0))
+
+
+def result_row(r, sheet_names, accounts=False):
+    """Valores de una fila de la hoja de resultados (montos como números)"""
+    banco = r['banco']
+    interno = r.get('interno')
+    tipo_coincidencia, mensaje_cruce = describe_match(r, sheet_names, accounts)
+    row = [
+        r['estado'],
+        tipo_coincidencia,
+        mensaje_cruce,
+        r.get('fila_banco', '-'),
+        banco.get('fecha', '-'),
+        banco.get('referencia', '-'),
+        banco.get('monto', 0) if banco.get('monto') else None,
+        r.get('fila_interno', '-'),
+        interno.get('fecha', '-') if interno else '-',
+        interno.get('referencia', '-') if interno else '-',
+        interno.get('monto', 0) if interno and interno.get('monto') else None,
+        match_difference(r),
+        r.get('grupo_agregado')
+    ]
+    if accounts:
+        row.append(account_name(r, sheet_names))
+    return row
+
+
+# Filas de una hoja de Excel (incluido el encabezado)
+EXCEL_MAX_ROWS = 1048576
+
+# Estilos con nombre: se registran una vez por libro y cada celda solo referencia el nombre,
+# en lugar de crear Font/PatternFill/Border/Alignment nuevos por celda. Las celdas sin fuente
+# propia usan la del libro (DEFAULT_FONT), igual que una celda sin estilo
+_THIN = Side(style='thin')
+_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+_CENTER = Alignment(horizontal='center', vertical='center')
+_RIGHT = Alignment(horizontal='right', vertical='center')
+
+
+def _solid(color):
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+
+def export_styles():
+    """Estilos con nombre de la exportación (hoja de resultados y hojas originales)"""
+    return [
+        NamedStyle('conc_encabezado', font=Font(bold=True, color="FFFFFF", size=11), fill=_solid("366092"),
+                   border=_BORDER, alignment=_CENTER),
+        NamedStyle('conc_celda', font=DEFAULT_FONT, border=_BORDER),
+        NamedStyle('conc_conciliado', font=DEFAULT_FONT, fill=_solid("C6EFCE"), border=_BORDER),
+        NamedStyle('conc_no_conciliado', font=DEFAULT_FONT, fill=_solid("FFC7CE"), border=_BORDER),
+        NamedStyle('conc_monto', font=DEFAULT_FONT, border=_BORDER, alignment=_RIGHT, number_format='#,##0.00'),
+        NamedStyle('conc_fecha', font=DEFAULT_FONT, border=_BORDER, alignment=_CENTER, number_format='dd/mm/yyyy'),
+        NamedStyle('conc_centrado', font=DEFAULT_FONT, border=_BORDER, alignment=_CENTER),
+        NamedStyle('orig_encabezado', font=Font(bold=True, size=11), fill=_solid("D3D3D3"), border=_BORDER),
+        NamedStyle('orig_encabezado_cruce', font=Font(bold=True, size=11), fill=_solid("D3D3D3"),
+                   border=_BORDER, alignment=_CENTER),
+        NamedStyle('orig_celda', font=DEFAULT_FONT, border=_BORDER),
+        NamedStyle('orig_fecha', font=DEFAULT_FONT, border=_BORDER, number_format='dd/mm/yyyy'),
+        NamedStyle('orig_numero', font=DEFAULT_FONT, border=_BORDER, alignment=_RIGHT, number_format='#,##0.00'),
+        NamedStyle('orig_ok', font=Font(bold=True, color="006100"), fill=_solid("C6EFCE"),
+                   border=_BORDER, alignment=_CENTER),
+        NamedStyle('orig_no_cruza', font=Font(bold=True, color="9C0006"), fill=_solid("FFC7CE"),
+                   border=_BORDER, alignment=_CENTER),
+    ]
+
+
+def _register_styles(wb):
+    for style in export_styles():
+        if style.name not in wb.named_styles:
+            wb.add_named_style(style)
+
+
+def new_workbook(write_only=False):
+    """Libro para la exportación con los estilos registrados
+
+    Con write_only=True las filas se escriben en streaming a un archivo
+    temporal a medida que se agregan (memoria acotada sin importar el número
+    de filas); las hojas se llenan una vez cada una y en orden.
+    """
+    wb = Workbook(write_only=write_only)
+    _register_styles(wb)
+    return wb
+
+
+def _write_sheet(ws, rows):
+    """Escribe filas de pares (valor, estilo) en una hoja normal o de solo escritura
+
+    El estilo va antes que el valor para que openpyxl conserve su formato
+    automático en fechas sueltas de columnas que no son de fecha.
+    """
+    if ws.parent.write_only:
+        for row in rows:
+            cells = []
+            for value, style in row:
+                cell = WriteOnlyCell(ws)
+                cell.style = style
+                cell.value = value
+                cells.append(cell)
+            ws.append(cells)
+    else:
+        for r_idx, row in enumerate(rows, 1):
+            for c_idx, (value, style) in enumerate(row, 1):
+                cell = ws.cell(row=r_idx, column=c_idx)
+                cell.style = style
+                cell.value = value
+
+
+def _date_parser():
+    """pd.to_datetime memoizado por valor (las fechas se repiten mucho); None si no se puede convertir"""
+    cache = {}
+    def parse(value):
+        if value not in cache:
+            try:
+                cache[value] = pd.to_datetime(value)
+            except:
+                cache[value] = None
+        return cache[value]
+    return parse
+
+
+def _result_rows(results, sheet_names, accounts=False):
+    """Filas (valor, estilo) de la hoja de resultados, empezando por el encabezado"""
+    yield [(header, 'conc_encabezado') for header in result_headers(sheet_names, accounts)]
+    parse_date = _date_parser()
+    for r in results:
+        row = []
+        for col_idx, value in enumerate(result_row(r, sheet_names, accounts), 1):
+            style = 'conc_celda'
+            if col_idx == 1:  # Estado
+                style = 'conc_conciliado' if value == 'Conciliado' else 'conc_no_conciliado'
+            elif col_idx in (7, 11, 12):  # Montos
+                if value is not None and isinstance(value, (int, float)) and value != 0:
+                    style = 'conc_monto'
+            elif col_idx in (5, 9):  # Fechas
+                if value and value != '-':
+                    date_val = parse_date(value)
+                    if date_val is not None:
+                        value = date_val
+                        style = 'conc_fecha'
+                    else:
+                        style = 'conc_centrado'
+            elif col_idx in (4, 8):  # Números de fila
+                if value != '-':
+                    style = 'conc_centrado'
+            elif col_idx == 13:  # Grupo agregado
+                if value is not None:
+                    style = 'conc_centrado'
+            row.append((value, style))
+        yield row
+
+
+def _fill_results_sheet(ws, results, sheet_names, accounts=False):
+    """Llena la hoja de resultados (anchos, paneles y filas)"""
+    # Anchos y paneles antes de las filas: en modo solo escritura se escriben al empezar la hoja
+    column_widths = {
+        'A': 12,  # Estado
+        'B': 15,  # Tipo
+        'C': 50,  # Cruza
+        'D': 12,  # Fila 1
+        'E': 12,  # Fecha 1
+        'F': 12,  # PV 1
+        'G': 15,  # Monto 1
+        'H': 12,  # Fila 2
+        'I': 12,  # Fecha 2
+        'J': 12,  # PV 2
+        'K': 15,  # Monto 2
+        'L': 15,  # Diferencia
+        'M': 10   # Grupo agregado
+    }
+    if accounts:
+        column_widths['N'] = 20  # Cuenta
+    for col_letter, width in column_widths.items():
+        ws.column_dimensions[col_letter].width = width
+    # Congelar primera fila
+    ws.freeze_panes = 'A2'
+
+    _write_sheet(ws, _result_rows(results, sheet_names, accounts))
+
+
+def create_excel_with_format(results, sheet_names, write_only=False, max_rows=EXCEL_MAX_ROWS, accounts=False):
+    """Crea Excel preservando formatos originales
+
+    Con write_only=True el libro es de solo escritura (ver new_workbook): las
+    hojas originales se agregan después con add_original_sheets y se guarda con wb.save.
+    Si los resultados no caben en una hoja (max_rows incluye el encabezado) se
+    reparten en "Conciliación", "Conciliación (2)", ... Con accounts=True (cruce
+    contra varias hojas de cuentas) se agrega la columna Cuenta.
+    """
+    wb = new_workbook(write_only)
+    per_sheet = max_rows - 1
+    chunks = [results[start:start + per_sheet] for start in range(0, len(results), per_sheet)] or [results]
+    for n, chunk in enumerate(chunks, 1):
+        title = "Conciliación" if n == 1 else f"Conciliación ({n})"
+        if n == 1 and not write_only:
+            ws = wb.active
+            ws.title = title
+        else:
+            ws = wb.create_sheet(title)
+        _fill_results_sheet(ws, chunk, sheet_names, accounts)
+    return wb
+
+
+def matched_rows(results):
+    """Filas (base 1, como en Excel) que cruzaron en cada lado"""
+    filas_banco_cruzadas = set()
+    filas_interno_cruzadas = set()
+    for r in results:
+        if r['estado'] == 'Conciliado':
+            if r.get('fila_banco'):
+                filas_banco_cruzadas.add(r['fila_banco'])
+            if r.get('fila_interno'):
+                filas_interno_cruzadas.add(r['fila_interno'])
+    return filas_banco_cruzadas, filas_interno_cruzadas
+
+
+def _original_columns(df):
+    """Valores y estilo de cada columna de una hoja original
+
+    El tipo de la columna se mira una sola vez: las de fecha llevan formato de
+    fecha y las numéricas formato numérico salvo en las celdas vacías.
+    """
+    columns = []
+    for c_idx in range(len(df.columns)):
+        series = df.iloc[:, c_idx]
+        values = series.astype(object).to_numpy()
+        if pd.api.types.is_datetime64_any_dtype(series):
+            styles = ['orig_fecha'] * len(values)
+        elif pd.api.types.is_numeric_dtype(series):
+            styles = np.where(series.isna().to_numpy(), 'orig_celda', 'orig_numero').tolist()
+        else:
+            styles = ['orig_celda'] * len(values)
+        columns.append(zip(values, styles))
+    return columns
+
+
+def _original_rows(df, filas_cruzadas):
+    """Filas (valor, estilo) de una hoja original con la columna "Cruce" al final"""
+    yield [(col_name, 'orig_encabezado') for col_name in df.columns] + [("Cruce", 'orig_encabezado_cruce')]
+
+    # El índice del DataFrame original es 0-based: la fila en Excel es índice + 2
+    # (1 para encabezado + 1 porque Excel empieza en 1)
+    cruce = [("OK", 'orig_ok') if (int(df_idx) + 2 if isinstance(df_idx, (int, float)) else r_idx) in filas_cruzadas
+             else ("NO CRUZA", 'orig_no_cruza')
+             for r_idx, df_idx in enumerate(df.index, 2)]
+    for row in zip(*_original_columns(df), cruce):
+        yield row
+
+
+def add_original_sheet(wb, df, sheet_name, filas_cruzadas):
+    """Agrega una hoja con los datos originales y la columna "Cruce" (OK / NO CRUZA)"""
+    _register_styles(wb)
+    # Limpiar nombre de hoja (máximo 31 caracteres, sin caracteres inválidos)
+    title = f"Original_{sheet_name}"[:31].replace('/', '_').replace('\\', '_').replace('?', '_').replace('*', '_').replace('[', '_').replace(']', '_')
+    ws = wb.create_sheet(title=title)
+
+    # Ajustar ancho de columnas
+    for c_idx, col_name in enumerate(df.columns, 1):
+        col_letter = get_column_letter(c_idx)
+        ws.column_dimensions[col_letter].width = max(len(str(col_name)), 12)
+    # Ajustar ancho de columna Cruce
+    col_letter_cruce = get_column_letter(len(df.columns) + 1)
+    ws.column_dimensions[col_letter_cruce].width = 12
+
+    _write_sheet(ws, _original_rows(df, filas_cruzadas))
+    return ws
+
+
+def add_original_sheets(wb, results, sheet_names, original_files_data):
+    """Agrega las hojas originales de ambos lados (si están en original_files_data)"""
+    filas_banco_cruzadas, filas_interno_cruzadas = matched_rows(results)
+    if 'original_df1' in original_files_data:
+        add_original_sheet(wb, original_files_data['original_df1'], sheet_names[0], filas_banco_cruzadas)
+    if 'original_df2' in original_files_data:
+        add_original_sheet(wb, original_files_data['original_df2'], sheet_names[1], filas_interno_cruzadas)
+
+
+def has_macros(content):
+    """True si los bytes son un libro con macros (.xlsm: incluye xl/vbaProject.bin)"""
+    try:
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            return 'xl/vbaProject.bin' in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+def _mark_sheet(ws, filas_cruzadas):
+    """Agrega la columna "Cruce" a la derecha de la última columna con datos de una hoja existente"""
+    last_column = 0
+    for row in ws.iter_rows(values_only=True):
+        used = [c_idx for c_idx, value in enumerate(row, 1) if value is not None and value != '']
+        if used:
+            last_column = max(last_column, used[-1])
+    column = last_column + 1
+
+    header = ws.cell(row=1, column=column)
+    header.style = 'orig_encabezado_cruce'
+    header.value = "Cruce"
+    # Solo se tocan las celdas de la columna nueva en las filas con datos
+    for r_idx, row in enumerate(ws.iter_rows(min_row=2, max_col=last_column or 1, values_only=True), 2):
+        if all(value is None or value == '' for value in row):
+            continue
+        cell = ws.cell(row=r_idx, column=column)
+        if r_idx in filas_cruzadas:
+            cell.style = 'orig_ok'
+            cell.value = "OK"
+        else:
+            cell.style = 'orig_no_cruza'
+            cell.value = "NO CRUZA"
+    ws.column_dimensions[get_column_letter(column)].width = 12
+
+
+def mark_original_workbook(content, marks, results=None, sheet_names=None, keep_vba=None):
+    """Copia del libro subido con la columna "Cruce" agregada en sus propias hojas
+
+    En lugar de reconstruir las hojas desde los DataFrames, abre el libro
+    (bytes) una vez y agrega en cada hoja de marks ({nombre o posición de la
+    hoja: filas cruzadas}) la columna "Cruce" con OK / NO CRUZA en cada fila
+    con datos. Formatos, fórmulas y anchos del usuario quedan como estaban.
+    Los libros con macros se abren con keep_vba (por defecto se detecta del
+    contenido). Con results se agrega al final la hoja "Conciliación".
+    Devuelve los bytes del libro guardado.
+    """
+    if keep_vba is None:
+        keep_vba = has_macros(content)
+    wb = load_workbook(BytesIO(content), keep_vba=keep_vba)
+    _register_styles(wb)
+    for sheet, filas_cruzadas in marks.items():
+        _mark_sheet(wb.worksheets[sheet] if isinstance(sheet, int) else wb[sheet], filas_cruzadas)
+    if results is not None:
+        _fill_results_sheet(wb.create_sheet("Conciliación"), results, sheet_names)
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def mark_original_workbooks(results, sheet_names, workbooks):
+    """Marca cada libro original: workbooks es [(contenido, [(hoja, lado)])], lado 0 (banco) o 1 (interno)
+
+    Si ambas hojas vienen del mismo libro van en una sola copia. Devuelve la
+    lista de bytes en el mismo orden.
+    """
+    filas = matched_rows(results)
+    return [mark_original_workbook(content, {sheet: filas[side] for sheet, side in sheets}, results, sheet_names)
+            for content, sheets in workbooks]
+
+
+def results_frame(results, sheet_names, accounts=False):
+    """Resultados como DataFrame plano (mismas columnas que la hoja de resultados)"""
+    headers = result_headers(sheet_names, accounts)
+    frame = pd.DataFrame([result_row(r, sheet_names, accounts) for r in results], columns=headers)
+    # Números de fila y grupo enteros aunque falten en las filas sin contraparte
+    for column in (headers[3], headers[7], headers[12]):
+        frame[column] = frame[column].astype('Int64')
+    return frame
+
+
+def write_results_csv(results, sheet_names, path):
+    """Escribe los resultados como CSV plano (mismas columnas que la hoja de resultados)"""
+    results_frame(results, sheet_names).to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def write_results_parquet(results, sheet_names, path):
+    """Escribe los resultados como Parquet (requiere pyarrow o fastparquet)"""
+    frame = results_frame(results, sheet_names)
+    # Columnas de texto con mezcla de tipos ("-" junto a números o fechas): todo como texto
+    for column in frame.columns[frame.dtypes == object]:
+        frame[column] = frame[column].map(lambda value: None if value is None else str(value))
+    frame.to_parquet(path, index=False)
+
+
+def _write_shard(task):
+    """Escribe un libro de resultados (tarea picklable para ProcessPoolExecutor)"""
+    results, sheet_names, path = task
+    create_excel_with_format(results, sheet_names, write_only=True).save(path)
+    return path
+
+
+def write_results_sharded(results, sheet_names, path, rows_per_workbook=EXCEL_MAX_ROWS - 1, workers=None,
+                          original_files_data=None):
+    """Reparte los resultados en varios libros de hasta rows_per_workbook filas, comprimidos en el zip path
+
+    Para resultados que superan el límite de filas de Excel. Cada libro
+    (conciliacion_001.xlsx, ...) se escribe en su propio proceso, hasta
+    workers a la vez (por defecto uno por CPU). Mientras tanto el proceso
+    actual escribe originales.xlsx con las hojas originales, si vienen en
+    original_files_data. Devuelve los nombres de los archivos dentro del zip.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        tasks = [(results[start:start + rows_per_workbook], sheet_names,
+                  os.path.join(directory, f"conciliacion_{n:03d}.xlsx"))
+                 for n, start in enumerate(range(0, len(results), rows_per_workbook), 1)]
+        if not tasks:
+            tasks = [(results, sheet_names, os.path.join(directory, "conciliacion_001.xlsx"))]
+        paths = [task[2] for task in tasks]
+
+        if workers == 1 or len(tasks) == 1:
+            for task in tasks:
+                _write_shard(task)
+            pending = []
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            pending = [pool.submit(_write_shard, task) for task in tasks]
+        try:
+            if original_files_data and ('original_df1' in original_files_data or 'original_df2' in original_files_data):
+                wb = new_workbook(write_only=True)
+                add_original_sheets(wb, results, sheet_names, original_files_data)
+                paths.append(os.path.join(directory, "originales.xlsx"))
+                wb.save(paths[-1])
+            for future in pending:
+                future.result()
+        finally:
+            if pending:
+                pool.shutdown()
+
+        # Los xlsx ya vienen comprimidos: se guardan sin volver a comprimir
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+            for shard in paths:
+                archive.write(shard, arcname=os.path.basename(shard))
+    return [os.path.basename(shard) for shard in paths]